@@ -7,42 +7,33 @@
  * @copyright Copyright (c) 2022
 """
 
-import os
-import sys
-import jwt
-import json
 from flask import Flask, jsonify, request, abort
-from server.state.state import StateMachine
-from server.user.user_manage import UserManage
-from server.util.GrammarException import GrammarException
-from server.util.LoginExcepiton import LoginException
+from controller import create_controller
 
 app = Flask(__name__)
-try:
-    current_path = os.path.split(os.path.realpath(__file__))[0]
-    user_manage = UserManage("secret")
-    state_machine = StateMachine("grammar.txt", os.path.join(current_path, "dsl.db"))
-except GrammarException as err:
-    print(" ".join(err.context))
-    print("GrammarException: ", err.msg)
-    sys.exit(1)
-except (FileNotFoundError, json.JSONDecodeError, KeyError):
-    print("Error with config.json or file not found")
-    sys.exit(1)
+controller = create_controller()
+
+
+def reply(result: tuple):
+    """把控制器的返回值转换为Flask响应，状态码不为200时中止请求。"""
+    body, status = result
+    if body is None:
+        abort(status)
+    return jsonify(body), status
 
 
 @app.route('/')
 def connect():
     """一个新的客户端连接到服务器时，请求一个token。
 
-    :return: 返回一个消息列表和token，格式为：{"msg": ["xxx", "xxx"], "token": "xxx"}。
+    :return: 返回一个消息列表、token和是否由服务器推送超时消息，格式为：{"msg": ["xxx", "xxx"], "token": "xxx", "push": false}。
     :status 200: 成功建立会话。
 
     一个客户端与服务器建立连接时，或者客户端开始一个新的会话时，从此路由获取一个token。
     服务器默认分配一个访客账户，如果设置了默认的问候消息，还会返回消息列表。
+    ``push`` 为true时服务器计算闲置时间，客户端通过 /poll 接收超时消息，不需要定时发送 /echo。
     """
-    user, token = user_manage.connect()
-    return jsonify({"msg": state_machine.speak(user.state), "token": token}), 200
+    return reply(controller.connect())
 
 
 @app.route('/send')
@@ -58,21 +49,10 @@ def send():
     一个客户端通过此路由向服务器发送一条消息。
     收到消息后，服务器首先对token进行鉴权，之后对消息进行处理并产生响应，返回一个消息列表。
     如果服务器需要终止一个会话，则设 exit 为1，该token立即过期，客户端需要重新开启一个会话。
+    无状态访客的状态保存在token中，响应中带有新的token，格式为：{"msg": [...], "exit": false, "token": "xxx"}，
+    客户端之后使用新的token。
     """
-    try:
-        msg = request.args["msg"]
-        token = request.args["token"]
-        user = user_manage.jwt_decode(token)
-        response = state_machine.state_transform(user.state, msg)
-        if user.state.state == -1:
-            user_manage.timeout(user.username)
-        return jsonify({"msg": response, "exit": user.state.state == -1}), 200
-    except KeyError:
-        abort(400)
-    except jwt.InvalidTokenError:
-        abort(403)
-    except LoginException:
-        abort(401)
+    return reply(controller.send(request.args))
 
 
 @app.route('/echo')
@@ -92,21 +72,63 @@ def echo():
     收到echo后，服务器首先对token进行鉴权，之后依照闲置时间进行处理并产生响应，返回一个消息列表。
     如果服务器需要终止一个会话，则设 ``exit`` 为1，该token立即过期，客户端需要重新开启一个会话。
     如果服务器要求客户端重置闲置时间计时器，则设 ``reset`` 为1，客户端应当重启计时器。
+    无状态访客的响应中带有新的token，与 /send 相同。
+    """
+    return reply(controller.echo(request.args))
+
+
+@app.route('/batch', methods=["POST"])
+def batch():
+    """
+    批量处理多个会话的消息和闲置时间报告。
+    :param: JSON数组，每项为 {"token": "xxx", "msg": "xxx"} 或者 {"token": "xxx", "seconds": 5}，最多 MAX_BATCH 项。
+    :return: 与请求顺序相同的结果数组，格式为：{"results": [{"status": 200, "msg": [...], "exit": false}, ...]}，
+        每项的内容与 /send、/echo 的响应相同，失败的项只有 ``status``。
+    :status 200: 请求格式正确，各项的状态码见 ``status``。
+    :status 400: 请求不是JSON数组。
+    :status 413: 项数超过 MAX_BATCH。
+
+    供代理大量终端用户的网关使用，一次请求代替多次 /send、/echo。
+    各项按token分组，每个token只鉴权一次，同一会话的项按请求中的顺序执行。
+    会话结束后同一会话之后的项返回403；无状态访客的每项结果带有新的token。
+    """
+    return reply(controller.batch(request.get_json(silent=True)))
+
+
+@app.route('/job', methods=["POST"])
+def job():
+    """
+    在服务进程中批量更新全部用户的变量，供管理员使用。
+    :param: JSON对象，格式为：{"key": "xxx", "variable": "billing", "op": "Add", "value": "0.5", "where": "billing > 0"}，
+        ``where`` 和每个事务的行数 ``chunk`` 可选。
+    :return: 任务统计，格式为：{"rows": 10, "seconds": 0.1, "rows_per_second": 100.0, "max_lock_seconds": 0.01}。
+    :status 200: 任务完成。
+    :status 400: 请求格式有误，或者变量不存在、类型不符。
+    :status 403: 密钥错误。
+    :status 404: 服务器没有设置管理密钥（DSL_ADMIN_KEY）。
+
+    与命令行 ``python -m server.state.jobs`` 相同的批量更新，在服务运行时执行，
+    任务完成后丢弃在线会话的变量缓存，已登录的会话不会继续使用旧值。
+    """
+    return reply(controller.job(request.get_json(silent=True)))
+
+
+@app.route('/poll')
+def poll():
+    """
+    长轮询，客户端等待服务器推送的超时消息。
+    :param: 客户端发送token和最长等待秒数，格式为：{"token": "xxx", "timeout": 25}。
+    :return: 返回一个消息列表、是否结束会话的标志和是否转移到新状态的标志，格式与 /echo 相同：
+        {"msg": ["xxx", "xxx"], "exit": false, "reset": false}。
+    :status 200: 鉴权成功，有新消息或者等待超时，超时时消息列表为空。
+    :status 400: 客户端请求消息格式有误。
+    :status 403: 鉴权失败。
+    :status 404: 服务器没有开启推送（DSL_PUSH）。
+
+    服务器计算每个会话的闲置时间，到达Wait分支的时间时执行超时转移，回复放入会话的发件箱。
+    客户端在收到响应后立即发起下一次请求。如果 ``exit`` 为1，会话已经结束，该token过期。
     """
-    try:
-        seconds = int(request.args["seconds"])
-        token = request.args["token"]
-        user = user_manage.jwt_decode(token)
-        response, exit_, reset_timer = state_machine.timeout_transform(user.state, seconds)
-        if exit_:
-            user_manage.timeout(user.username)
-        return jsonify({"msg": response, "exit": exit_, "reset": reset_timer}), 200
-    except (KeyError, ValueError):
-        abort(400)
-    except jwt.InvalidTokenError:
-        abort(403)
-    except LoginException:
-        abort(401)
+    return reply(controller.poll(request.args))
 
 
 @app.route('/login')
@@ -122,17 +144,7 @@ def login():
     收到请求后，服务器首先对token进行鉴权，之后验证用户名和密码，如果验证通过，则返回一个新的token。
     原有的token立即过期，客户端需要使用新的token继续会话。
     """
-    try:
-        username = request.args["username"]
-        passwd = request.args["password"]
-        token = request.args["token"]
-        user = user_manage.jwt_decode(token)
-        new_token = user_manage.login(user, username, passwd, state_machine.db)
-        return jsonify({"token": new_token}), 200
-    except jwt.InvalidTokenError:
-        abort(403)
-    except KeyError:
-        abort(400)
+    return reply(controller.login(request.args))
 
 
 @app.route('/register')
@@ -150,18 +162,9 @@ def register():
     收到请求后，服务器首先对token进行鉴权，之后验证用户名是否合法，如果验证通过，则返回一个新的token。
     原有的token立即过期，客户端需要使用新的token继续会话。
     """
-    try:
-        username = request.args["username"]
-        passwd = request.args["password"]
-        token = request.args["token"]
-        user = user_manage.jwt_decode(token)
-        new_token = user_manage.register(user, username, passwd, state_machine.db)
-        return jsonify({"token": new_token}), 200
-    except jwt.InvalidTokenError:
-        abort(403)
-    except KeyError:
-        abort(400)
+    return reply(controller.register(request.args))
 
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=8888, debug=True, threaded=False)
+    # 推送模式下 /poll 会占用请求线程等待，单线程时一个长轮询会阻塞其他全部请求
+    app.run(host='127.0.0.1', port=8888, debug=True, threaded=controller.user_manage.idle is not None)
@@ -0,0 +1,430 @@
+"""
+ * @file async_app.py
+ * @author LinZhi
+ * @brief 异步服务器
+        基于asyncio的HTTP/1.1服务器，路由和JSON格式与 app.py 相同，
+        阻塞的状态机和数据库操作在有界线程池中执行，空闲的长连接和长轮询请求只占用协程
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from threading import Event, Thread
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import jwt
+
+import rfc6455
+from controller import Controller, create_controller
+
+WORKERS = 8  # 执行阻塞操作的线程数
+QUEUE = 256  # 最多同时提交到线程池的请求数，超过时请求在协程中排队
+KEEP_ALIVE = 300.0  # 空闲连接保持的秒数
+MAX_HEADERS = 100
+MAX_BODY = 1 << 20
+
+
+class LoopEvent(object):
+    """
+    唤醒协程的等待对象，接口与 ``threading.Event`` 的 ``set`` 相同，可以交给 ``IdleScheduler.wait``。
+    ``set`` 可以在任何线程中调用。
+
+    :ivar loop: 协程所在的事件循环。
+    :ivar future: 被唤醒时完成的Future。
+    """
+
+    __slots__ = ("loop", "future")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.wake)
+        except RuntimeError:  # 服务器已经停止，事件循环已经关闭
+            pass
+
+    def wake(self) -> None:
+        if not self.future.done():  # 等待可能已经超时
+            self.future.set_result(None)
+
+
+class WebSocketSession(object):
+    """
+    WebSocket连接上的一个会话。
+    token只在建立连接时鉴权一次，之后每帧一个JSON对象：客户端的帧 ``route`` 为 /send、/echo、/login、/register 之一，
+    其余字段与HTTP请求参数相同但不带token；服务器的帧为对应路由的响应内容加上 ``route`` 和 ``status``，
+    失败时只有这两项。服务器开启推送时，超时消息以 ``route`` 为 /poll 的帧在产生时发送。
+    响应中带有新的token（登录、注册、无状态访客）时连接改用新的token。会话结束或者鉴权失败时服务器关闭连接，
+    客户端关闭连接不结束会话，之后可以用同一个token重新连接。
+
+    :ivar server: 异步服务器。
+    :ivar reader: 连接的读取端。
+    :ivar writer: 连接的写入端。
+    :ivar token: 当前的token。
+    :ivar pusher: 等待推送消息的任务。
+    """
+
+    ROUTES = ("/send", "/echo", "/login", "/register")
+
+    def __init__(self, server: "AsyncServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 token: str) -> None:
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.token = token
+        self.pusher: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def send(self, route: str, status: int, body: Optional[dict] = None) -> None:
+        """发送一帧响应。"""
+        frame = dict(body) if body is not None else dict()
+        frame["route"] = route
+        frame["status"] = status
+        if not self.closed:
+            self.writer.write(rfc6455.encode(rfc6455.TEXT, json.dumps(frame).encode()))
+
+    def close(self, code: int) -> None:
+        """发送关闭帧，之后不再发送消息。"""
+        if not self.closed:
+            self.closed = True
+            self.writer.write(rfc6455.encode(rfc6455.CLOSE, rfc6455.close_payload(code)))
+
+    def update(self, body: Optional[dict]) -> None:
+        """响应中带有新的token时改用新的token，重新开始等待推送消息。"""
+        if body is not None and body.get("token") is not None and body["token"] != self.token:
+            self.token = body["token"]
+            self.start_push()
+
+    def start_push(self) -> None:
+        """开始或者重新开始等待推送消息。"""
+        if self.pusher is not None:
+            self.pusher.cancel()
+        self.pusher = None
+        if self.server.controller.user_manage.idle is not None:
+            self.pusher = asyncio.get_running_loop().create_task(self.push())
+
+    async def push(self) -> None:
+        """推送任务，与长轮询相同，消息在调度线程中产生时唤醒。"""
+        controller = self.server.controller
+        while not self.closed:
+            user, _, status = await self.server.call(controller.open_poll, {"token": self.token})
+            if status != 200:  # 会话不使用推送，或者会话已经结束
+                return
+            waiter = LoopEvent(asyncio.get_running_loop())
+            if not controller.user_manage.idle.wait(user, waiter):
+                await waiter.future
+            body, status = await self.server.call(controller.close_poll, user)
+            if len(body["msg"]) != 0 or body["exit"] or body["reset"]:
+                self.send("/poll", status, body)
+            if body["exit"]:
+                self.close(1000)
+                return
+            await self.writer.drain()
+
+    async def run(self) -> None:
+        """读取客户端的消息直到连接关闭。"""
+        self.start_push()
+        controller = self.server.controller
+        handlers = {"/send": controller.send, "/echo": controller.echo,
+                    "/login": controller.login, "/register": controller.register}
+        try:
+            while not self.closed:
+                text = await rfc6455.read_message(self.reader, self.writer)
+                if text is None:
+                    self.closed = True
+                    break
+                try:
+                    args = json.loads(text)
+                    route = args.pop("route")
+                    handler = handlers[route]
+                except (ValueError, KeyError, AttributeError, TypeError):
+                    self.send(None, 400)
+                    continue
+                args["token"] = self.token
+                try:
+                    body, status = await self.server.call(handler, args)
+                except Exception as err:  # 与HTTP请求相同，未处理的异常返回500，连接继续可用
+                    print("AsyncServer: ", err, file=sys.stderr)
+                    body, status = None, 500
+                self.server.requests += 1
+                self.update(body)
+                self.send(route, status, body)
+                if status == 403 or (body is not None and body.get("exit")):  # 会话已经结束
+                    self.close(1000 if status == 200 else 1008)
+                await self.writer.drain()
+        except rfc6455.ProtocolError:
+            self.close(1002)
+        finally:
+            if self.pusher is not None:
+                self.pusher.cancel()
+
+
+class AsyncServer(object):
+    """
+    异步HTTP服务器。
+    每个连接一个协程，支持HTTP/1.1长连接；请求交给 ``Controller`` 处理，控制器方法在线程池中执行，
+    同时提交的请求数不超过 ``QUEUE``，线程数量固定，与连接数量无关。
+    长轮询在协程中等待，闲置调度线程通过 ``LoopEvent`` 唤醒。
+    /ws 路径升级为WebSocket连接，由 ``WebSocketSession`` 处理。
+
+    :ivar controller: 路由逻辑。
+    :ivar executor: 执行控制器方法的线程池。
+    :ivar slots: 限制同时提交到线程池的请求数的信号量。
+    :ivar keep_alive: 空闲连接保持的秒数。
+    :ivar routes: 从路径映射到（请求方法，处理协程）的字典。
+    :ivar connections: 当前连接数。
+    :ivar requests: 处理过的请求数，包括WebSocket消息。
+    :ivar websockets: 当前WebSocket连接数。
+    """
+
+    def __init__(self, controller: Controller, workers: int = WORKERS, queue: int = QUEUE,
+                 keep_alive: float = KEEP_ALIVE) -> None:
+        """
+
+        :param controller: 路由逻辑。
+        :param workers: 线程池的线程数。
+        :param queue: 最多同时提交到线程池的请求数。
+        :param keep_alive: 空闲连接保持的秒数。
+        """
+        self.controller = controller
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dsl")
+        self.slots = asyncio.Semaphore(queue)
+        self.keep_alive = keep_alive
+        self.routes = {
+            "/": ("GET", lambda args, body: self.call(controller.connect)),
+            "/send": ("GET", lambda args, body: self.call(controller.send, args)),
+            "/echo": ("GET", lambda args, body: self.call(controller.echo, args)),
+            "/batch": ("POST", lambda args, body: self.call(self.post, controller.batch, body)),
+            "/job": ("POST", lambda args, body: self.call(self.post, controller.job, body)),
+            "/poll": ("GET", self.poll),
+            "/login": ("GET", lambda args, body: self.call(controller.login, args)),
+            "/register": ("GET", lambda args, body: self.call(controller.register, args)),
+        }
+        self.connections = 0
+        self.requests = 0
+        self.websockets = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.thread: Optional[Thread] = None
+
+    async def call(self, function, *args):
+        """在线程池中执行阻塞的函数。"""
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    @staticmethod
+    def post(handler, body: bytes) -> (Optional[dict], int):
+        """解析JSON请求体并调用控制器方法，在线程池中执行。"""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        return handler(data)
+
+    async def poll(self, args: dict, body: bytes) -> (Optional[dict], int):
+        """长轮询，鉴权和取消息在线程池中执行，等待只占用协程。"""
+        user, timeout, status = await self.call(self.controller.open_poll, args)
+        if status != 200:
+            return None, status
+        waiter = LoopEvent(asyncio.get_running_loop())
+        if not self.controller.user_manage.idle.wait(user, waiter):
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.call(self.controller.close_poll, user)
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> (Optional[dict], int):
+        """按路径调用处理协程。
+
+        :return: 响应内容和状态码。
+        """
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if route is None:
+            return None, 404
+        if method != route[0]:
+            return None, 405
+        try:
+            return await route[1](dict(parse_qsl(url.query, keep_blank_values=True)), body)
+        except Exception as err:  # 与Flask相同，未处理的异常返回500，连接继续可用
+            print("AsyncServer: ", err, file=sys.stderr)
+            return None, 500
+
+    @staticmethod
+    def response(status: int, body: Optional[dict], keep_alive: bool) -> bytes:
+        """编码HTTP响应，状态码不为200时响应体为状态描述。"""
+        phrase = HTTPStatus(status).phrase
+        if body is None:
+            data, content_type = f"{status} {phrase}".encode(), "text/plain; charset=utf-8"
+        else:
+            data, content_type = json.dumps(body).encode(), "application/json"
+        head = f"HTTP/1.1 {status} {phrase}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n" \
+               f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        return head.encode("latin-1") + data
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """连接的主循环，依次读取请求、处理并写回响应，直到客户端关闭连接或者空闲超时。"""
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.keep_alive)
+                except asyncio.TimeoutError:
+                    break
+                if len(line) == 0:
+                    break
+                parts = line.decode("latin-1").split()
+                if len(parts) != 3:
+                    writer.write(self.response(400, None, False))
+                    break
+                method, target, version = parts
+                headers = dict()
+                while len(headers) <= MAX_HEADERS:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(headers) > MAX_HEADERS or "transfer-encoding" in headers:  # 不支持分块传输
+                    writer.write(self.response(400, None, False))
+                    break
+                length = int(headers.get("content-length", "0"))
+                if length > MAX_BODY:
+                    writer.write(self.response(413, None, False))
+                    break
+                body = await reader.readexactly(length) if length > 0 else b""
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.websocket(target, headers, reader, writer)
+                    break
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                result, status = await self.dispatch(method, target, body)
+                self.requests += 1
+                writer.write(self.response(status, result, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):  # 客户端断开或者请求格式错误
+            pass
+        except asyncio.CancelledError:  # 服务器停止，连接正常结束
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def websocket(self, target: str, headers: dict, reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> None:
+        """完成WebSocket握手并处理会话。
+
+        请求不带token时建立新的会话，第一帧为 / 路由的响应；带有token时先鉴权，失败时返回403，不升级连接。
+        """
+        url = urlsplit(target)
+        key = headers.get("sec-websocket-key")
+        if url.path != "/ws" or key is None or headers.get("sec-websocket-version") != "13":
+            writer.write(self.response(404 if url.path != "/ws" else 400, None, False))
+            return
+        token = dict(parse_qsl(url.query)).get("token")
+        greeting = None
+        if token is None:
+            greeting, _ = await self.call(self.controller.connect)
+            token = greeting["token"]
+        else:
+            try:
+                await self.call(self.controller.user_manage.jwt_decode, token)
+            except jwt.InvalidTokenError:
+                writer.write(self.response(403, None, False))
+                return
+        writer.write(rfc6455.handshake(key))
+        session = WebSocketSession(self, reader, writer, token)
+        self.websockets += 1
+        try:
+            if greeting is not None:
+                session.send("/", 200, greeting)
+            await session.run()
+            await writer.drain()
+        finally:
+            self.websockets -= 1
+
+    async def serve(self, host: str, port: int) -> None:
+        """在当前事件循环中运行服务器，直到被取消。"""
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """在后台线程中启动服务器。
+
+        :param host: 监听地址。
+        :param port: 监听端口，为0时由系统分配。
+        :return: 实际监听的端口。
+        """
+        ready = Event()
+
+        def run() -> None:
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+            ready.set()
+            self.loop.run_forever()
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        """停止后台线程中的服务器，关闭全部连接。"""
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+        self.executor.shutdown()
+
+    def stats(self) -> dict:
+        """服务器统计。
+
+        :return: 包含当前连接数 ``connections``、其中的WebSocket连接数 ``websockets``、
+            处理过的请求数 ``requests`` 的字典。
+        """
+        return {"connections": self.connections, "websockets": self.websockets, "requests": self.requests}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """命令行入口，环境变量与 app.py 相同。长轮询和WebSocket连接只占用协程，默认开启推送。
+
+    用法::
+
+        python async_app.py --port 5000 --workers 8
+    """
+    parser = argparse.ArgumentParser(prog="python async_app.py", description="异步服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=5000, help="监听端口")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="执行数据库操作的线程数")
+    parser.add_argument("--queue", type=int, default=QUEUE, help="最多同时提交到线程池的请求数")
+    parser.add_argument("--no-push", action="store_true", help="不推送超时消息，客户端定时发送 /echo")
+    args = parser.parse_args(argv)
+    server = AsyncServer(create_controller(push=not args.no_push), args.workers, args.queue)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
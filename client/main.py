@@ -8,17 +8,20 @@
  * @copyright Copyright (c) 2022
 """
 
+import os
 import sys
-from threading import Timer, Lock
+from threading import Thread, Timer, Lock
 import json.decoder
 from typing import Optional
 
 import requests
-from PyQt5.QtCore import QObject, pyqtProperty, pyqtSlot, pyqtSignal
+from PyQt5.QtCore import QObject, QTimer, QUrl, pyqtProperty, pyqtSlot, pyqtSignal
 from PyQt5.QtGui import QGuiApplication
 from PyQt5.QtQml import QQmlApplicationEngine, QQmlListProperty
 
 server_address = "http://127.0.0.1:5000"
+socket_address = "ws://127.0.0.1:5000/ws"
+use_websocket = bool(os.environ.get("DSL_WEBSOCKET"))  # 通过WebSocket与异步服务器 async_app.py 通信
 
 
 class Message(QObject):
@@ -51,6 +54,12 @@ class Client(QObject):
     :ivar logined: 是否已经登录。
     :ivar timer: 超时计时器，监测用户闲置时间。
     :ivar time_count: 用户闲置时间计数器。
+    :ivar push: 服务器是否推送超时消息，为True时通过 /poll 长轮询接收，不使用超时计时器。
+    :ivar session: 会话编号，每次建立连接时增加，旧会话的轮询线程随之退出。
+    :ivar socket: WebSocket模式下的连接，鉴权一次，之后消息和服务器推送的超时消息都通过它传输。
+    :ivar pending: WebSocket连接建立之前等待发送的帧。
+    :ivar greeted: 当前WebSocket连接是否已经收到问候消息。
+    :ivar socket_timer: WebSocket模式下服务器不推送时的超时计时器，在主线程中发送 /echo 帧。
     """
 
     def __init__(self, parent=None) -> None:
@@ -62,11 +71,26 @@ class Client(QObject):
         self.logined = False
         self.timer: Optional[Timer] = None
         self.time_count: Optional[int] = None
+        self.push = False
+        self.session = 0
+        self.socket: Optional["QWebSocket"] = None
+        self.pending: list[dict] = []
+        self.greeted = False
+        self.socket_timer: Optional[QTimer] = None
         self.connect()
 
     def __del__(self) -> None:
+        self.stop_timer()
+        self.session += 1  # 结束轮询线程
+        if self.socket is not None:
+            self.socket.close()
+
+    def stop_timer(self) -> None:
+        """停止超时计时器，推送模式下没有计时器。"""
         if self.timer is not None:
             self.timer.cancel()
+        if self.socket_timer is not None:
+            self.socket_timer.stop()
 
     message_changed = pyqtSignal()
 
@@ -93,6 +117,14 @@ class Client(QObject):
         发送请求
         :param msg: 请求信息
         """
+        if use_websocket:  # 响应在 socket_message 中处理
+            if len(msg.strip()) == 0:
+                return
+            self.append_message(Message(msg, 1))
+            with self.lock:
+                self.time_count = 0
+            self.socket_send({"route": "/send", "msg": msg})
+            return
         if self.token is None:
             self.connect()
             if self.token is None:
@@ -102,11 +134,12 @@ class Client(QObject):
             return
         self.append_message(Message(msg, 1))
 
-        with self.lock:  # 重设计时器
-            self.time_count = 0
-        self.timer.cancel()
-        self.timer = Timer(5, self.timeout)
-        self.timer.start()
+        if not self.push:
+            with self.lock:  # 重设计时器
+                self.time_count = 0
+            self.timer.cancel()
+            self.timer = Timer(5, self.timeout)
+            self.timer.start()
 
         try:
             # 向/send 发送get请求
@@ -118,10 +151,12 @@ class Client(QObject):
                 return
             elif r.status_code == 403:
                 self.append_message(Message("服务器拒绝请求，请重启客户端", 0))
-                self.timer.cancel()
+                self.stop_timer()
                 return
             elif r.status_code != 200:  # 其他错误
                 raise requests.exceptions.ConnectionError()
+            if r.json().get("token") is not None:  # 无状态访客每次请求后更新令牌
+                self.token = r.json().get("token")
             for msg in r.json().get("msg"):
                 self.append_message(Message(msg, 0))
             if r.json().get("exit"):
@@ -129,7 +164,7 @@ class Client(QObject):
                 self.append_message(Message("输入任意信息开始对话", 0))
                 self.token = None
                 self.logined = False
-                self.timer.cancel()
+                self.stop_timer()
         except requests.exceptions.ConnectionError:
             self.append_message(Message("服务器异常，请稍后重试", 0))
         except (KeyError, json.decoder.JSONDecodeError):
@@ -142,6 +177,9 @@ class Client(QObject):
         :param username: 用户名
         :param password: 密码
         """
+        if use_websocket:
+            self.socket_send({"route": "/login", "username": username, "password": password})
+            return
         if self.token is None:
             self.connect()
             if self.token is None:
@@ -154,7 +192,7 @@ class Client(QObject):
             )
             if r.status_code == 403:
                 self.append_message(Message("服务器拒绝请求，请重启客户端", 0))
-                self.timer.cancel()
+                self.stop_timer()
                 return
             elif r.status_code != 200:
                 raise requests.exceptions.ConnectionError()
@@ -175,6 +213,9 @@ class Client(QObject):
         :param username: 用户名
         :param password: 密码
         """
+        if use_websocket:
+            self.socket_send({"route": "/register", "username": username, "password": password})
+            return
         if self.token is None:
             self.connect()
             if self.token is None:
@@ -187,7 +228,7 @@ class Client(QObject):
             )
             if r.status_code == 403:
                 self.append_message(Message("服务器拒绝请求，请重启客户端", 0))
-                self.timer.cancel()
+                self.stop_timer()
                 return
             elif r.status_code != 200:
                 raise requests.exceptions.ConnectionError()
@@ -205,6 +246,9 @@ class Client(QObject):
         """
         与服务端建立连接
         """
+        if use_websocket:
+            self.open_socket()
+            return
         try:
             r = requests.get(server_address)
             if r.status_code != 200:
@@ -212,6 +256,11 @@ class Client(QObject):
             self.token = r.json().get("token")
             for msg in r.json().get("msg"):
                 self.append_message(Message(msg, 0))
+            self.session += 1
+            self.push = bool(r.json().get("push"))
+            if self.push:  # 服务器计算闲置时间，长轮询接收超时消息
+                Thread(target=self.poll, args=(self.session,), daemon=True).start()
+                return
             self.time_count = 0
             self.timer = Timer(5, self.timeout)
             self.timer.start()
@@ -239,13 +288,15 @@ class Client(QObject):
                 return
             elif r.status_code == 403:
                 self.append_message(Message("服务器拒绝请求，请重启客户端", 0))
-                self.timer.cancel()
+                self.stop_timer()
                 return
             elif r.status_code != 200:
                 raise requests.exceptions.ConnectionError()
             if r.json().get("reset"):
                 with self.lock:
                     self.time_count = 0
+            if r.json().get("token") is not None:  # 无状态访客每次请求后更新令牌
+                self.token = r.json().get("token")
             for msg in r.json().get("msg"):
                 self.append_message(Message(msg, 0))
             if r.json().get("exit"):
@@ -253,13 +304,153 @@ class Client(QObject):
                 self.append_message(Message("输入任意信息开始对话", 0))
                 self.token = None
                 self.logined = False
-                self.timer.cancel()
+                self.stop_timer()
         except requests.exceptions.ConnectionError:
             self.append_message(Message("服务器异常，请稍后重试", 0))
         except (KeyError, json.decoder.JSONDecodeError):
             self.append_message(Message("反馈消息异常，请稍后重试", 0))
 
 
+    def poll(self, session: int) -> None:
+        """
+        推送模式下的长轮询线程，接收服务器产生的超时消息
+        :param session: 会话编号，会话改变后线程退出
+        """
+        while self.session == session and self.token is not None:
+            try:
+                r = requests.get(
+                    server_address + "/poll",
+                    params={"token": self.token, "timeout": 25},
+                    timeout=35,
+                )
+                if self.session != session:
+                    return
+                if r.status_code == 403:  # 会话已经结束
+                    return
+                elif r.status_code != 200:
+                    raise requests.exceptions.ConnectionError()
+                for msg in r.json().get("msg"):
+                    self.append_message(Message(msg, 0))
+                if r.json().get("exit"):
+                    self.append_message(Message("退出成功！", 0))
+                    self.append_message(Message("输入任意信息开始对话", 0))
+                    self.token = None
+                    self.logined = False
+                    return
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.append_message(Message("服务器异常，请稍后重试", 0))
+                return
+            except (KeyError, json.decoder.JSONDecodeError):
+                self.append_message(Message("反馈消息异常，请稍后重试", 0))
+                return
+
+    def open_socket(self) -> None:
+        """
+        WebSocket模式下建立连接，服务器的第一帧带有token和问候消息
+        """
+        from PyQt5.QtWebSockets import QWebSocket  # 只在WebSocket模式下需要，部分PyQt5安装没有这个模块
+
+        socket = self.socket = QWebSocket()
+        self.greeted = False
+        socket.textMessageReceived.connect(self.socket_message)
+        socket.disconnected.connect(lambda: self.socket_closed(socket))
+        socket.error.connect(lambda error: self.socket_closed(socket))
+        socket.open(QUrl(socket_address))
+
+    def socket_send(self, frame: dict) -> None:
+        """
+        WebSocket模式下发送一帧，收到问候消息之前先放入等待队列
+        :param frame: 帧的内容，route 为路由，其余字段与HTTP请求参数相同，不带token
+        """
+        if self.socket is None:
+            self.open_socket()
+        if self.token is None:
+            self.pending.append(frame)
+            return
+        self.socket.sendTextMessage(json.dumps(frame))
+
+    def socket_message(self, text: str) -> None:
+        """
+        处理服务器发来的一帧，包括请求的响应和服务器推送的超时消息
+        :param text: 帧的内容
+        """
+        try:
+            data = json.loads(text)
+            route, status = data.get("route"), data.get("status")
+            if status == 401:
+                self.append_message(Message("需要登录，请点击右上角登录", 0))
+                return
+            elif status == 403:  # 服务器随后关闭连接
+                self.append_message(Message("服务器拒绝请求，请重启客户端", 0))
+                self.stop_timer()
+                return
+            elif status != 200:
+                raise KeyError()
+            if route == "/":  # 问候消息
+                self.greeted = True
+                self.token = data["token"]
+                for msg in data["msg"]:
+                    self.append_message(Message(msg, 0))
+                self.push = bool(data.get("push"))
+                if not self.push:
+                    self.time_count = 0
+                    self.socket_timer = QTimer(self)
+                    self.socket_timer.timeout.connect(self.socket_timeout)
+                    self.socket_timer.start(5000)
+                pending, self.pending = self.pending, []
+                for frame in pending:
+                    self.socket_send(frame)
+                return
+            if route in ("/login", "/register"):
+                login = route == "/login"
+                if data.get("token") is None:
+                    self.append_message(Message("登录失败，用户名或密码无效" if login else "注册失败，用户名冲突", 0))
+                    return
+                self.token = data["token"]
+                self.append_message(Message("登录成功！" if login else "注册并登录成功", 0))
+                return
+            if data.get("token") is not None:  # 无状态访客每次请求后更新令牌
+                self.token = data["token"]
+            if data.get("reset"):
+                with self.lock:
+                    self.time_count = 0
+            for msg in data["msg"]:
+                self.append_message(Message(msg, 0))
+            if data.get("exit"):  # 服务器随后关闭连接
+                self.append_message(Message("退出成功！", 0))
+                self.append_message(Message("输入任意信息开始对话", 0))
+                self.token = None
+                self.logined = False
+                self.stop_timer()
+        except (KeyError, TypeError, json.decoder.JSONDecodeError):
+            self.append_message(Message("反馈消息异常，请稍后重试", 0))
+
+    def socket_timeout(self) -> None:
+        """
+        WebSocket模式下服务器不推送时的闲置计时，在主线程中发送 /echo 帧
+        """
+        with self.lock:
+            self.time_count += 5
+        self.socket_send({"route": "/echo", "seconds": self.time_count})
+
+    def socket_closed(self, socket: "QWebSocket") -> None:
+        """
+        WebSocket连接关闭或者连接失败，会话结束后的关闭是正常的，否则提示服务器异常
+        :param socket: 关闭的连接，不是当前连接时忽略
+        """
+        if socket is not self.socket:
+            return
+        self.socket = None
+        socket.deleteLater()
+        self.stop_timer()
+        if not self.greeted or self.token is not None:
+            self.append_message(Message("服务器异常，请稍后重试", 0))
+            self.token = None
+            self.pending = []
+        elif len(self.pending) != 0:  # 会话结束后用户又发送了消息，建立新的会话
+            self.open_socket()
+
+
 if __name__ == "__main__":
     app = QGuiApplication(sys.argv)
     engine = QQmlApplicationEngine()
@@ -0,0 +1,328 @@
+"""
+ * @file controller.py
+ * @author LinZhi
+ * @brief 路由逻辑模块
+        Flask应用 app.py 和异步服务器 async_app.py 共用的请求处理逻辑
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import atexit
+import hmac
+import json
+import os
+import sys
+from threading import Event
+from typing import Optional
+
+import jwt
+
+from server.state.idle import IdleScheduler
+from server.state.jobs import CHUNK_SIZE, BulkUpdateJob
+from server.state.reload import ScriptReloader
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+from server.util.GrammarException import GrammarException
+from server.util.LoginExcepiton import LoginException
+
+MAX_BATCH = 1000  # /batch 一次请求的最大项数
+MAX_POLL = 60.0  # /poll 最长等待秒数
+
+
+class Controller(object):
+    """
+    路由逻辑。
+    每个方法对应一个路由，接收请求参数，返回（响应内容，状态码），状态码不为200时响应内容为None。
+    方法会阻塞在数据库操作上，异步服务器在线程池中调用；长轮询分为 ``open_poll`` 和 ``close_poll`` 两步，
+    两步之间的等待由调用者完成，Flask应用占用一个线程等待，异步服务器只占用一个协程。
+
+    :ivar user_manage: 用户管理对象。
+    :ivar state_machine: 启动时构建的状态机。
+    :ivar reloader: 热重载器，为None时不重载。
+    :ivar admin_key: 管理路由 /job 的密钥，为None时不提供管理路由。
+    """
+
+    def __init__(self, user_manage: UserManage, state_machine: StateMachine,
+                 reloader: Optional[ScriptReloader] = None, admin_key: Optional[str] = None) -> None:
+        """
+
+        :param user_manage: 用户管理对象。
+        :param state_machine: 状态机。
+        :param reloader: 热重载器。
+        :param admin_key: 管理路由的密钥。
+        """
+        self.user_manage = user_manage
+        self.state_machine = state_machine
+        self.reloader = reloader
+        self.admin_key = admin_key
+
+    def machine(self) -> StateMachine:
+        """当前使用的状态机。每个请求只获取一次，重载不影响正在处理的请求。"""
+        return self.reloader.machine if self.reloader is not None else self.state_machine
+
+    def handle_send(self, user, msg: str) -> dict:
+        """处理一条消息，/send 和 /batch 共用。
+
+        :param user: 已经鉴权的User对象。
+        :param msg: 消息。
+        :return: 响应内容。
+        :exception jwt.InvalidTokenError 会话已经结束
+        :exception LoginException 用户是访客，需要登录
+        """
+        user_manage = self.user_manage
+        with user_manage.turn(user):  # 状态机在取得执行权之后获取
+            if user.state.state == -1:  # 会话已经被Wait分支结束，等待客户端取走结束消息
+                user_manage.timeout(user.username)
+                raise jwt.InvalidTokenError
+            response = self.machine().state_transform(user.state, msg)
+            if user.state.state == -1:
+                user_manage.timeout(user.username)
+            elif user_manage.idle is not None:  # 只有客户端使用推送的会话重新计算闲置时间
+                user_manage.idle.touch(user)
+        result = {"msg": response, "exit": user.state.state == -1}
+        new_token = user_manage.reissue(user)
+        if new_token is not None:
+            result["token"] = new_token
+        return result
+
+    def handle_echo(self, user, seconds: int) -> dict:
+        """处理一条闲置时间报告，/echo 和 /batch 共用。
+
+        :param user: 已经鉴权的User对象。
+        :param seconds: 闲置秒数。
+        :return: 响应内容。
+        """
+        with self.user_manage.turn(user):
+            response, exit_, reset_timer = self.machine().timeout_transform(user.state, seconds)
+            if exit_:
+                self.user_manage.timeout(user.username)
+        result = {"msg": response, "exit": exit_, "reset": reset_timer}
+        new_token = self.user_manage.reissue(user)
+        if new_token is not None:
+            result["token"] = new_token
+        return result
+
+    def connect(self) -> (Optional[dict], int):
+        """建立会话，对应 / 路由。"""
+        user_manage = self.user_manage
+        user, token = user_manage.connect()
+        response = self.machine().speak(user.state)
+        push = user_manage.idle is not None and not user.stateless
+        if push:  # 无状态访客没有服务器端的会话，登录后也仍然使用 /echo
+            user_manage.idle.enroll(user)
+        return {"msg": response, "token": token, "push": push}, 200
+
+    def send(self, args) -> (Optional[dict], int):
+        """处理一条消息，对应 /send 路由。
+
+        :param args: 请求参数，包含 ``msg`` 和 ``token``。
+        """
+        try:
+            msg = args["msg"]
+            user = self.user_manage.jwt_decode(args["token"])
+            return self.handle_send(user, msg), 200
+        except KeyError:
+            return None, 400
+        except jwt.InvalidTokenError:
+            return None, 403
+        except LoginException:
+            return None, 401
+
+    def echo(self, args) -> (Optional[dict], int):
+        """处理一条闲置时间报告，对应 /echo 路由。
+
+        :param args: 请求参数，包含 ``seconds`` 和 ``token``。
+        """
+        try:
+            seconds = int(args["seconds"])
+            user = self.user_manage.jwt_decode(args["token"])
+            return self.handle_echo(user, seconds), 200
+        except (KeyError, ValueError):
+            return None, 400
+        except jwt.InvalidTokenError:
+            return None, 403
+        except LoginException:
+            return None, 401
+
+    def batch(self, items) -> (Optional[dict], int):
+        """批量处理多个会话的消息，对应 /batch 路由。
+
+        :param items: 请求体解析得到的JSON，数组或者 ``{"items": [...]}``。
+        """
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            return None, 400
+        if len(items) > MAX_BATCH:
+            return None, 413
+        results: list[Optional[dict]] = [None] * len(items)
+        groups: dict[str, list[int]] = dict()
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get("token"), str) or \
+                    (not isinstance(item.get("msg"), str) and not isinstance(item.get("seconds"), int)):
+                results[index] = {"status": 400}
+            else:
+                groups.setdefault(item["token"], []).append(index)
+        for token, indices in groups.items():
+            try:
+                user = self.user_manage.jwt_decode(token)
+            except jwt.InvalidTokenError:
+                for index in indices:
+                    results[index] = {"status": 403}
+                continue
+            exit_ = False
+            for index in indices:
+                item = items[index]
+                if exit_:  # 会话已经在本次请求中结束
+                    results[index] = {"status": 403}
+                    continue
+                try:
+                    if isinstance(item.get("msg"), str):
+                        result = self.handle_send(user, item["msg"])
+                    else:
+                        result = self.handle_echo(user, item["seconds"])
+                    result["status"] = 200
+                    exit_ = result["exit"]
+                except jwt.InvalidTokenError:
+                    result = {"status": 403}
+                except LoginException:
+                    result = {"status": 401}
+                results[index] = result
+        return {"results": results}, 200
+
+    def open_poll(self, args) -> (object, float, int):
+        """长轮询的第一步，鉴权并读取等待时间。
+
+        :param args: 请求参数，包含 ``token`` 和可选的 ``timeout``。
+        :return: User对象、最长等待秒数和状态码，状态码不为200时User对象为None。
+        """
+        if self.user_manage.idle is None:
+            return None, 0, 404
+        try:
+            timeout = min(float(args.get("timeout", "25")), MAX_POLL)
+            user = self.user_manage.jwt_decode(args["token"])
+        except (KeyError, ValueError):
+            return None, 0, 400
+        except jwt.InvalidTokenError:
+            return None, 0, 403
+        if not self.user_manage.idle.enrolled(user):  # 客户端没有被告知使用推送，例如无状态访客
+            return None, 0, 404
+        return user, timeout, 200
+
+    def close_poll(self, user) -> (Optional[dict], int):
+        """长轮询的第二步，取走会话发件箱中的消息。
+
+        :param user: ``open_poll`` 返回的User对象。
+        """
+        response, exit_, reset_timer = self.user_manage.idle.take(user)
+        if exit_:
+            self.user_manage.timeout(user.username)
+        return {"msg": response, "exit": exit_, "reset": reset_timer}, 200
+
+    def poll(self, args) -> (Optional[dict], int):
+        """长轮询，对应 /poll 路由，在当前线程中等待。
+
+        :param args: 请求参数，包含 ``token`` 和可选的 ``timeout``。
+        """
+        user, timeout, status = self.open_poll(args)
+        if status != 200:
+            return None, status
+        waiter = Event()
+        if not self.user_manage.idle.wait(user, waiter):
+            waiter.wait(timeout)
+        return self.close_poll(user)
+
+    def job(self, body) -> (Optional[dict], int):
+        """在服务进程中执行批量更新任务，对应 /job 路由。
+
+        任务与在线会话共用数据库对象，完成后丢弃在线会话的变量缓存，已登录的会话之后读到更新后的值。
+
+        :param body: 请求体解析得到的JSON，包含 ``key``、``variable``、``op``、``value``，
+            可选的 ``where`` 和 ``chunk``，含义与命令行 ``python -m server.state.jobs`` 的参数相同。
+        """
+        if self.admin_key is None:
+            return None, 404
+        if not isinstance(body, dict):
+            return None, 400
+        if not hmac.compare_digest(str(body.get("key", "")).encode(), self.admin_key.encode()):
+            return None, 403
+        try:
+            chunk = int(body.get("chunk", CHUNK_SIZE))
+            job = BulkUpdateJob(str(body["variable"]), str(body["op"]), str(body["value"]), body.get("where"),
+                                chunk or None)
+        except (KeyError, ValueError, TypeError, GrammarException):
+            return None, 400
+        return job.run(self.machine().db, self.user_manage), 200
+
+    def login(self, args) -> (Optional[dict], int):
+        """登录，对应 /login 路由。
+
+        :param args: 请求参数，包含 ``username``、``password`` 和 ``token``。
+        """
+        try:
+            username = args["username"]
+            passwd = args["password"]
+            user = self.user_manage.jwt_decode(args["token"])
+            return {"token": self.user_manage.login(user, username, passwd, self.machine().db)}, 200
+        except jwt.InvalidTokenError:
+            return None, 403
+        except KeyError:
+            return None, 400
+
+    def register(self, args) -> (Optional[dict], int):
+        """注册，对应 /register 路由。
+
+        :param args: 请求参数，包含 ``username``、``password`` 和 ``token``。
+        """
+        try:
+            username = args["username"]
+            passwd = args["password"]
+            user = self.user_manage.jwt_decode(args["token"])
+            return {"token": self.user_manage.register(user, username, passwd, self.machine().db)}, 200
+        except jwt.InvalidTokenError:
+            return None, 403
+        except KeyError:
+            return None, 400
+
+
+def create_controller(push: Optional[bool] = None) -> Controller:
+    """按环境变量构建用户管理对象和状态机，脚本有错误时退出进程。
+
+    环境变量见 README，Flask应用和异步服务器使用相同的环境变量。
+
+    :param push: 是否由服务器推送超时消息，为None时由 ``DSL_PUSH`` 决定。
+    """
+    if push is None:
+        push = bool(os.environ.get("DSL_PUSH"))
+    try:
+        current_path = os.path.split(os.path.realpath(__file__))[0]
+        user_manage = UserManage(
+            "secret",
+            stateless_guests=bool(os.environ.get("DSL_STATELESS_GUESTS")),  # 访客状态保存在令牌中，服务器不保存访客对象
+        )
+        backend = os.environ.get("DSL_BACKEND", "sqlite")  # columnar: 进程内列式存储，定期写入快照
+        state_machine = StateMachine(
+            "grammar.txt",
+            os.path.join(current_path, "dsl.col" if backend == "columnar" else "dsl.db"),
+            os.path.join(current_path, "grammar.dslc"),
+            durability=os.environ.get("DSL_DURABILITY", "commit"),  # batch: 更新批量提交，最多丢失50毫秒内的更新
+            persistent=bool(os.environ.get("DSL_PERSISTENT")),  # 保留已有的用户数据，重启时只迁移表结构
+            backend=backend,
+            shards=int(os.environ.get("DSL_SHARDS", "1")),  # 按用户名分散到多个SQLite文件
+        )
+        atexit.register(state_machine.db.close)
+        controller = Controller(user_manage, state_machine, admin_key=os.environ.get("DSL_ADMIN_KEY"))
+        if os.environ.get("DSL_RELOAD"):  # 热重载模式，修改脚本后无需重启服务
+            controller.reloader = ScriptReloader(state_machine, user_manage)
+            controller.reloader.start()
+        if push:  # 服务器计算闲置时间，超时回复通过 /poll 推送，客户端不再定时发送 /echo
+            user_manage.idle = IdleScheduler(controller.machine, user_manage)
+            user_manage.idle.start()
+        return controller
+    except GrammarException as err:
+        print(" ".join(err.context))
+        print("GrammarException: ", err.msg)
+        sys.exit(1)
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        print("Error with config.json or file not found")
+        sys.exit(1)
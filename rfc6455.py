@@ -0,0 +1,138 @@
+"""
+ * @file rfc6455.py
+ * @author LinZhi
+ * @brief WebSocket协议模块
+        RFC 6455 的握手和帧编码，异步服务器和测试共用
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+from typing import Optional
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+MAX_MESSAGE = 1 << 20  # 一条消息的最大字节数
+
+
+class ProtocolError(Exception):
+    """对端违反协议，连接应当以 1002 关闭。"""
+
+
+def accept_key(key: str) -> str:
+    """由客户端的 ``Sec-WebSocket-Key`` 计算 ``Sec-WebSocket-Accept``。"""
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def handshake(key: str) -> bytes:
+    """服务器的握手响应。
+
+    :param key: 客户端的 ``Sec-WebSocket-Key``。
+    """
+    return ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n").encode("latin-1")
+
+
+def mask_payload(payload: bytes, mask: bytes) -> bytes:
+    """按4字节掩码异或，掩码和解码相同。整段转换为整数计算，避免逐字节循环。"""
+    length = len(payload)
+    if length == 0:
+        return payload
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+
+
+def encode(opcode: int, payload: bytes = b"", masked: bool = False) -> bytes:
+    """编码一个不分片的帧。
+
+    :param opcode: 操作码。
+    :param payload: 负载。
+    :param masked: 是否加掩码，客户端发送的帧必须加掩码，服务器发送的帧不加。
+    """
+    length = len(payload)
+    mask_bit = 0x80 if masked else 0
+    if length < 126:
+        head = struct.pack("!BB", 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if not masked:
+        return head + payload
+    mask = os.urandom(4)
+    return head + mask + mask_payload(payload, mask)
+
+
+def close_payload(code: int) -> bytes:
+    """关闭帧的负载，只包含状态码。"""
+    return struct.pack("!H", code)
+
+
+async def read_frame(reader: asyncio.StreamReader, require_mask: bool = True) -> (bool, int, bytes):
+    """读取一个帧。
+
+    :param reader: 连接的读取端。
+    :param require_mask: 是否要求帧带有掩码，服务器读取客户端的帧时为True。
+    :return: 是否为消息的最后一帧、操作码和已经解码的负载。
+    :exception ProtocolError 帧格式错误或者超过 ``MAX_MESSAGE``
+    :exception asyncio.IncompleteReadError 连接在帧中途关闭
+    """
+    first, second = await reader.readexactly(2)
+    fin, opcode = bool(first & 0x80), first & 0x0F
+    masked, length = bool(second & 0x80), second & 0x7F
+    if first & 0x70:
+        raise ProtocolError("未协商扩展")
+    if masked != require_mask:
+        raise ProtocolError("掩码错误")
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if opcode >= CLOSE and (length > 125 or not fin):
+        raise ProtocolError("控制帧过长或者分片")
+    if length > MAX_MESSAGE:
+        raise ProtocolError("消息过长")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    return fin, opcode, payload if mask is None else mask_payload(payload, mask)
+
+
+async def read_message(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       require_mask: bool = True) -> Optional[str]:
+    """读取一条文本消息，拼接分片，自动回复Ping。
+
+    :param reader: 连接的读取端。
+    :param writer: 连接的写入端，用于回复Pong和Close。
+    :param require_mask: 是否要求帧带有掩码。
+    :return: 消息文本，对端关闭连接时返回None。
+    :exception ProtocolError 帧格式错误、二进制消息或者文本不是UTF-8
+    """
+    parts: list[bytes] = []
+    size = 0
+    while True:
+        fin, opcode, payload = await read_frame(reader, require_mask)
+        if opcode == CLOSE:
+            writer.write(encode(CLOSE, payload[:2], not require_mask))
+            return None
+        if opcode == PING:
+            writer.write(encode(PONG, payload, not require_mask))
+            continue
+        if opcode == PONG:
+            continue
+        if opcode == BINARY:
+            raise ProtocolError("不支持二进制消息")
+        if (opcode == TEXT) == (len(parts) != 0) or opcode not in (TEXT, CONTINUATION):
+            raise ProtocolError("分片顺序错误")
+        size += len(payload)
+        if size > MAX_MESSAGE:
+            raise ProtocolError("消息过长")
+        parts.append(payload)
+        if fin:
+            try:
+                return b"".join(parts).decode("utf-8")
+            except UnicodeDecodeError:
+                raise ProtocolError("文本不是UTF-8")
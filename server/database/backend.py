@@ -0,0 +1,270 @@
+"""
+ * @file backend.py
+ * @author LinZhi
+ * @brief 存储后端模块
+        定义用户数据存储后端的接口，以及基于SQLite的实现
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import time
+from abc import abstractmethod, ABCMeta
+from typing import Iterable, Optional, Union
+
+from storm.exceptions import IntegrityError
+
+from server.user.user_state import VariableSet
+from server.util.GrammarException import GrammarException
+
+
+class Backend(metaclass=ABCMeta):
+    """
+    存储后端抽象基类。
+    用户的变量集以字典表示，包含用户名和脚本定义的全部变量，不含密码。
+
+    """
+
+    @abstractmethod
+    def prepare(self, table: str, variables: list[tuple], create: bool) -> int:
+        """按脚本定义建立或者迁移用户数据。
+
+        :param table: 脚本定义的表名。
+        :param variables: 脚本定义的变量，每项为（变量名，类型，默认值）。
+        :param create: 是否建立数据表（脚本中 ``Database: True``）。
+        :return: 用户数据的结构版本号。
+        :exception GrammarException 变量类型与已有数据不一致
+        """
+        pass
+
+    @abstractmethod
+    def get_variables(self, username: str, names: Optional[Iterable[str]] = None) -> Optional[dict]:
+        """读取用户的变量。
+
+        :param username: 用户名。
+        :param names: 变量名，为None时读取全部变量。
+        :return: 从变量名映射到变量值的字典，用户不存在时返回None。
+        """
+        pass
+
+    @abstractmethod
+    def apply_update(self, username: str, update, operand: Union[int, float, str]) -> None:
+        """执行一个更新动作。
+
+        :param username: 用户名。
+        :param update: 更新动作 UpdateAction。
+        :param operand: 已经转换类型的操作数。
+        """
+        pass
+
+    @abstractmethod
+    def create_user(self, username: str, password: str) -> Optional[dict]:
+        """添加新用户，各变量取默认值。
+
+        :param username: 用户名。
+        :param password: 密码。
+        :return: 新用户的变量集，用户已经存在时返回None。
+        """
+        pass
+
+    @abstractmethod
+    def verify_login(self, username: str, password: str) -> Optional[dict]:
+        """验证用户名和密码。
+
+        :param username: 用户名。
+        :param password: 密码。
+        :return: 验证成功时返回用户的变量集，否则返回None。
+        """
+        pass
+
+    @abstractmethod
+    def bulk_update(self, update, operand: Union[int, float, str], condition: Optional[tuple],
+                    chunk_size: Optional[int]) -> (int, float):
+        """对满足条件的全部用户（访客除外）执行一个更新动作。
+
+        :param update: 更新动作 UpdateAction。
+        :param operand: 已经转换类型的操作数。
+        :param condition: 过滤条件（变量名，比较运算符，值），为None时更新全部用户。
+        :param chunk_size: 每个事务最多覆盖的行数，为None时用一个事务完成。
+        :return: 更新的行数，以及单个事务持有写锁的最长秒数。
+        """
+        pass
+
+    def flush(self) -> None:
+        """等待尚未写入的更新完成。"""
+        pass
+
+    def close(self) -> None:
+        """关闭后端，写入尚未保存的数据。"""
+        pass
+
+
+class SqliteBackend(Backend):
+    """
+    SQLite存储后端。
+    通过数据库对象的连接池访问SQLite文件，更新动作执行加载时生成的UPDATE语句，
+    ``batch`` 持久化方式下更新进入延迟写入队列。
+
+    :ivar db: 数据库对象。
+    :cvar column_type: 变量类型对应的数据库列类型。
+    """
+
+    column_type = {"Int": "INT", "Real": "REAL", "Text": "TEXT"}
+
+    def __init__(self, db) -> None:
+        """
+
+        :param db: 数据库对象 Database。
+        """
+        self.db = db
+
+    @staticmethod
+    def columns() -> list[str]:
+        """变量集的列名，不含密码。"""
+        return [name for name in VariableSet.type if name != "password"]
+
+    def prepare(self, table: str, variables: list[tuple], create: bool) -> int:
+        """建立或者迁移用户数据表。
+
+        表不存在时建表；表已经存在时比较脚本定义的变量与表中的列，只对新增的变量执行 ``ALTER TABLE ADD COLUMN``，
+        已有的行得到变量的默认值。每次改变表结构都会增加数据库中记录的结构版本号（``PRAGMA user_version``）。
+        SQLite增加带常量默认值的列不需要改写已有的行，因此启动代价与用户数量无关。
+
+        :param  同存储后端抽象基类 Backend.prepare
+        """
+        if not create:
+            return 0
+        with self.db.store() as store:
+            columns = {row[1]: row[2].upper() for row in store.execute(f"PRAGMA table_info({table})")}
+            version = store.execute("PRAGMA user_version").get_one()[0]
+            if len(columns) == 0:
+                create_table_statement = [
+                    "CREATE TABLE " + table + "(username TEXT PRIMARY KEY, password TEXT"
+                ]  # 建表语句
+                for name, type_, _ in variables:
+                    create_table_statement.append(f"{name} {self.column_type[type_]}")
+                store.execute(",".join(create_table_statement) + ")")
+                version += 1
+            else:
+                added = []
+                for name, type_, default in variables:
+                    if name not in columns:
+                        added.append((name, type_, default))
+                    elif columns[name] != self.column_type[type_]:  # 只进行增加列的迁移，类型改变需要手动处理
+                        raise GrammarException(f"{name} 变量类型与数据库中的列 {columns[name]} 不一致", [name, type_])
+                for name, type_, default in added:
+                    if type_ == "Text":
+                        default = "'" + default.replace("'", "''") + "'"
+                    store.execute(f"ALTER TABLE {table} ADD COLUMN {name} {self.column_type[type_]} DEFAULT {default}")
+                if len(added) != 0:
+                    version += 1
+            store.execute(f"PRAGMA user_version = {version}")
+            if store.get(VariableSet, "Guest") is None:
+                store.add(VariableSet("Guest", ""))  # 创建默认的访客用户
+        return version
+
+    def get_variables(self, username: str, names: Optional[Iterable[str]] = None) -> Optional[dict]:
+        """
+        该用户有延迟写入的更新时读取之前先提交，保证读到自己的修改；其他用户的更新留在队列中继续合并。
+
+        :param  同存储后端抽象基类 Backend.get_variables
+        """
+        self.flush_user(username)
+        names = self.columns() if names is None else list(names)
+        with self.db.store() as store:
+            row = store.execute(
+                f"SELECT {', '.join(names)} FROM {VariableSet.__storm_table__} WHERE username = ?", (username,)
+            ).get_one()
+        if row is None:
+            return None
+        return dict(zip(names, row))
+
+    def apply_update(self, username: str, update, operand: Union[int, float, str]) -> None:
+        params = (operand, username)
+        if self.db.queue is not None:
+            statement = update.statement
+            self.db.queue.submit(lambda store: store.execute(statement, params, noresult=True), username)
+        else:
+            with self.db.store() as store:
+                store.execute(update.statement, params, noresult=True)
+
+    def create_user(self, username: str, password: str) -> Optional[dict]:
+        """
+        直接插入新行，由主键约束判断用户是否已经存在，因此两个线程同时注册同一用户名时只有一个成功。
+
+        :param  同存储后端抽象基类 Backend.create_user
+        """
+        with self.db.store() as store:
+            variable_set = VariableSet(username, password)
+            store.add(variable_set)  # 添加新的行
+            try:
+                store.flush()
+            except IntegrityError:  # 用户已经存在
+                store.rollback()
+                return None
+            return {name: getattr(variable_set, name) for name in self.columns()}  # 各变量的默认值
+
+    def verify_login(self, username: str, password: str) -> Optional[dict]:
+        """
+        上一个会话延迟写入的更新提交后再读取。
+
+        :param  同存储后端抽象基类 Backend.verify_login
+        """
+        self.flush_user(username)
+        names = self.columns()
+        with self.db.store() as store:
+            row = store.execute(
+                f"SELECT password, {', '.join(names)} FROM {VariableSet.__storm_table__} WHERE username = ?",
+                (username,),
+            ).get_one()
+        if row is None or row[0] != password:
+            return None
+        return dict(zip(names, row[1:]))
+
+    def bulk_update(self, update, operand: Union[int, float, str], condition: Optional[tuple],
+                    chunk_size: Optional[int]) -> (int, float):
+        """
+        一条集合更新语句完成全部修改；分块时按rowid区间切分，每块一个事务，两块之间其他写操作可以取得写锁。
+
+        :param  同存储后端抽象基类 Backend.bulk_update
+        """
+        self.flush()  # 先提交会话的延迟写入
+        statement = f"UPDATE {VariableSet.__storm_table__} SET {update.assignment} WHERE username != 'Guest'"
+        params = [operand]
+        if condition is not None:
+            statement += f" AND {condition[0]} {condition[1]} ?"
+            params.append(condition[2])
+        if chunk_size is None:
+            start = time.perf_counter()
+            with self.db.store() as store:
+                rows = store.execute(statement, params).rowcount
+            return rows, time.perf_counter() - start
+
+        with self.db.store() as store:
+            low, high = store.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {VariableSet.__storm_table__}").get_one()
+        rows = 0
+        longest = 0.0
+        if low is None:
+            return rows, longest
+        statement += " AND rowid BETWEEN ? AND ?"
+        for first in range(low, high + 1, chunk_size):
+            start = time.perf_counter()
+            with self.db.store() as store:
+                rows += store.execute(statement, params + [first, first + chunk_size - 1]).rowcount
+            longest = max(longest, time.perf_counter() - start)
+        return rows, longest
+
+    def flush(self) -> None:
+        if self.db.queue is not None:
+            self.db.queue.flush()
+
+    def flush_user(self, username: str) -> None:
+        """只在用户有尚未提交的更新时等待提交。
+
+        :param username: 用户名。
+        """
+        if self.db.queue is not None:
+            self.db.queue.flush(username)
+
+    def close(self) -> None:
+        if self.db.queue is not None:
+            self.db.queue.close()
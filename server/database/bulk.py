@@ -0,0 +1,255 @@
+"""
+ * @file bulk.py
+ * @author LinZhi
+ * @brief 批量导入导出模块
+        按脚本定义的变量集，流式地批量导入导出用户
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+import zlib
+from typing import Callable, Iterable, Iterator, Optional, TextIO, Union
+
+from server.database.database import Database
+
+BATCH_SIZE = 10000
+
+
+def record_format(file_name: str) -> str:
+    """根据扩展名判断文件格式，``.jsonl`` 为每行一个JSON对象，其余为带表头的CSV。"""
+    return "jsonl" if file_name.endswith((".jsonl", ".json")) else "csv"
+
+
+def read_records(f: TextIO, fmt: str) -> Iterator[Union[dict, str]]:
+    """逐条读取用户记录。
+
+    :param f: 输入文件。
+    :param fmt: ``csv`` 或者 ``jsonl``。
+    :return: 记录的迭代器。CSV的每条记录为从列名映射到值的字典；JSONL的每条记录为一行JSON文本，
+        由 ``BulkLoader.convert`` 解析，格式错误的行与其他错误记录一样被拒绝，不中断导入。
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+class BulkLoader(object):
+    """
+    批量导入导出类。
+    直接使用sqlite3连接，每 ``batch_size`` 条记录用一次 ``executemany`` 插入并提交一次事务，
+    记录按用户名分配到与 ShardedBackend 相同的分片。导出时逐行读取游标，不把整张表读入内存。
+
+    :ivar paths: 每个分片的数据库路径。
+    :ivar table: 表名。
+    :ivar variables: 脚本定义的变量，每项为（变量名，类型，默认值）。
+    :ivar batch_size: 每个事务插入的记录数。
+    """
+
+    def __init__(self, path: str, table: str, variables: list[tuple], shards: int = 1,
+                 batch_size: int = BATCH_SIZE, busy_timeout: float = 5.0) -> None:
+        """
+
+        :param path: 数据库路径，与 Database 的参数相同。
+        :param table: 表名。
+        :param variables: 脚本定义的变量。
+        :param shards: 分片数量。
+        :param batch_size: 每个事务插入的记录数。
+        :param busy_timeout: 等待SQLite写锁的最长秒数。
+        """
+        self.paths = [path] if shards <= 1 else [Database.shard_path(path, index) for index in range(shards)]
+        self.table = table
+        self.variables = variables
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self.columns = ["username", "password"] + [name for name, _, _ in variables]
+
+    def connect(self, path: str) -> sqlite3.Connection:
+        connection = sqlite3.connect(path, timeout=self.busy_timeout, isolation_level=None)
+        connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def shard(self, username: str) -> int:
+        """用户所在的分片编号，与 ShardedBackend.shard 一致。"""
+        return zlib.crc32(username.encode("utf-8")) % len(self.paths)
+
+    def convert(self, record: Union[dict, str]) -> tuple:
+        """按变量类型转换一条记录，缺少的变量取默认值。
+
+        :param record: 用户记录，或者一行JSON文本。
+        :return: 按列顺序排列的值。
+        :exception ValueError 不是JSON对象、缺少用户名或者值的类型不正确
+        """
+        if isinstance(record, str):
+            record = json.loads(record)  # json.JSONDecodeError 是 ValueError 的子类
+        if not isinstance(record, dict):
+            raise ValueError("记录不是JSON对象")
+        username = record.get("username")
+        if not username:
+            raise ValueError("缺少用户名")
+        row = [str(username), str(record.get("password") or "")]
+        for name, type_, default in self.variables:
+            value = record.get(name)
+            if value is None or value == "":
+                row.append(default)
+            elif type_ == "Int":
+                row.append(int(value))
+            elif type_ == "Real":
+                row.append(float(value))
+            else:
+                row.append(str(value))
+        return tuple(row)
+
+    def import_records(self, records: Iterable[Union[dict, str]],
+                       progress: Optional[Callable[[int, int, int], None]] = None) -> (int, int, int):
+        """批量导入用户，已经存在的用户名被跳过。
+
+        :param records: 用户记录，参见 ``read_records``。
+        :param progress: 进度回调，参数为已读取、已导入、已拒绝的记录数，每提交一批调用一次。
+        :return: 已读取、已导入、已拒绝的记录数。
+        """
+        statement = (f"INSERT OR IGNORE INTO {self.table} ({', '.join(self.columns)}) "
+                     f"VALUES ({', '.join('?' * len(self.columns))})")
+        connections = [self.connect(path) for path in self.paths]
+        buffers: list[list[tuple]] = [[] for _ in self.paths]
+        read = imported = rejected = 0
+
+        def write(index: int) -> int:
+            connection = connections[index]
+            before = connection.total_changes
+            connection.execute("BEGIN")
+            connection.executemany(statement, buffers[index])
+            connection.execute("COMMIT")
+            buffers[index].clear()
+            return connection.total_changes - before
+
+        try:
+            for record in records:
+                read += 1
+                try:
+                    row = self.convert(record)
+                except (ValueError, TypeError) as err:
+                    rejected += 1
+                    print(f"第 {read} 条记录: {err}", file=sys.stderr)
+                    continue
+                index = self.shard(row[0])
+                buffers[index].append(row)
+                if len(buffers[index]) >= self.batch_size:
+                    imported += write(index)
+                    if progress is not None:
+                        progress(read, imported, rejected)
+            for index in range(len(self.paths)):
+                if len(buffers[index]) != 0:
+                    imported += write(index)
+            if progress is not None:
+                progress(read, imported, rejected)
+        finally:
+            for connection in connections:
+                connection.close()
+        return read, imported, rejected
+
+    def export_records(self) -> Iterator[dict]:
+        """逐条导出用户，访客用户除外。
+
+        :return: 记录的迭代器，列与导入时相同。
+        """
+        for path in self.paths:
+            connection = self.connect(path)
+            try:
+                cursor = connection.execute(
+                    f"SELECT {', '.join(self.columns)} FROM {self.table} WHERE username != 'Guest'"
+                )
+                for row in cursor:
+                    yield dict(zip(self.columns, row))
+            finally:
+                connection.close()
+
+    def export_file(self, f: TextIO, fmt: str,
+                    progress: Optional[Callable[[int], None]] = None) -> int:
+        """导出到文件。
+
+        :param f: 输出文件。
+        :param fmt: ``csv`` 或者 ``jsonl``。
+        :param progress: 进度回调，参数为已导出的记录数，每导出 ``batch_size`` 条调用一次。
+        :return: 导出的记录数。
+        """
+        writer = csv.DictWriter(f, self.columns) if fmt == "csv" else None
+        if writer is not None:
+            writer.writeheader()
+        count = 0
+        for record in self.export_records():
+            if writer is not None:
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+            if progress is not None and count % self.batch_size == 0:
+                progress(count)
+        return count
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """命令行入口。
+
+    用法::
+
+        python -m server.database.bulk import grammar.txt dsl.db users.csv
+        python -m server.database.bulk export grammar.txt dsl.db users.jsonl --shards 4
+    """
+    from server.state.state import StateMachine
+    from server.util.GrammarException import GrammarException
+
+    parser = argparse.ArgumentParser(prog="python -m server.database.bulk", description="批量导入导出用户")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("script", help="脚本文件，决定变量集")
+    parser.add_argument("database", help="数据库路径")
+    parser.add_argument("file", help="CSV文件或者JSONL文件（.jsonl），导出时为 - 表示标准输出")
+    parser.add_argument("--shards", type=int, default=1, help="分片数量")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="每个事务的记录数")
+    args = parser.parse_args(argv)
+
+    try:
+        # 以持久化模式打开数据库，按脚本建表或者补充新增的变量列
+        machine = StateMachine(args.script, args.database, persistent=True, shards=args.shards)
+    except GrammarException as err:
+        print(" ".join([str(item) for item in err.context]), file=sys.stderr)
+        print("GrammarException: ", err.msg, file=sys.stderr)
+        return 1
+    machine.db.close()
+    loader = BulkLoader(args.database, machine.db_name, machine.variables, args.shards, args.batch)
+    fmt = record_format(args.file)
+    start = time.perf_counter()
+
+    if args.command == "import":
+        def report(read: int, imported: int, rejected: int) -> None:
+            rate = read / max(time.perf_counter() - start, 1e-9)
+            print(f"已读取 {read} 条，导入 {imported} 条，拒绝 {rejected} 条，{rate:.0f} 条/秒", file=sys.stderr)
+
+        with open(args.file, "r", encoding="utf-8", newline="") as f:
+            read, imported, rejected = loader.import_records(read_records(f, fmt), report)
+        print(f"跳过已存在的用户 {read - imported - rejected} 条", file=sys.stderr)
+        return 0 if rejected == 0 else 2
+
+    def report_export(count: int) -> None:
+        rate = count / max(time.perf_counter() - start, 1e-9)
+        print(f"已导出 {count} 条，{rate:.0f} 条/秒", file=sys.stderr)
+
+    if args.file == "-":
+        count = loader.export_file(sys.stdout, fmt, report_export)
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            count = loader.export_file(f, fmt, report_export)
+    print(f"共导出 {count} 条", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+ * @file columnar.py
+ * @author LinZhi
+ * @brief 列式存储后端模块
+        在进程内存中按列存储用户数据，快照保存到内存映射文件
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import json
+import mmap
+import operator
+import os
+import struct
+import time
+from array import array
+from threading import Condition, Lock, Thread
+from typing import Iterable, Optional, Union
+
+from server.database.backend import Backend
+from server.util.GrammarException import GrammarException
+
+MAGIC = b"DSLM"
+_HEADER = struct.Struct("<4sQ")  # 魔数，JSON描述的字节数
+
+
+class ColumnarBackend(Backend):
+    """
+    列式存储后端。
+    每个变量一列：整数列和实数列分别存放在 ``array('q')``、``array('d')`` 中，文本列是字符串列表。
+    文本列不使用全局的驻留表，被覆盖的文本随即释放，内存和快照大小只与当前的数据有关；
+    默认值由各行共用一个字符串对象，加载快照时相同的文本也只保留一份。用户名到行号的字典用于定位用户。
+    读写只访问内存，不经过SQL和ORM。数据在 ``snapshot()`` 时写入内存映射文件，持久化模式下启动时从快照恢复。
+    与延迟写入队列相同，快照线程在修改数量达到 ``snapshot_changes``，或者最早的未保存修改超过 ``snapshot_delay`` 秒时
+    写入快照，因此进程崩溃时最多丢失 ``snapshot_delay`` 秒内的注册和更新。
+
+    :ivar path: 快照文件路径，为None时不保存快照。
+    :ivar lock: 写操作互斥锁。
+    :ivar condition: 与 ``lock`` 共用同一把锁的条件变量，唤醒快照线程。
+    :ivar snapshot_changes: 触发快照的修改数量。
+    :ivar snapshot_delay: 修改等待写入快照的最长秒数，即最大丢失窗口。
+    :ivar changes: 上次快照之后的修改数量。
+    :ivar snapshots: 已经写入的快照数量。
+    :ivar rows: 从用户名映射到行号的字典。
+    :ivar usernames: 每行的用户名。
+    :ivar types: 从列名映射到变量类型的字典，密码列为文本列。
+    :ivar columns: 从列名映射到列数组（文本列为列表）的字典。
+    :ivar defaults: 从列名映射到默认值的字典。
+    :ivar version: 数据结构版本号。
+    :cvar typecode: 数值变量类型对应的数组类型。
+    :cvar compare: 批量更新过滤条件的比较运算。
+    """
+
+    typecode = {"Int": "q", "Real": "d"}
+    compare = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "=": operator.eq,
+               "!=": operator.ne}
+
+    def __init__(self, path: Optional[str], persistent: bool = False, snapshot_changes: int = 10000,
+                 snapshot_delay: float = 1.0) -> None:
+        """
+
+        :param path: 快照文件路径。
+        :param persistent: 是否从已有的快照恢复数据。
+        :param snapshot_changes: 触发快照的修改数量。
+        :param snapshot_delay: 最大丢失窗口秒数。
+        """
+        self.path = path
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        self.snapshot_lock = Lock()  # 同一时间只写一个快照，临时文件不会被两个线程同时写入
+        self.snapshot_changes = snapshot_changes
+        self.snapshot_delay = snapshot_delay
+        self.changes = 0
+        self.first = 0.0  # 最早的未保存修改发生的时间
+        self.snapshots = 0
+        self.closed = False
+        self.rows: dict[str, int] = dict()
+        self.usernames: list[str] = []
+        self.types: dict[str, str] = {"password": "Text"}
+        self.columns: dict[str, Union[array, list]] = {"password": []}
+        self.defaults: dict[str, Union[int, float, str]] = {"password": ""}
+        self.version = 0
+        if persistent and path is not None and os.path.exists(path):
+            self.load()
+        self.thread: Optional[Thread] = None
+        if path is not None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def changed(self, count: int = 1) -> None:
+        """记录修改，调用时需持有 ``lock``。
+
+        :param count: 修改的行数。
+        """
+        if count == 0:
+            return
+        if self.changes == 0:
+            self.first = time.monotonic()
+        self.changes += count
+        if self.changes == count or self.changes >= self.snapshot_changes:  # 开始计时或者达到数量
+            self.condition.notify_all()
+
+    def column(self, type_: str, value: Union[int, float, str], count: int) -> Union[array, list]:
+        """新建一列，每行的值相同。
+
+        :param type_: 变量类型。
+        :param value: 每行的值。
+        :param count: 行数。
+        """
+        if type_ == "Text":
+            return [value] * count
+        return array(self.typecode[type_], [value]) * count
+
+    def prepare(self, table: str, variables: list[tuple], create: bool) -> int:
+        """
+        新增的变量以默认值追加为新列，已有的列保持不变。
+
+        :param  同存储后端抽象基类 Backend.prepare
+        """
+        if not create:
+            return 0
+        with self.lock:
+            added = False
+            for name, type_, default in variables:
+                if name not in self.types:
+                    self.types[name] = type_
+                    self.defaults[name] = default
+                    self.columns[name] = self.column(type_, default, len(self.usernames))
+                    added = True
+                elif self.types[name] != type_:
+                    raise GrammarException(f"{name} 变量类型与快照中的列 {self.types[name]} 不一致", [name, type_])
+                else:
+                    self.defaults[name] = default
+            if added or self.version == 0:
+                self.version += 1
+                self.changed()
+            if "Guest" not in self.rows:
+                self.insert("Guest", "")  # 创建默认的访客用户
+            return self.version
+
+    def row(self, index: int, names: Iterable[str]) -> dict:
+        """读取一行中的若干列。"""
+        result = dict()
+        for name in names:
+            if name == "username":
+                result[name] = self.usernames[index]
+            else:
+                result[name] = self.columns[name][index]
+        return result
+
+    def variable_names(self) -> list[str]:
+        """变量集的列名，不含密码。"""
+        return ["username"] + [name for name in self.columns if name != "password"]
+
+    def get_variables(self, username: str, names: Optional[Iterable[str]] = None) -> Optional[dict]:
+        index = self.rows.get(username)
+        if index is None:
+            return None
+        return self.row(index, self.variable_names() if names is None else names)
+
+    def apply_update(self, username: str, update, operand: Union[int, float, str]) -> None:
+        with self.lock:
+            index = self.rows.get(username)
+            if index is None:
+                return
+            column = self.columns[update.variable]
+            if self.types[update.variable] == "Text":
+                column[index] = operand
+            else:
+                column[index] = update.compute(column[index], operand)
+            self.changed()
+
+    def insert(self, username: str, password: str) -> int:
+        """追加一行，调用时需持有 ``lock``。
+
+        :return: 新行的行号。
+        """
+        index = len(self.usernames)
+        for name, column in self.columns.items():
+            column.append(password if name == "password" else self.defaults[name])
+        self.usernames.append(username)
+        self.rows[username] = index  # 最后登记行号，读取时不会看到不完整的行
+        self.changed()
+        return index
+
+    def create_user(self, username: str, password: str) -> Optional[dict]:
+        with self.lock:
+            if username in self.rows:  # 用户已经存在
+                return None
+            index = self.insert(username, password)
+        return self.row(index, self.variable_names())
+
+    def verify_login(self, username: str, password: str) -> Optional[dict]:
+        index = self.rows.get(username)
+        if index is None or self.columns["password"][index] != password:
+            return None
+        return self.row(index, self.variable_names())
+
+    def bulk_update(self, update, operand: Union[int, float, str], condition: Optional[tuple],
+                    chunk_size: Optional[int]) -> (int, float):
+        """
+        逐行计算，分块时每块释放一次锁。
+
+        :param  同存储后端抽象基类 Backend.bulk_update
+        """
+        rows = 0
+        longest = 0.0
+        total = len(self.usernames)
+        step = total if chunk_size is None else chunk_size
+        for first in range(0, total, max(step, 1)):
+            start = time.perf_counter()
+            with self.lock:
+                column = self.columns[update.variable]
+                text = self.types[update.variable] == "Text"
+                updated = rows
+                for index in range(first, min(first + step, total)):
+                    if self.usernames[index] == "Guest":
+                        continue
+                    if condition is not None:
+                        current = self.columns[condition[0]][index]
+                        if not self.compare[condition[1]](current, condition[2]):
+                            continue
+                    column[index] = operand if text else update.compute(column[index], operand)
+                    rows += 1
+                self.changed(rows - updated)
+            longest = max(longest, time.perf_counter() - start)
+        return rows, longest
+
+    @staticmethod
+    def pack_strings(strings: list[str]) -> bytes:
+        """将字符串列表编码为长度数组和UTF-8内容。"""
+        encoded = [text.encode("utf-8") for text in strings]
+        return array("q", [len(item) for item in encoded]).tobytes() + b"".join(encoded)
+
+    @staticmethod
+    def unpack_strings(buffer: memoryview, count: int) -> list[str]:
+        """解码 pack_strings 的结果，相同的文本共用一个字符串对象。"""
+        lengths = array("q")
+        lengths.frombytes(buffer[:count * lengths.itemsize])
+        result = []
+        shared: dict[str, str] = dict()
+        offset = count * lengths.itemsize
+        for length in lengths:
+            text = str(buffer[offset:offset + length], "utf-8")
+            result.append(shared.setdefault(text, text))
+            offset += length
+        return result
+
+    def snapshot(self) -> None:
+        """将全部数据写入快照文件。
+
+        先写入临时文件，再替换原文件，写入过程中崩溃不会损坏已有的快照。
+        """
+        if self.path is None:
+            return
+        with self.snapshot_lock:
+            self.write_snapshot()
+
+    def write_snapshot(self) -> None:
+        """写入快照，调用时需持有 ``snapshot_lock``。"""
+        with self.lock:  # 只在持有锁时复制各列，编码在锁外进行
+            self.changes = 0
+            copies = [(":usernames", None, len(self.usernames), list(self.usernames))]
+            for name, column in self.columns.items():
+                data = column.tobytes() if isinstance(column, array) else list(column)
+                copies.append((name, self.types[name], len(column), data))
+            defaults = dict(self.defaults)
+            version = self.version
+        blocks = []
+        for name, type_, count, data in copies:
+            blocks.append((name, type_, count, self.pack_strings(data) if isinstance(data, list) else data))
+        layout = []
+        offset = 0
+        for name, type_, count, data in blocks:
+            layout.append([name, type_, count, offset, len(data)])
+            offset += len(data)
+        header = json.dumps({"version": version, "defaults": defaults, "blocks": layout}).encode("utf-8")
+        start = _HEADER.size + len(header)
+        size = start + offset
+
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            f.truncate(max(size, 1))
+        with open(temp, "r+b") as f:
+            with mmap.mmap(f.fileno(), max(size, 1)) as mapped:
+                mapped[:start] = _HEADER.pack(MAGIC, len(header)) + header
+                for (_, _, _, data), (_, _, _, position, length) in zip(blocks, layout):
+                    mapped[start + position:start + position + length] = data
+                mapped.flush()
+        os.replace(temp, self.path)
+        with self.lock:
+            self.snapshots += 1
+
+    def load(self) -> None:
+        """从快照文件恢复数据。"""
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, length = _HEADER.unpack_from(mapped, 0)
+                if magic != MAGIC:
+                    raise ValueError(f"{self.path} 不是列式存储快照")
+                header = json.loads(bytes(mapped[_HEADER.size:_HEADER.size + length]))
+                start = _HEADER.size + length
+                view = memoryview(mapped)
+                strings = None  # 旧版本快照的文本驻留表，文本列存放的是表中的编号
+                try:
+                    for name, type_, count, offset, size in header["blocks"]:
+                        data = view[start + offset:start + offset + size]
+                        if name == ":usernames":
+                            self.usernames = self.unpack_strings(data, count)
+                        elif name == ":strings":
+                            strings = self.unpack_strings(data, count)
+                        elif type_ == "Text" and strings is None:
+                            self.columns[name] = self.unpack_strings(data, count)
+                            self.types[name] = type_
+                        else:
+                            column = array("q" if type_ == "Text" else self.typecode[type_])
+                            column.frombytes(data)
+                            self.columns[name] = [strings[index] for index in column] if type_ == "Text" else column
+                            self.types[name] = type_
+                        data.release()
+                finally:
+                    view.release()
+        self.defaults.update(header["defaults"])
+        self.version = header["version"]
+        self.rows = {username: index for index, username in enumerate(self.usernames)}
+
+    def run(self) -> None:
+        """快照线程主循环。"""
+        while True:
+            with self.condition:
+                while self.changes == 0 and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                while self.changes < self.snapshot_changes and not self.closed:
+                    remaining = self.first + self.snapshot_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.closed:  # 由 close 写入最后的快照
+                    return
+            try:
+                self.snapshot()
+            except Exception as err:  # 写入失败时重新记录修改，等待 snapshot_delay 秒后重试
+                print("ColumnarBackend: ", err)
+                with self.lock:
+                    self.changed()
+
+    def close(self) -> None:
+        """停止快照线程并写入最后的快照。"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.snapshot()
@@ -8,26 +8,227 @@
  * @copyright Copyright (c) 2022
 """
 import os
-from threading import Lock
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock, local
+from typing import Iterable, Iterator, Optional, Union
 from storm import database
+from storm.store import Store
+
+from server.database.write_queue import WriteBehindQueue
 
 
 class Database(object):
     """
     数据库类
     定义对应用户信息数据库
+    数据库文件使用WAL日志模式，读操作互不阻塞，也不阻塞写操作，写操作之间由SQLite的文件锁互斥，
+    等待写锁的最长时间为 ``busy_timeout`` 秒。
+    每个线程持有一个长期使用的Store（SQLite连接只能在创建它的线程中使用），通过 ``store()`` 取出，
+    同时取出Store的线程数量不超过 ``pool_size``。
+    用户数据的读写通过存储后端 ``backend`` 完成，``sqlite`` 后端使用上述连接池，``columnar`` 后端在进程内存中按列存储。
     :ivar database 数据库对象
-    :ivar lock 数据库访问互斥锁
+    :ivar pool_size 同时使用数据库的最大线程数
+    :ivar busy_timeout 等待SQLite写锁的最长秒数
+    :ivar durability 持久化方式，``commit`` 每次更新立即提交，``batch`` 更新进入延迟写入队列批量提交
+    :ivar queue 延迟写入队列，``commit`` 方式下为None
+    :ivar backend 存储后端
     """
 
-    def __init__(self, path) -> None:
+    def __init__(
+        self,
+        path,
+        durability: str = "commit",
+        batch_size: int = 64,
+        max_delay: float = 0.05,
+        pool_size: int = 16,
+        busy_timeout: float = 5.0,
+        persistent: bool = False,
+        backend: str = "sqlite",
+        shards: int = 1,
+    ) -> None:
         """
         初始化数据库。
 
+        :param path: 数据库路径。
+        :param durability: 持久化方式，``commit`` 或者 ``batch``。
+        :param batch_size: ``batch`` 方式下一次事务提交的最大更新数量。
+        :param max_delay: ``batch`` 方式下更新在队列中等待的最长秒数，即进程崩溃时的最大丢失窗口。
+        :param pool_size: 同时使用数据库的最大线程数。
+        :param busy_timeout: 等待SQLite写锁的最长秒数。
+        :param persistent: 是否打开已有的数据库文件，为False时删除已有的文件。
+        :param backend: 存储后端，``sqlite`` 或者 ``columnar``（列式存储，``path`` 为快照文件，不使用 ``durability``）。
+        :param shards: ``sqlite`` 后端的分片数量，大于1时用户按用户名分散到多个SQLite文件，参见 shard_path。
+        """
+        if durability not in ("commit", "batch"):
+            raise ValueError(f"未知的持久化方式 {durability}")
+        if backend not in ("sqlite", "columnar"):
+            raise ValueError(f"未知的存储后端 {backend}")
+        if not persistent:
+            self.remove(path)
+        self.database = database.create_database(f"sqlite:{path}?timeout={busy_timeout}&journal_mode=WAL")
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.slots = BoundedSemaphore(pool_size)
+        self.local = local()
+        self.stats_lock = Lock()  # 只保护统计数据
+        self.stores = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.durability = durability
+        self.queue: Optional[WriteBehindQueue] = None
+        # 后端在此处才导入，后端依赖的用户状态模块也依赖本模块
+        if backend == "columnar":
+            from server.database.columnar import ColumnarBackend
+
+            self.backend = ColumnarBackend(path, persistent)
+        elif shards > 1:
+            from server.database.sharded import ShardedBackend
+
+            self.backend = ShardedBackend([
+                Database(self.shard_path(path, index), durability, batch_size, max_delay, pool_size, busy_timeout,
+                         persistent)
+                for index in range(shards)
+            ])
+        else:
+            from server.database.backend import SqliteBackend
+
+            if durability == "batch":
+                self.queue = WriteBehindQueue(self, batch_size, max_delay)
+            self.backend = SqliteBackend(self)
+
+    @staticmethod
+    def remove(path: str) -> None:
+        """删除数据库文件及其WAL日志文件。
+
         :param path: 数据库路径。
         """
         directory, file_name = os.path.split(path)
-        if file_name in os.listdir(directory):
-            os.remove(path)
-        self.database = database.create_database("sqlite:" + path)
-        self.lock = Lock()
+        for name in (file_name, file_name + "-wal", file_name + "-shm"):
+            if name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def shard_path(path: str, index: int) -> str:
+        """分片的数据库路径，例如 ``dsl.db`` 的0号分片为 ``dsl.0.db``。
+
+        :param path: 数据库路径。
+        :param index: 分片编号。
+        :return: 分片的数据库路径。
+        """
+        root, ext = os.path.splitext(path)
+        return f"{root}.{index}{ext}"
+
+    @contextmanager
+    def store(self) -> Iterator[Store]:
+        """取出当前线程的Store。
+
+        正常退出时提交事务（只读事务的提交不需要同步磁盘），结束读快照，使下一次读取看到其他线程的修改；
+        抛出异常时回滚事务。同一线程中嵌套使用时共用外层的事务。
+
+        :return: 当前线程的Store。
+        """
+        state = self.local
+        if getattr(state, "depth", 0) != 0:  # 嵌套使用，由外层提交
+            state.depth += 1
+            try:
+                yield state.store
+            finally:
+                state.depth -= 1
+            return
+
+        start = time.perf_counter()
+        self.slots.acquire()
+        wait = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        try:
+            store = getattr(state, "store", None)
+            if store is None:
+                store = Store(self.database)
+                state.store = store
+                with self.stats_lock:
+                    self.stores += 1
+            state.depth = 1
+            try:
+                yield store
+                store.commit()
+            except BaseException:
+                store.rollback()
+                raise
+            finally:
+                state.depth = 0
+        finally:
+            with self.stats_lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def metrics(self) -> dict:
+        """连接池统计。
+
+        :return: 包含最大线程数 ``pool_size``、写锁等待时间 ``busy_timeout``、已创建的Store数量 ``stores``、
+            正在使用的Store数量 ``in_use``、取出次数 ``checkouts``、平均和最长取出等待秒数 ``wait_avg``、``wait_max`` 的字典。
+            分片模式下本对象的连接池不使用，返回全部分片的合计，``pool_size`` 为各分片之和。
+        """
+        shards = getattr(self.backend, "shards", None)
+        if shards is not None:
+            parts = [shard.metrics() for shard in shards]
+            checkouts = sum(part["checkouts"] for part in parts)
+            return {
+                "pool_size": sum(part["pool_size"] for part in parts),
+                "busy_timeout": self.busy_timeout,
+                "stores": sum(part["stores"] for part in parts),
+                "in_use": sum(part["in_use"] for part in parts),
+                "checkouts": checkouts,
+                "wait_avg": sum(part["wait_avg"] * part["checkouts"] for part in parts) / checkouts
+                if checkouts != 0 else 0.0,
+                "wait_max": max(part["wait_max"] for part in parts),
+            }
+        with self.stats_lock:
+            return {
+                "pool_size": self.pool_size,
+                "busy_timeout": self.busy_timeout,
+                "stores": self.stores,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts != 0 else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+    def prepare(self, table: str, variables: list[tuple], create: bool) -> int:
+        """按脚本定义建立或者迁移用户数据，参见 Backend.prepare。"""
+        return self.backend.prepare(table, variables, create)
+
+    def get_variables(self, username: str, names: Optional[Iterable[str]] = None) -> Optional[dict]:
+        """读取用户的变量，参见 Backend.get_variables。"""
+        return self.backend.get_variables(username, names)
+
+    def apply_update(self, username: str, update, operand: Union[int, float, str]) -> None:
+        """执行一个更新动作，参见 Backend.apply_update。"""
+        self.backend.apply_update(username, update, operand)
+
+    def create_user(self, username: str, password: str) -> Optional[dict]:
+        """添加新用户，参见 Backend.create_user。"""
+        return self.backend.create_user(username, password)
+
+    def verify_login(self, username: str, password: str) -> Optional[dict]:
+        """验证用户名和密码，参见 Backend.verify_login。"""
+        return self.backend.verify_login(username, password)
+
+    def bulk_update(self, update, operand: Union[int, float, str], condition: Optional[tuple],
+                    chunk_size: Optional[int]) -> (int, float):
+        """对满足条件的全部用户执行一个更新动作，参见 Backend.bulk_update。"""
+        return self.backend.bulk_update(update, operand, condition, chunk_size)
+
+    def flush(self) -> None:
+        """等待尚未写入的更新完成。``commit`` 方式下更新已经提交，直接返回。"""
+        self.backend.flush()
+
+    def close(self) -> None:
+        """关闭数据库，提交延迟写入的更新，列式存储写入快照。"""
+        self.backend.close()
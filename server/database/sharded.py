@@ -0,0 +1,92 @@
+"""
+ * @file sharded.py
+ * @author LinZhi
+ * @brief 分片存储后端模块
+        按用户名的稳定哈希把用户分散到多个SQLite文件
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import zlib
+from typing import Iterable, Optional, Union
+
+from server.database.backend import Backend
+
+
+class ShardedBackend(Backend):
+    """
+    分片存储后端。
+    每个分片是一个独立的数据库对象，拥有自己的SQLite文件、连接和延迟写入队列，
+    一个SQLite文件同一时间只允许一个写事务，分片后不同分片上的写操作可以同时进行。
+    用户所在的分片由用户名的CRC32决定，与进程和启动次数无关。
+    分片数量记录在每个文件的 ``PRAGMA application_id`` 中，持久化模式下分片数量改变时拒绝启动。
+
+    :ivar shards: 分片的数据库对象。
+    """
+
+    def __init__(self, shards: list) -> None:
+        """
+
+        :param shards: 分片的数据库对象 Database。
+        """
+        self.shards = shards
+
+    def shard(self, username: str):
+        """用户所在的分片。
+
+        :param username: 用户名。
+        :return: 分片的数据库对象。
+        """
+        return self.shards[zlib.crc32(username.encode("utf-8")) % len(self.shards)]
+
+    def prepare(self, table: str, variables: list[tuple], create: bool) -> int:
+        """
+        每个分片分别建表或者迁移，所有分片的结构版本号相同。
+
+        :param  同存储后端抽象基类 Backend.prepare
+        :exception ValueError 持久化模式下已有数据的分片数量与配置不一致
+        """
+        versions = set()
+        for shard in self.shards:
+            with shard.store() as store:
+                count = store.execute("PRAGMA application_id").get_one()[0]
+                if count not in (0, len(self.shards)):  # 重新分片需要迁移数据
+                    raise ValueError(f"数据库分片数量为 {count}，与配置的 {len(self.shards)} 不一致")
+                store.execute(f"PRAGMA application_id = {len(self.shards)}")
+            versions.add(shard.prepare(table, variables, create))
+        return max(versions)
+
+    def get_variables(self, username: str, names: Optional[Iterable[str]] = None) -> Optional[dict]:
+        return self.shard(username).get_variables(username, names)
+
+    def apply_update(self, username: str, update, operand: Union[int, float, str]) -> None:
+        self.shard(username).apply_update(username, update, operand)
+
+    def create_user(self, username: str, password: str) -> Optional[dict]:
+        return self.shard(username).create_user(username, password)
+
+    def verify_login(self, username: str, password: str) -> Optional[dict]:
+        return self.shard(username).verify_login(username, password)
+
+    def bulk_update(self, update, operand: Union[int, float, str], condition: Optional[tuple],
+                    chunk_size: Optional[int]) -> (int, float):
+        """
+        依次在每个分片上执行，每个分片只持有自己文件的写锁。
+
+        :param  同存储后端抽象基类 Backend.bulk_update
+        """
+        rows = 0
+        longest = 0.0
+        for shard in self.shards:
+            count, seconds = shard.backend.bulk_update(update, operand, condition, chunk_size)
+            rows += count
+            longest = max(longest, seconds)
+        return rows, longest
+
+    def flush(self) -> None:
+        for shard in self.shards:
+            shard.flush()
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,173 @@
+"""
+ * @file write_queue.py
+ * @author LinZhi
+ * @brief 延迟写入模块
+        更新动作进入队列，由写线程合并为批量事务提交
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import time
+from threading import Condition, Thread
+from typing import Callable, Optional
+
+from storm.store import Store
+
+RETRIES = 3  # 一批写操作提交失败时的最多尝试次数
+RETRY_DELAY = 0.05  # 重试前等待的秒数，每次重试递增
+
+
+def transient(err: Exception) -> bool:
+    """是否为重试可能成功的错误，例如等待写锁超过 ``busy_timeout``。"""
+    message = str(err).lower()
+    return "locked" in message or "busy" in message
+
+
+class WriteBehindQueue(object):
+    """延迟写入队列。
+
+    每次提交事务都要等待磁盘同步，逐个提交时更新速度受限于磁盘延迟。
+    队列中的写操作由写线程按批执行，一批只提交一次事务。
+    队列中写操作数量达到 ``batch_size``，或者最早的写操作等待超过 ``max_delay`` 秒时提交，
+    因此进程崩溃时最多丢失 ``max_delay`` 秒内的更新。
+    单个写操作失败时跳过该操作；事务提交失败或者数据库被锁时整批回滚重试，重试 ``RETRIES`` 次仍然失败的批
+    放入 ``failed``，写线程继续运行，等待提交的 ``flush`` 不会因此永久阻塞。
+    写操作可以带有所属用户名，读取某个用户之前只有该用户有尚未提交的写操作时才需要等待提交，
+    其他用户的读取不会打断批量提交。
+
+    :ivar db: 数据库对象，写线程通过它取出自己的Store。
+    :ivar batch_size: 一批写操作的最大数量。
+    :ivar max_delay: 写操作在队列中等待的最长秒数，即最大丢失窗口。
+    :ivar items: 等待写入的（用户名，写操作）。
+    :ivar keys: 从用户名映射到尚未提交的写操作数量的字典。
+    :ivar submitted: 已经进入队列的写操作数量。
+    :ivar committed: 已经处理的写操作数量，包括执行失败的。
+    :ivar batches: 已经处理的批数量。
+    :ivar errors: 执行失败的写操作数量。
+    :ivar failed: 重试后仍然没有提交的写操作，可以检查后用 ``submit`` 重新提交。
+    """
+
+    def __init__(self, db, batch_size: int = 64, max_delay: float = 0.05) -> None:
+        """
+
+        :param db: 数据库对象。
+        :param batch_size: 一批写操作的最大数量。
+        :param max_delay: 最大丢失窗口秒数。
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.items: list[tuple[Optional[str], Callable[[Store], None]]] = []
+        self.keys: dict[str, int] = dict()
+        self.first = 0.0  # 队列中最早的写操作进入队列的时间
+        self.submitted = 0
+        self.committed = 0
+        self.batches = 0
+        self.errors = 0
+        self.failed: list[Callable[[Store], None]] = []
+        self.flushing = 0
+        self.closed = False
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, apply: Callable[[Store], None], key: Optional[str] = None) -> None:
+        """将写操作加入队列。
+
+        :param apply: 写操作，参数为写线程的Store，不需要提交。
+        :param key: 写操作所属的用户名，``flush`` 可以只等待该用户的写操作。
+        """
+        with self.condition:
+            if len(self.items) == 0:
+                self.first = time.monotonic()
+            self.items.append((key, apply))
+            if key is not None:
+                self.keys[key] = self.keys.get(key, 0) + 1
+            self.submitted += 1
+            if len(self.items) == 1 or len(self.items) >= self.batch_size:  # 开始计时或者达到批量
+                self.condition.notify_all()
+
+    def pending(self) -> int:
+        """尚未提交的写操作数量。"""
+        with self.condition:
+            return self.submitted - self.committed
+
+    def flush(self, key: Optional[str] = None) -> None:
+        """立即提交队列中的写操作，并等待提交完成。
+
+        :param key: 用户名，不为None时只在该用户有尚未提交的写操作时提交。
+        """
+        with self.condition:
+            if key is not None and key not in self.keys:
+                return
+            target = self.submitted
+            if self.committed >= target:
+                return
+            self.flushing += 1
+            self.condition.notify_all()
+            while self.committed < target:
+                self.condition.wait()
+            self.flushing -= 1
+
+    def close(self) -> None:
+        """提交剩余的写操作并停止写线程。"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self) -> None:
+        """写线程主循环。"""
+        while True:
+            with self.condition:
+                while len(self.items) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.items) == 0:
+                    return
+                while len(self.items) < self.batch_size and self.flushing == 0 and not self.closed:
+                    remaining = self.first + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.items[:self.batch_size]
+                del self.items[:self.batch_size]  # 剩余的写操作已经超过批量，下一轮立即提交
+            try:
+                self.write([apply for _, apply in batch])
+            finally:  # 无论成败都推进进度，否则等待提交的线程永远阻塞
+                with self.condition:
+                    for key, _ in batch:
+                        if key is not None:
+                            self.keys[key] -= 1
+                            if self.keys[key] == 0:
+                                del self.keys[key]
+                    self.committed += len(batch)
+                    self.batches += 1
+                    self.condition.notify_all()
+
+    def write(self, batch: list[Callable[[Store], None]]) -> None:
+        """在一个事务中执行一批写操作，事务失败时整批重试。
+
+        :param batch: 写操作。
+        """
+        for attempt in range(RETRIES):
+            errors = 0
+            try:
+                with self.db.store() as store:
+                    for apply in batch:
+                        try:
+                            apply(store)
+                        except Exception as err:  # 单个写操作失败不影响同批的其他操作
+                            if transient(err):  # 数据库被锁，回滚整批后重试
+                                raise
+                            errors += 1
+                            print("WriteBehindQueue: ", err)
+                with self.condition:
+                    self.errors += errors
+                return
+            except Exception as err:  # 提交失败，事务已经回滚
+                print(f"WriteBehindQueue: 第 {attempt + 1} 次提交失败: ", err)
+                if attempt + 1 < RETRIES:
+                    time.sleep(RETRY_DELAY * (attempt + 1))
+        with self.condition:
+            self.errors += len(batch)
+            self.failed.extend(batch)
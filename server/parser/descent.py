@@ -0,0 +1,381 @@
+"""
+ * @file descent.py
+ * @author LinZhi
+ * @brief 递归下降解析器模块
+        手写的词法分析与递归下降语法分析
+    与 parser.py 的文法等价，产生相同的语法树，解析时间与脚本长度成线性关系
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import re
+from typing import Optional
+
+from server.util.GrammarException import GrammarException
+
+
+class Lexer(object):
+    """
+    词法分析类
+    按语法分析的需要逐个识别单词，单词之间的空白字符被跳过。
+    关键字、数字、字符串的识别规则与pyparsing文法一致。
+
+    :ivar text: 脚本文本。
+    :ivar pos: 当前位置。
+    """
+
+    white_chars = " \n\t\r"
+    ident_chars = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_$")
+    const_num = re.compile(r"[-+]?[0-9]+")
+    real_num = re.compile(r"[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?")
+    word = re.compile(r"[A-Za-z]+")
+    var_name = re.compile(r"[0-9A-Za-z_]+")
+    compare = re.compile(r"<=|<|>=|>|=")
+    strings = {
+        '"': re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'),
+        "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+    }
+
+    def __init__(self, text: str) -> None:
+        self.text = text.expandtabs()
+        self.pos = 0
+
+    def skip(self) -> None:
+        """跳过空白字符。"""
+        text = self.text
+        pos = self.pos
+        while pos < len(text) and text[pos] in self.white_chars:
+            pos += 1
+        self.pos = pos
+
+    def at_end(self) -> bool:
+        """是否已经到达文本末尾。"""
+        self.skip()
+        return self.pos >= len(self.text)
+
+    def keyword(self, match: str) -> bool:
+        """识别一个关键字，关键字前后不能紧接标识符字符。
+
+        :param match: 关键字。
+        :return: 如果识别成功，前进并返回True；否则返回False。
+        """
+        self.skip()
+        text = self.text
+        pos = self.pos
+        end = pos + len(match)
+        if not text.startswith(match, pos):
+            return False
+        if pos > 0 and text[pos - 1] in self.ident_chars:
+            return False
+        if end < len(text) and text[end] in self.ident_chars:
+            return False
+        self.pos = end
+        return True
+
+    def regex(self, pattern: re.Pattern) -> Optional[str]:
+        """识别一个满足正则表达式的单词。
+
+        :param pattern: 正则表达式。
+        :return: 识别出的单词，识别失败时返回None。
+        """
+        self.skip()
+        result = pattern.match(self.text, self.pos)
+        if result is None:
+            return None
+        self.pos = result.end()
+        return result.group()
+
+    def literal(self, match: str) -> bool:
+        """识别一个符号。
+
+        :param match: 符号。
+        :return: 如果识别成功，前进并返回True；否则返回False。
+        """
+        self.skip()
+        if self.text.startswith(match, self.pos):
+            self.pos += len(match)
+            return True
+        return False
+
+    def string(self) -> Optional[str]:
+        """识别一个带引号的字符串，结果保留引号。
+
+        :return: 识别出的字符串，识别失败时返回None。
+        """
+        self.skip()
+        pos = self.pos
+        if pos >= len(self.text) or self.text[pos] not in self.strings:
+            return None
+        quote = self.text[pos]
+        result = self.strings[quote].match(self.text, pos)
+        end = result.end()
+        if not self.text.startswith(quote, end):
+            return None
+        self.pos = end + 1
+        return self.text[pos:self.pos]
+
+    def var(self) -> Optional[str]:
+        """识别一个变量，结果保留 ``$`` 前缀。
+
+        :return: 识别出的变量，识别失败时返回None。
+        """
+        self.skip()
+        pos = self.pos
+        if not self.text.startswith("$", pos):
+            return None
+        result = self.var_name.match(self.text, pos + 1)
+        if result is None:
+            return None
+        self.pos = result.end()
+        return self.text[pos:self.pos]
+
+    def error(self, expected: str) -> GrammarException:
+        """构造语法错误异常。
+
+        :param expected: 期望的单词。
+        :return: 语法错误异常，上下文为出错的行。
+        """
+        self.skip()
+        line_start = self.text.rfind("\n", 0, self.pos) + 1
+        line_end = self.text.find("\n", self.pos)
+        if line_end == -1:
+            line_end = len(self.text)
+        line = self.text[line_start:line_end]
+        lineno = self.text.count("\n", 0, self.pos) + 1
+        col = self.pos - line_start + 1
+        return GrammarException(
+            f"Expected {expected}, found {self.text[self.pos:self.pos + 10]!r}  "
+            f"(at char {self.pos}), (line:{lineno}, col:{col})",
+            [line],
+        )
+
+
+class DescentParser(object):
+    """
+    脚本语言递归下降分析类
+    每个文法规则对应一个方法，根据下一个单词决定分支，不需要回溯。
+    """
+
+    def __init__(self, text: str) -> None:
+        self.lexer = Lexer(text)
+
+    @staticmethod
+    def analyse_file(file: str) -> list:
+        """
+        brief 解析一个脚本，脚本存储在文件中
+
+        :param file: 文件名。
+        :return: 解析脚本得到的语法树，与 Parser.analyse_file 的结果相同
+        :exception GrammarException 脚本存在语法错误
+        """
+        with open(file, "r", encoding="utf-8") as f:
+            return DescentParser(f.read()).language()
+
+    @staticmethod
+    def analyse_state(text: str) -> list:
+        """
+        brief 解析一个状态定义，用于热重载时只解析改变的状态
+
+        :param text: 状态定义文本，以 ``State:`` 开头。
+        :return: 状态定义的语法树，与 Parser.analyse_state 的结果相同
+        :exception GrammarException 状态定义存在语法错误
+        """
+        parser = DescentParser(text)
+        if not parser.lexer.keyword("State:"):
+            raise parser.lexer.error("'State:'")
+        result = parser.state_define()
+        if not parser.lexer.at_end():
+            raise parser.lexer.error("end of text")
+        return result
+
+    def language(self) -> list:
+        """language = basic (state_define | vars_define)*"""
+        lexer = self.lexer
+        result = [self.basic()]
+        while True:
+            if lexer.keyword("State:"):
+                result.append(self.state_define())
+            elif lexer.keyword("Var:"):
+                result.append(self.vars_define())
+            else:
+                break
+        if not lexer.at_end():
+            raise lexer.error("end of text")
+        return result
+
+    def basic(self) -> list:
+        """basic = "Basic:" "Name:" word "Database:" word"""
+        lexer = self.lexer
+        if not lexer.keyword("Basic:"):
+            raise lexer.error("'Basic:'")
+        if not lexer.keyword("Name:"):
+            raise lexer.error("'Name:'")
+        name = self.word()
+        if not lexer.keyword("Database:"):
+            raise lexer.error("'Database:'")
+        return ["Basic:", ["Name:", name], ["Database:", self.word()]]
+
+    def vars_define(self) -> list:
+        """vars_define = "Var:" one_var_define+"""
+        clauses = [self.one_var_define()]
+        while True:
+            self.lexer.skip()
+            if not self.lexer.text.startswith("$", self.lexer.pos):
+                break
+            clauses.append(self.one_var_define())
+        return ["Var:", clauses]
+
+    def one_var_define(self) -> list:
+        """one_var_define = var ("Int" const_num | "Real" real_num | "Text" const_string)"""
+        lexer = self.lexer
+        name = self.var()
+        if lexer.keyword("Int"):
+            return [name, "Int", self.const_num()]
+        if lexer.keyword("Real"):
+            return [name, "Real", self.real_num()]
+        if lexer.keyword("Text"):
+            return [name, "Text", self.const_string()]
+        raise lexer.error("'Int' | 'Real' | 'Text'")
+
+    def state_define(self) -> list:
+        """state_define = "State:" word ["Logined"] speak_action* service* default wait*"""
+        lexer = self.lexer
+        name = self.word()
+        logined = ["Logined"] if lexer.keyword("Logined") else []
+        speaks = []
+        while lexer.keyword("Speak:"):
+            speaks.append(["Speak:", self.contents(False)])
+        services = []
+        while lexer.keyword("Service:"):
+            judgement = self.judgement()
+            services.append(["Service:"] + judgement + [self.actions(True)])
+        if not lexer.keyword("Default:"):
+            raise lexer.error("'Default:'")
+        default = ["Default:", self.actions(True)]
+        waits = []
+        while lexer.keyword("Wait:"):
+            seconds = self.const_num()
+            waits.append(["Wait:", seconds, self.actions(False)])
+        return ["State:", name, logined, speaks, services, default, waits]
+
+    def judgement(self) -> list:
+        """judgement = "Length" compare const_num | "Contain:" const_string | "Type" ("Int" | "Real") | const_string"""
+        lexer = self.lexer
+        if lexer.keyword("Length"):
+            op = lexer.regex(lexer.compare)
+            if op is None:
+                raise lexer.error("'<' | '>' | '<=' | '>=' | '='")
+            return ["Length", op, self.const_num()]
+        if lexer.keyword("Contain:"):
+            return ["Contain:", self.const_string()]
+        if lexer.keyword("Type"):
+            if lexer.keyword("Int"):
+                return ["Type", "Int"]
+            if lexer.keyword("Real"):
+                return ["Type", "Real"]
+            raise lexer.error("'Int' | 'Real'")
+        string = lexer.string()
+        if string is None:
+            raise lexer.error("judgement")
+        return [string]
+
+    def actions(self, allow_input: bool) -> list:
+        """actions = (set_action | speak)* [exit_action | goto_action]
+
+        :param allow_input: Speak子句是否可以引用用户输入。
+        """
+        lexer = self.lexer
+        result = []
+        while True:
+            if lexer.keyword("Update:"):
+                result.append(self.set_action())
+            elif lexer.keyword("Speak:"):
+                result.append(["Speak:", self.contents(allow_input)])
+            else:
+                break
+        if lexer.keyword("Exit"):
+            result.append(["Exit"])
+        elif lexer.keyword("Goto"):
+            result.append(["Goto", self.word()])
+        return result
+
+    def set_action(self) -> list:
+        """set_action = "Update:" var (("Add" | "Sub" | "Set") (real_num | "Input") | "Set" const_string)"""
+        lexer = self.lexer
+        name = self.var()
+        for op in ("Add", "Sub", "Set"):
+            if lexer.keyword(op):
+                break
+        else:
+            raise lexer.error("'Add' | 'Sub' | 'Set'")
+        if lexer.keyword("Input"):
+            return ["Update:", name, op, "Input"]
+        if op == "Set":
+            string = lexer.string()
+            if string is not None:
+                return ["Update:", name, op, string]
+        return ["Update:", name, op, self.real_num()]
+
+    def contents(self, allow_input: bool) -> list:
+        """contents = content ("+" content)*
+
+        :param allow_input: 是否可以引用用户输入。
+        """
+        result = [self.content(allow_input)]
+        while self.lexer.literal("+"):
+            result.append(self.content(allow_input))
+        return result
+
+    def content(self, allow_input: bool) -> str:
+        """content = var | const_string | "Input"
+
+        :param allow_input: 是否可以引用用户输入。
+        """
+        lexer = self.lexer
+        if allow_input and lexer.keyword("Input"):
+            return "Input"
+        string = lexer.string()
+        if string is not None:
+            return string
+        self.lexer.skip()
+        if lexer.text.startswith("$", lexer.pos):
+            return self.var()
+        raise lexer.error("content")
+
+    def var(self) -> str:
+        name = self.lexer.var()
+        if name is None:
+            raise self.lexer.error("var")
+        return name
+
+    def word(self) -> str:
+        word = self.lexer.regex(Lexer.word)
+        if word is None:
+            raise self.lexer.error("word")
+        return word
+
+    def const_string(self) -> str:
+        string = self.lexer.string()
+        if string is None:
+            raise self.lexer.error("string")
+        return string
+
+    def const_num(self) -> int:
+        num = self.lexer.regex(Lexer.const_num)
+        if num is None:
+            raise self.lexer.error("integer")
+        return int(num)
+
+    def real_num(self) -> float:
+        num = self.lexer.regex(Lexer.real_num)
+        if num is None:
+            raise self.lexer.error("real number")
+        return float(num)
+
+
+if __name__ == "__main__":
+    try:
+        print(DescentParser.analyse_file("../../grammar.txt"))
+    except GrammarException as err:
+        print(" ".join(err.context))
+        print("GrammarException: ", err.msg)
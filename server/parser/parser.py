@@ -122,6 +122,16 @@ class Parser(object):
         result += Parser.language.parse_file(file, parse_all=True).as_list()
         return result
 
+    @staticmethod
+    def analyse_state(text: str) -> list:
+        """
+        brief 解析一个状态定义，用于热重载时只解析改变的状态
+
+        :param text: 状态定义文本，以 ``State:`` 开头。
+        :return: 状态定义的语法树
+        """
+        return Parser.state_define.parse_string(text, parse_all=True).as_list()[0]
+
 
 if __name__ == "__main__":
     try:
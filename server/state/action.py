@@ -9,7 +9,6 @@
 """
 from abc import abstractmethod, ABCMeta
 from typing import Union, Optional
-from storm.store import Store
 from server.database.database import Database
 from server.util.GrammarException import GrammarException
 from server.user.user_state import UserState, VariableSet
@@ -87,6 +86,8 @@ class UpdateAction(Action):
     :ivar op: 更新操作类型，可以是 ``Add``、``Sub``、``Set`` 之一。
     :ivar value: 更新的值，可为字符串常量、数字常量、用户输入
     :ivar value_check: 对动作进行类型检查，查看更新值是否符合类型
+    :ivar assignment: 加载时生成的参数化赋值表达式，参数为操作数
+    :ivar statement: 加载时生成的参数化UPDATE语句，参数为操作数和用户名
     """
 
     def __init__(self, variable: str, op: str, value: Union[str, int, float], value_check: Optional[str]) -> None:
@@ -124,86 +125,135 @@ class UpdateAction(Action):
         self.variable = variable
         self.op = op
         self.value = value
+        self.assignment = self.compile(variable, op)
+        self.statement = f"UPDATE {VariableSet.__storm_table__} SET {self.assignment} WHERE username = ?"
+
+    @staticmethod
+    def compile(variable: str, op: str) -> str:
+        """生成更新语句的赋值部分。
+
+        加减运算在数据库中完成，一条语句即可原子地完成读取和修改，不需要先读出变量集。
+
+        :param variable: 变量名。
+        :param op: 更新操作类型。
+        :return: 参数化的赋值表达式，参数为操作数。
+        """
+        if op == "Add":
+            return f"{variable} = {variable} + ?"
+        if op == "Sub":
+            return f"{variable} = {variable} - ?"
+        return f"{variable} = ?"
 
     def __repr__(self) -> str:
         return f"Update {self.variable} {self.op} {self.value}"
 
+    def operand(self, request: str) -> Union[int, float, str]:
+        """计算更新操作数。
+
+        :param request: 用户输入。
+        :return: 操作数，值为 ``Input`` 时根据变量类型转换用户输入。
+        """
+        if self.value == "Input":  # 根据用户输入处理值
+            if VariableSet.type[self.variable] == "Int":
+                return int(request)
+            if VariableSet.type[self.variable] == "Real":
+                return float(request)
+            return request
+        if VariableSet.type[self.variable] == "Text":
+            return self.value[1:-1]
+        if VariableSet.type[self.variable] == "Int":
+            return int(self.value)
+        return self.value
+
+    def compute(self, value: Union[int, float, str], operand: Union[int, float, str]) -> Union[int, float, str]:
+        """根据原值和操作数计算变量的新值。
+
+        :param value: 变量原值。
+        :param operand: 操作数。
+        :return: 变量新值。
+        """
+        if self.op == "Add":
+            return value + operand
+        if self.op == "Sub":
+            return value - operand
+        return operand
+
     def exec(self, user_state: UserState, response: list[str], request: str, db: Database) -> None:
         """
         执行数据修改动作
 
+        由存储后端执行修改，SQLite后端执行加载时生成的UPDATE语句，加减运算由数据库原子地完成。
+        数据库为 ``batch`` 持久化方式时，修改进入延迟写入队列，缓存立即更新，因此同一会话随后的读取能看到修改。
+
         :param  同动作抽象基类 Action.exec
         """
-        with db.lock:
-            store = Store(db.database)
-            variable_set: VariableSet = store.get(VariableSet, user_state.username)  # 得到用户的变量集
-            if self.op == "Add":
-                value = getattr(variable_set, self.variable)
-                if self.value == "Input":  # 根据用户输入处理值
-                    if VariableSet.type[self.variable] == "Int":
-                        setattr(variable_set, self.variable, value + int(request))
-                    elif VariableSet.type[self.variable] == "Real":
-                        setattr(variable_set, self.variable, value + float(request))
-                else:
-                    setattr(variable_set, self.variable, value + self.value)
-            elif self.op == "Sub":
-                value = getattr(variable_set, self.variable)
-                if self.value == "Input":  # 根据用户输入处理值
-                    if VariableSet.type[self.variable] == "Int":
-                        setattr(variable_set, self.variable, value - int(request))
-                    elif VariableSet.type[self.variable] == "Real":
-                        setattr(variable_set, self.variable, value - float(request))
-                else:
-                    setattr(variable_set, self.variable, value - self.value)
-            elif self.op == "Set":
-                if self.value == "Input":  # 根据用户输入处理值
-                    if VariableSet.type[self.variable] == "Int":
-                        setattr(variable_set, self.variable, int(request))
-                    elif VariableSet.type[self.variable] == "Real":
-                        setattr(variable_set, self.variable, float(request))
-                    elif VariableSet.type[self.variable] == "Text":
-                        setattr(variable_set, self.variable, request)
-                else:
-                    if VariableSet.type[self.variable] == "Text":
-                        setattr(variable_set, self.variable, self.value[1:-1])
-                    else:
-                        setattr(variable_set, self.variable, self.value)
-            store.commit()
-            store.close()
+        operand = self.operand(request)  # 在请求线程中转换用户输入，错误不会延迟到写线程
+        db.apply_update(user_state.username, self, operand)
+        cache = user_state.cache
+        if cache is not None:  # 按同样的运算更新缓存，不需要读回数据库
+            user_state.cached(self.variable, self.compute(cache[self.variable], operand))
 
 
 class SpeakAction(Action):
     """产生回复动作。
 
+    回复内容在构造时编译为模板，由字面值、变量和用户输入三种片段组成，
+    执行时一次取出模板用到的全部变量。
+
     :ivar contents: 回复内容列表。
+    :ivar template: 模板片段列表，每项为（片段类型，值），相邻的字面值已合并。
+    :ivar variables: 模板用到的变量名，不含 ``$`` 前缀。
     """
 
+    LITERAL = 0
+    VARIABLE = 1
+    INPUT = 2
+
     def __init__(self, contents: list[str]) -> None:
         self.contents = contents
         for content in self.contents:
             if content[0] == '$':
                 if VariableSet.type.get(content[1:]) is None:
                     raise GrammarException(f"{content[1:]} 变量名不存在", ["Speak"] + contents)
+        self.template: list[tuple[int, str]] = []
+        self.variables: tuple[str, ...] = tuple(dict.fromkeys(
+            content[1:] for content in self.contents if content[0] == '$'
+        ))
+        for content in self.contents:
+            if content[0] == '$':  # 输出信息为变量
+                self.template.append((self.VARIABLE, content[1:]))
+            elif content[0] == '"' and content[-1] == '"':  # 输出信息为字符串
+                if len(self.template) != 0 and self.template[-1][0] == self.LITERAL:
+                    self.template[-1] = (self.LITERAL, self.template[-1][1] + content[1:-1])
+                else:
+                    self.template.append((self.LITERAL, content[1:-1]))
+            elif content == "Input":  # 输出信息为用户输入
+                self.template.append((self.INPUT, ""))
 
     def __repr__(self) -> str:
         return "Speak " + " + ".join(self.contents)
 
+    def render(self, values: dict, request: str) -> str:
+        """根据变量值和用户输入填充模板。
+
+        :param values: 从变量名映射到变量值的字典，至少包含 ``variables`` 中的变量。
+        :param request: 用户请求信息。
+        :return: 回复信息。
+        """
+        res = []
+        for kind, value in self.template:
+            if kind == self.LITERAL:
+                res.append(value)
+            elif kind == self.VARIABLE:
+                res.append(str(values[value]))
+            else:
+                res.append(request)
+        return "".join(res)
+
     def exec(self, user_state: UserState, response: list[str], request: str, db: Database) -> None:
         """
         执行客服回复动作
 
         :param  同动作抽象基类 Action.exec
         """
-        res = ""
-        with db.lock:
-            for content in self.contents:
-                if content[0] == '$':  # 输出信息为变量
-                    store = Store(db.database)
-                    variable_set = store.get(VariableSet, user_state.username)
-                    res += str(getattr(variable_set, content[1:]))
-                    store.close()
-                elif content[0] == '"' and content[-1] == '"':   # 输出信息为字符串
-                    res += content[1:-1]
-                elif content == "Input":   # 输出信息为用户输入
-                    res += request
-        response.append(res)
+        response.append(self.render(user_state.fetch(self.variables, db), request))
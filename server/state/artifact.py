@@ -0,0 +1,78 @@
+"""
+ * @file artifact.py
+ * @author LinZhi
+ * @brief 预编译模块
+        将构建好的状态机写入二进制文件，进程启动时直接加载，跳过脚本解析
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import hashlib
+import os
+import pickle
+import struct
+import sys
+from typing import Optional
+
+MAGIC = b"DSLC"
+VERSION = 7
+_HEADER = struct.Struct(">4sI32s")  # 魔数、格式版本、脚本内容哈希
+
+
+def script_hash(file: str) -> bytes:
+    """计算脚本内容的哈希值。
+
+    :param file: 脚本文件路径。
+    :return: 脚本内容的 SHA-256 摘要。
+    """
+    with open(file, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def save(file: str, artifact: str, payload: dict) -> None:
+    """写入预编译文件。
+
+    先写入临时文件再替换，多个进程同时读取时不会读到写了一半的文件。
+
+    :param file: 脚本文件路径。
+    :param artifact: 预编译文件路径。
+    :param payload: 状态机快照。
+    """
+    temp = f"{artifact}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, script_hash(file)))
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, artifact)
+
+
+def load(file: str, artifact: str) -> Optional[dict]:
+    """读取预编译文件。
+
+    :param file: 脚本文件路径。
+    :param artifact: 预编译文件路径。
+    :return: 状态机快照。文件不存在、版本不符或者脚本已经修改时返回None。
+    """
+    try:
+        with open(artifact, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                return None
+            magic, version, digest = _HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION or digest != script_hash(file):
+                return None
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+if __name__ == "__main__":
+    # 用法：python -m server.state.artifact grammar.txt grammar.dslc
+    from server.state.state import StateMachine
+    from server.util.GrammarException import GrammarException
+
+    try:
+        StateMachine(sys.argv[1], None).save(sys.argv[2])
+    except GrammarException as err:
+        print(" ".join([str(item) for item in err.context]))
+        print("GrammarException: ", err.msg)
+        sys.exit(1)
@@ -0,0 +1,87 @@
+"""
+ * @file automaton.py
+ * @author LinZhi
+ * @brief 多模式匹配模块
+        Aho-Corasick 自动机，一次扫描用户输入即可找出包含的所有模式串
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+from collections import deque
+
+INFINITY = float("inf")
+
+
+class Automaton(object):
+    """Aho-Corasick 自动机。
+
+    每个模式串带有一个值（包含判断分支的序号），匹配时返回输入中出现的模式串的最小值。
+
+    :ivar goto: 字典树的转移，每个节点为从字符映射到子节点的字典。
+    :ivar fail: 失配指针。
+    :ivar output: 每个节点及其失配链上所有模式串的最小值。
+    :ivar minimum: 所有模式串的最小值，找到它即可提前结束扫描。
+    """
+
+    def __init__(self, patterns: list[tuple[str, int]]) -> None:
+        """
+
+        :param patterns: 模式串及其对应的值。
+        """
+        self.goto: list[dict[str, int]] = [dict()]
+        self.output: list[float] = [INFINITY]
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append(dict())
+                    self.output.append(INFINITY)
+                node = child
+            self.output[node] = min(self.output[node], value)
+        self.minimum = min([value for _, value in patterns], default=INFINITY)
+
+        # 按层次构造失配指针，并沿失配链合并输出
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                state = self.fail[node]
+                while state != 0 and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] = min(self.output[child], self.output[self.fail[child]])
+                queue.append(child)
+
+    def search(self, text: str, bound: float = INFINITY) -> float:
+        """扫描一次输入，找出其中出现的模式串的最小值。
+
+        :param text: 输入字符串。
+        :param bound: 上界，只关心小于它的值。
+        :return: 出现的模式串的最小值，如果没有小于上界的值，返回上界。
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        best = min(bound, output[0])  # 空模式串总是出现
+        if best <= self.minimum:
+            return best
+        root = goto[0]
+        node = 0
+        for char in text:
+            if node == 0:
+                node = root.get(char, 0)
+                if node == 0:  # 大部分字符不是任何模式串的开头
+                    continue
+            else:
+                while node != 0 and char not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(char, 0)
+            if output[node] < best:
+                best = output[node]
+                if best <= self.minimum:
+                    break
+        return best
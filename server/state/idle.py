@@ -0,0 +1,292 @@
+"""
+ * @file idle.py
+ * @author LinZhi
+ * @brief 闲置调度模块
+        在服务器端计算会话的闲置时间，到达Wait分支的时间时执行超时转移，结果放入会话的发件箱等待客户端取走
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import heapq
+import itertools
+import time
+from threading import Condition, Event, Thread
+from typing import Callable, Optional
+
+from server.state.state import StateMachine
+
+COMPACT = 2  # 堆中的记录超过有效记录的倍数时重建堆
+COMPACT_MIN = 64  # 会话很少时不重建
+
+
+class Outbox(object):
+    """会话的待发送消息。
+
+    :ivar messages: 尚未取走的消息。
+    :ivar exit: 会话是否已经结束。
+    :ivar reset: 会话是否因超时转移到新的状态。
+    :ivar waiter: 正在等待消息的长轮询请求。
+    """
+
+    __slots__ = ("messages", "exit", "reset", "waiter")
+
+    def __init__(self) -> None:
+        self.messages: list[str] = []
+        self.exit = False
+        self.reset = False
+        self.waiter: Optional[Event] = None
+
+
+class IdleScheduler(object):
+    """
+    闲置调度器。
+    会话每次发送消息后闲置时间从0开始计算，调度器根据会话当前状态的Wait分支算出下一个超时时间，
+    全部会话的超时时间放在一个最小堆中，由一个后台线程按时间顺序执行 ``timeout_transform``，
+    客户端不需要每隔几秒发送 /echo 报告闲置时间。超时产生的回复放入会话的发件箱，由长轮询请求 ``poll`` 取走。
+    会话被Wait分支结束时仍然保留，直到客户端取走结束消息或者会话超时释放。
+    堆中的记录不删除，会话的超时时间改变后旧记录在弹出时被忽略；旧记录超过有效记录的 ``COMPACT`` 倍时重建堆，
+    堆的大小与会话数量成正比，与消息频率无关。
+    只有 ``enroll`` 登记过的会话（建立会话时告知客户端 ``push`` 为true）才安排超时时间，
+    其余会话的客户端仍然定时发送 /echo，服务器不能再执行一遍超时转移。
+    同一会话的超时转移和消息处理通过 ``UserManage.turn`` 轮流执行。
+
+    :ivar machine: 返回当前状态机的函数，热重载后使用新的状态机。
+    :ivar user_manage: 用户管理对象。
+    :ivar clients: 客户端使用推送的User对象集合。
+    :ivar deadlines: 从User对象映射到（下一个超时时间，闲置开始时间，Wait秒数）的字典。
+    :ivar heap: （超时时间，序号，User对象）的最小堆。
+    :ivar outboxes: 从User对象映射到发件箱的字典。
+    :ivar fired: 执行过的超时转移次数。
+    :ivar errors: 执行时抛出异常的超时转移次数。
+    """
+
+    def __init__(self, machine: Callable[[], StateMachine], user_manage,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+
+        :param machine: 返回当前状态机的函数。
+        :param user_manage: 用户管理对象。
+        :param clock: 单调时钟，测试时可以替换。
+        """
+        self.machine = machine
+        self.user_manage = user_manage
+        self.clock = clock
+        self.clients: set = set()
+        self.deadlines: dict = dict()
+        self.heap: list = []
+        self.sequence = itertools.count()
+        self.outboxes: dict = dict()
+        self.fired = 0
+        self.errors = 0
+        self.condition = Condition()
+        self.stopped = False
+        self.thread: Optional[Thread] = None
+
+    def schedule(self, user, idle_since: float) -> None:
+        """根据会话当前状态的Wait分支安排下一个超时时间，调用时需持有 ``condition``。
+
+        :param user: User对象。
+        :param idle_since: 闲置开始的时间。
+        """
+        state = user.state.state
+        waits = self.machine().wait[state] if state >= 0 else dict()
+        pending = [seconds for seconds in waits if seconds > user.state.last_time]
+        if len(pending) == 0:  # 当前状态没有尚未触发的Wait分支
+            self.deadlines.pop(user, None)
+            return
+        seconds = min(pending)
+        deadline = idle_since + seconds
+        self.deadlines[user] = (deadline, idle_since, seconds)
+        heapq.heappush(self.heap, (deadline, next(self.sequence), user))
+        if len(self.heap) > COMPACT * len(self.deadlines) + COMPACT_MIN:  # 旧记录过多，只保留有效记录
+            self.heap = [(entry[0], next(self.sequence), item) for item, entry in self.deadlines.items()]
+            heapq.heapify(self.heap)
+        if self.heap[0][2] is user:  # 最早的超时时间提前，唤醒后台线程
+            self.condition.notify_all()
+
+    def enroll(self, user) -> None:
+        """登记客户端使用推送的会话，闲置时间从0开始计算。
+
+        :param user: User对象。
+        """
+        with self.condition:
+            self.clients.add(user)
+            user.state.last_time = 0
+            self.schedule(user, self.clock())
+
+    def enrolled(self, user) -> bool:
+        """会话的客户端是否使用推送。"""
+        with self.condition:
+            return user in self.clients
+
+    def touch(self, user) -> None:
+        """会话发送了消息，闲置时间从0开始计算。没有登记的会话（包括无状态访客登录后的会话）不处理。
+
+        :param user: User对象。
+        """
+        with self.condition:
+            if user not in self.clients:
+                return
+            user.state.last_time = 0
+            self.schedule(user, self.clock())
+
+    def forget(self, user) -> None:
+        """会话结束，移除其超时时间和发件箱。
+
+        :param user: User对象。
+        """
+        with self.condition:
+            self.clients.discard(user)
+            self.deadlines.pop(user, None)
+            outbox = self.outboxes.pop(user, None)
+        if outbox is not None and outbox.waiter is not None:
+            outbox.waiter.set()
+
+    def fire(self, now: Optional[float] = None) -> int:
+        """执行到期的超时转移。单个会话的转移抛出异常时仍然安排下一个Wait分支，不影响其他会话。
+
+        :param now: 当前时间，为None时读取时钟。
+        :return: 执行的超时转移次数，不包括执行前会话已经结束或者发送了新消息的记录。
+        """
+        now = self.clock() if now is None else now
+        ran = 0
+        due = []
+        with self.condition:
+            while len(self.heap) != 0 and self.heap[0][0] <= now:
+                deadline, _, user = heapq.heappop(self.heap)
+                entry = self.deadlines.get(user)
+                if entry is None or entry[0] != deadline:  # 会话已经结束或者超时时间已经改变
+                    continue
+                del self.deadlines[user]
+                due.append((user, entry[1], entry[2]))
+        for user, idle_since, seconds in due:
+            if self.user_manage.users.get(user.username) is not user:  # 会话已经释放
+                continue
+            with self.user_manage.turn(user):
+                machine = self.machine()  # 取得执行权后再获取，热重载后会话可能处于新追加的状态
+                with self.condition:
+                    if user in self.deadlines or user not in self.clients:  # 等待期间会话发送了新消息或者已经结束
+                        continue
+                # 浮点数相减可能略小于Wait秒数，不能直接截断
+                elapsed = max(seconds, int(now - idle_since))
+                ran += 1
+                try:
+                    response, exit_, reset = machine.timeout_transform(user.state, elapsed)
+                except Exception as err:
+                    print("IdleScheduler: ", err)
+                    with self.condition:
+                        self.errors += 1
+                        if user not in self.deadlines:
+                            self.schedule(user, idle_since)
+                    continue
+                with self.condition:
+                    if exit_:
+                        self.deliver(user, response, True, reset)
+                        continue
+                    if reset:  # 转移到新的状态，闲置时间重新计算
+                        user.state.last_time = 0
+                        idle_since = now
+                    if len(response) != 0 or reset:
+                        self.deliver(user, response, False, reset)
+                    if user not in self.deadlines:  # 执行期间会话没有发送新消息
+                        self.schedule(user, idle_since)
+        with self.condition:
+            self.fired += ran
+        return ran
+
+    def deliver(self, user, messages: list[str], exit_: bool, reset: bool) -> None:
+        """把消息放入会话的发件箱，唤醒等待的长轮询请求，调用时需持有 ``condition``。"""
+        outbox = self.outboxes.get(user)
+        if outbox is None:
+            outbox = self.outboxes[user] = Outbox()
+        outbox.messages.extend(messages)
+        outbox.exit = outbox.exit or exit_
+        outbox.reset = outbox.reset or reset
+        if outbox.waiter is not None:
+            outbox.waiter.set()
+
+    def wait(self, user, waiter) -> bool:
+        """登记等待会话消息的长轮询请求。
+
+        :param user: User对象。
+        :param waiter: 有 ``set`` 方法的对象，有新消息或者会话结束时在调度线程中调用，
+            可以是 ``threading.Event``，也可以是唤醒协程的对象。
+        :return: 发件箱中已经有消息时不登记，返回True。
+        """
+        with self.condition:
+            outbox = self.outboxes.get(user)
+            if outbox is not None and (len(outbox.messages) != 0 or outbox.exit):
+                return True
+            if outbox is None:
+                outbox = self.outboxes[user] = Outbox()
+            outbox.waiter = waiter
+            return False
+
+    def take(self, user) -> (list[str], bool, bool):
+        """取走会话发件箱中的消息。
+
+        :param user: User对象。
+        :return: 消息列表、会话是否已经结束、是否转移到新的状态。没有消息时返回空列表。
+        """
+        with self.condition:
+            outbox = self.outboxes.pop(user, None)
+        if outbox is None:
+            return [], False, False
+        return outbox.messages, outbox.exit, outbox.reset
+
+    def poll(self, user, timeout: float) -> (list[str], bool, bool):
+        """长轮询，在当前线程中等待会话的发件箱中有消息。
+
+        :param user: User对象。
+        :param timeout: 最长等待秒数。
+        :return: 与 ``take`` 相同。
+        """
+        waiter = Event()
+        if not self.wait(user, waiter):
+            waiter.wait(timeout)
+        return self.take(user)
+
+    def stats(self) -> dict:
+        """调度统计。
+
+        :return: 包含已安排超时时间的会话数量 ``scheduled``、堆中的记录数量 ``heap``、
+            有待发送消息的会话数量 ``outboxes``、执行过的超时转移次数 ``fired``、
+            抛出异常的次数 ``errors`` 的字典。
+        """
+        with self.condition:
+            return {"scheduled": len(self.deadlines), "heap": len(self.heap), "outboxes": len(self.outboxes),
+                    "fired": self.fired, "errors": self.errors}
+
+    def start(self) -> None:
+        """启动后台线程。"""
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程。"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        """后台线程主循环，睡眠到最早的超时时间。"""
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                        continue
+                    remaining = self.heap[0][0] - self.clock()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.stopped:
+                    return
+            try:
+                self.fire()
+            except Exception as err:  # 单个会话出错不影响其他会话
+                print("IdleScheduler: ", err)
@@ -0,0 +1,160 @@
+"""
+ * @file jobs.py
+ * @author LinZhi
+ * @brief 批量任务模块
+        对满足条件的全部用户执行同一个更新动作，例如按月计息、清零计数
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import argparse
+import re
+import sys
+import time
+from typing import Optional, Union
+
+from server.database.database import Database
+from server.state.action import UpdateAction
+from server.user.user_state import VariableSet
+from server.util.GrammarException import GrammarException
+
+CHUNK_SIZE = 1000
+_CONDITION = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|<|>|=)\s*(.+?)\s*$")
+
+
+class BulkUpdateJob(object):
+    """
+    批量更新任务。
+    更新动作与脚本中的 ``Update`` 动作相同，构造时同样按 ``VariableSet.type`` 检查类型。
+    SQLite后端用一条集合UPDATE语句完成，``chunk_size`` 不为None时按rowid区间分块，每块一个事务，
+    写锁每次只持有一块的时间，会话的更新可以在两块之间提交；分片模式下逐个分片执行。
+
+    :ivar update: 更新动作。
+    :ivar operand: 已经转换类型的操作数。
+    :ivar condition: 过滤条件（变量名，比较运算符，值），为None时更新全部用户。
+    :ivar chunk_size: 每个事务最多覆盖的行数，为None时用一个事务完成。
+    """
+
+    def __init__(self, variable: str, op: str, value: str, where: Optional[str] = None,
+                 chunk_size: Optional[int] = CHUNK_SIZE) -> None:
+        """
+
+        :param variable: 变量名。
+        :param op: 更新操作类型，``Add``、``Sub``、``Set`` 之一。
+        :param value: 操作数的文本。
+        :param where: 过滤条件，例如 ``billing > 0``，为None时更新全部用户。
+        :param chunk_size: 每个事务最多覆盖的行数。
+        :exception GrammarException 变量不存在或者类型不符
+        """
+        if op not in ("Add", "Sub", "Set"):
+            raise GrammarException(f"未知的更新操作 {op}", ["Update", variable, op, value])
+        literal = self.literal(variable, value, ["Update", variable, op, value])
+        if VariableSet.type.get(variable) == "Text":
+            literal = '"' + literal + '"'  # 与脚本中的字符串字面值相同，带引号
+        self.update = UpdateAction(variable, op, literal, None)
+        self.operand = self.update.operand("")
+        self.condition = None if where is None else self.parse_condition(where)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def literal(variable: str, value: str, context: list) -> Union[int, float, str]:
+        """按变量类型转换字面值，整数变量的字面值先转换为实数，由 UpdateAction 检查是否为整数。
+
+        :param variable: 变量名。
+        :param value: 字面值的文本。
+        :param context: 出错时的上下文。
+        :return: 转换后的值。
+        :exception GrammarException 变量不存在或者字面值不是数字
+        """
+        type_ = VariableSet.type.get(variable)
+        if type_ is None or variable == "password":
+            raise GrammarException(f"{variable} 变量名不存在", context)
+        if type_ == "Text":
+            return value
+        try:
+            return float(value)
+        except ValueError:
+            raise GrammarException(f"{value} 不是数字", context)
+
+    def parse_condition(self, where: str) -> tuple:
+        """解析过滤条件。
+
+        :param where: 形如 ``变量名 比较运算符 值`` 的条件。
+        :return: （变量名，比较运算符，值）。
+        :exception GrammarException 条件格式错误、变量不存在或者类型不符
+        """
+        match = _CONDITION.match(where)
+        if match is None:
+            raise GrammarException("过滤条件格式错误", ["where", where])
+        name, compare, value = match.groups()
+        value = self.literal(name, value.strip("\"'"), ["where", where])
+        if VariableSet.type[name] == "Int":
+            if int(value) != value:
+                raise GrammarException("过滤条件的值不为 整数!", ["where", where])
+            value = int(value)
+        return name, compare, value
+
+    def run(self, db: Database, user_manage=None) -> dict:
+        """执行任务。
+
+        :param db: 数据库对象。
+        :param user_manage: 用户管理对象，不为None时任务完成后丢弃在线会话的变量缓存，下次读取时重新载入。
+        :return: 包含更新行数 ``rows``、耗时 ``seconds``、每秒行数 ``rows_per_second``、
+            单个事务持有写锁的最长秒数 ``max_lock_seconds`` 的字典。
+        """
+        start = time.perf_counter()
+        rows, longest = db.bulk_update(self.update, self.operand, self.condition, self.chunk_size)
+        seconds = time.perf_counter() - start
+        if user_manage is not None:
+            for user in user_manage.users.values():
+                user.state.invalidate()
+        return {
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+            "max_lock_seconds": longest,
+        }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """命令行入口。
+
+    命令行在独立的进程中运行，无法丢弃服务进程中在线会话的变量缓存，已登录的会话会继续使用旧值，
+    因此应在服务停止时执行；服务运行时使用管理路由 /job，在服务进程内执行并丢弃在线会话的缓存。
+
+    用法::
+
+        python -m server.state.jobs grammar.txt dsl.db billing Add 0.5 --where "billing > 0"
+        python -m server.state.jobs grammar.txt dsl.db trans Set 0 --shards 4
+    """
+    from server.state.state import StateMachine
+
+    parser = argparse.ArgumentParser(prog="python -m server.state.jobs", description="批量更新用户变量")
+    parser.add_argument("script", help="脚本文件，决定变量集")
+    parser.add_argument("database", help="数据库路径")
+    parser.add_argument("variable", help="变量名")
+    parser.add_argument("op", choices=["Add", "Sub", "Set"], help="更新操作")
+    parser.add_argument("value", help="操作数")
+    parser.add_argument("--where", default=None, help="过滤条件，例如 \"billing > 0\"")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="每个事务的行数，0表示一个事务完成")
+    parser.add_argument("--shards", type=int, default=1, help="分片数量")
+    args = parser.parse_args(argv)
+
+    try:
+        machine = StateMachine(args.script, args.database, persistent=True, shards=args.shards)
+        job = BulkUpdateJob(args.variable, args.op, args.value, args.where, args.chunk or None)
+    except GrammarException as err:
+        print(" ".join([str(item) for item in err.context]), file=sys.stderr)
+        print("GrammarException: ", err.msg, file=sys.stderr)
+        return 1
+    try:
+        result = job.run(machine.db)
+    finally:
+        machine.db.close()
+    print(f"更新 {result['rows']} 行，耗时 {result['seconds']:.3f} 秒，{result['rows_per_second']:.0f} 行/秒，"
+          f"单个事务最长 {result['max_lock_seconds'] * 1000:.1f} 毫秒", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
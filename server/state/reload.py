@@ -0,0 +1,194 @@
+"""
+ * @file reload.py
+ * @author LinZhi
+ * @brief 热重载模块
+        监视脚本文件，只重新构建改变的状态，并原子地替换状态机
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import os
+import re
+from threading import Event, Lock, Thread
+from typing import Optional
+
+from server.state.state import StateMachine
+from server.util.GrammarException import GrammarException
+
+
+class ScriptReloader(object):
+    """脚本热重载类。
+
+    脚本按行首的 ``Basic:``、``Var:``、``State:`` 切分为段，重载时只解析和构建文本改变的状态。
+    已有状态的编号保持不变，新状态追加在末尾，删除的状态留下空位，
+    因此未改变状态中的Goto动作和在线用户的状态编号仍然有效，重载的代价与修改量成正比。
+    新状态机构建完成后才替换 ``machine``，正在处理的请求继续使用原状态机。
+
+    :ivar machine: 当前使用的状态机。
+    :ivar user_manage: 用户管理对象，用于重新映射在线用户的状态。
+    :ivar engine: 解析器。
+    :ivar interval: 检查脚本文件是否修改的间隔秒数。
+    :ivar header: 脚本中Basic与Var段的文本。
+    :ivar blocks: 从状态名映射到状态定义文本的字典。
+    :ivar referrers: 从状态名映射到包含Goto该状态动作的状态名集合。
+    :ivar lock: 互斥锁，同一时间只进行一次重载。
+    """
+
+    block_start = re.compile(r"^(?=(?:Basic|Var|State):)", re.M)
+    state_name = re.compile(r"State:\s+([A-Za-z]+)")
+
+    def __init__(self, machine: StateMachine, user_manage=None, engine: str = "pyparsing", interval: float = 1.0) -> None:
+        """
+
+        :param machine: 初始状态机。
+        :param user_manage: 用户管理对象，为None时不重新映射在线用户。
+        :param engine: 解析器，``pyparsing`` 或者 ``descent``。
+        :param interval: 检查间隔秒数。
+        """
+        self.machine = machine
+        self.user_manage = user_manage
+        self.engine = engine
+        self.interval = interval
+        self.lock = Lock()
+        self.mtime = os.stat(machine.file).st_mtime_ns
+        self.header, self.blocks = self.split(self.read())
+        self.referrers: dict[str, set[str]] = {name: set() for name in machine.state_map}
+        for name, index in machine.state_map.items():
+            for target in machine.targets(index):
+                self.referrers[machine.states[target]].add(name)
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def read(self) -> str:
+        with open(self.machine.file, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def split(self, text: str) -> (str, dict[str, str]):
+        """将脚本切分为段。
+
+        :param text: 脚本文本。
+        :return: Basic与Var段的文本，以及从状态名映射到状态定义文本的字典。
+        :exception GrammarException 状态缺少名字或者重名
+        """
+        header = []
+        blocks = {}
+        for block in self.block_start.split(text):
+            if block.startswith("State:"):
+                match = self.state_name.match(block)
+                if match is None:
+                    raise GrammarException("状态定义缺少状态名", [block.split("\n")[0]])
+                if match.group(1) in blocks:
+                    raise GrammarException("状态命名冲突", [match.group(1)])
+                blocks[match.group(1)] = block.rstrip()
+            else:
+                header.append(block.rstrip())
+        return "\n".join(header), blocks
+
+    def reload(self) -> bool:
+        """重新加载脚本。
+
+        :return: 如果脚本中的状态发生了改变并完成替换，返回True；否则返回False。
+        :exception GrammarException 新脚本存在错误，此时继续使用原状态机
+        """
+        with self.lock:
+            header, blocks = self.split(self.read())
+            if header != self.header:
+                raise GrammarException("Basic或Var定义已改变，需要重启服务", [])
+            if "Begin" not in blocks:
+                raise GrammarException("没有起始状态", [])
+            changed = {name for name, text in blocks.items() if self.blocks.get(name) != text}
+            removed = set(self.blocks) - set(blocks)
+            if len(changed) == 0 and len(removed) == 0:
+                return False
+
+            old = self.machine
+            machine = old.fork()
+            definitions = {name: machine.parse_state(blocks[name], self.engine) for name in changed}
+            # 先登记新状态和登录验证标志，构建Goto动作时需要目标状态的编号和标志
+            relogined = set()
+            for name, definition in definitions.items():
+                logined = len(definition[2]) != 0
+                if name not in machine.state_map:
+                    machine.add_state(name, logined)
+                elif machine.verified[machine.state_map[name]] != logined:
+                    machine.verified[machine.state_map[name]] = logined
+                    relogined.add(name)
+            if machine.verified[0]:
+                raise GrammarException("初始化状态必须不为Verified", [])
+            removed_index = {machine.remove_state(name) for name in removed}
+            for name in removed:
+                if len(self.referrers[name] - changed - removed) != 0:  # 未改变的状态仍然转移到被删除的状态
+                    raise GrammarException("Goto状态不存在", ["Goto", name])
+
+            # 目标状态的登录验证标志改变时，转移到它的状态也需要重新构建
+            rebuild = set(changed)
+            for name in relogined:
+                rebuild |= self.referrers[name] - removed
+            for name in rebuild:
+                if name not in definitions:
+                    definitions[name] = machine.parse_state(blocks[name], self.engine)
+                machine.build_state(definitions[name])
+            machine.resolve()
+
+            # 新状态机构建成功，更新引用关系并替换
+            for name in rebuild | removed:
+                if name in old.state_map:
+                    for target in old.targets(old.state_map[name]):
+                        self.referrers[old.states[target]].discard(name)
+            for name in removed:
+                del self.referrers[name]
+            for name in rebuild:
+                self.referrers.setdefault(name, set())
+                for target in machine.targets(machine.state_map[name]):
+                    self.referrers.setdefault(machine.states[target], set()).add(name)
+            self.machine = machine
+            self.header, self.blocks = header, blocks
+            self.remap(old, machine, removed_index)
+            return True
+
+    def remap(self, old: StateMachine, new: StateMachine, removed: set[int]) -> None:
+        """按状态名重新映射在线用户的状态编号。
+
+        已有状态的编号在重载前后不变，只有处于被删除状态的用户需要移动，移动到起始状态。
+
+        :param old: 原状态机。
+        :param new: 新状态机。
+        :param removed: 被删除的状态编号。
+        """
+        if self.user_manage is None or len(removed) == 0:
+            return
+        for user in self.user_manage.users.values():
+            with user.state.lock:
+                if user.state.state in removed:
+                    user.state.state = new.state_map.get(old.states[user.state.state], 0)
+
+    def check(self) -> None:
+        """检查脚本文件是否修改，修改时重新加载。"""
+        try:
+            mtime = os.stat(self.machine.file).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            self.reload()
+        except GrammarException as err:
+            print(" ".join([str(item) for item in err.context]))
+            print("GrammarException: ", err.msg)
+
+    def start(self) -> None:
+        """启动后台线程监视脚本文件。"""
+
+        def watch() -> None:
+            while not self.stopped.wait(self.interval):
+                self.check()
+
+        self.thread = Thread(target=watch, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """停止监视脚本文件。"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
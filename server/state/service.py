@@ -7,8 +7,11 @@
  * @date 2022-11-28
  * @copyright Copyright (c) 2022
 """
+from typing import Optional
+
 from server.state.action import Action
-from server.state.judgement import Judgement
+from server.state.automaton import Automaton
+from server.state.judgement import Judgement, EqualJudgement, ContainJudgement
 
 
 class Service(object):
@@ -24,3 +27,59 @@ class Service(object):
 
     def __repr__(self) -> str:
         return repr(self.judgement) + ": " + "; ".join([repr(i) for i in self.actions])
+
+
+class ServiceTable(object):
+    """一个状态的条件分支表，按声明顺序匹配第一个满足条件的分支。
+
+    相等判断分支预先按去除首尾空白的字符串建立索引，一次查找即可得到第一个相等的分支；
+    包含判断分支较多时构造一个 Aho-Corasick 自动机，一次扫描即可得到第一个满足的包含判断分支；
+    其余分支仅检查声明在已找到分支之前的部分，匹配结果与按顺序逐个检查相同。
+
+    :cvar automaton_threshold: 包含判断分支不少于该数量时才构造自动机，否则逐个检查更快。
+    :ivar services: 按声明顺序排列的条件分支。
+    :ivar equal: 从字符串映射到第一个与之相等的相等判断分支序号的字典。
+    :ivar automaton: 包含判断分支的自动机，值为分支序号。
+    :ivar others: 其他需要逐个检查的分支序号，按声明顺序排列。
+    """
+
+    automaton_threshold = 64
+
+    def __init__(self, services: list[Service]) -> None:
+        self.services = services
+        self.equal: dict[str, int] = dict()
+        self.automaton: Optional[Automaton] = None
+        self.others: list[int] = []
+        contains = [
+            (service.judgement.string, index)
+            for index, service in enumerate(services)
+            if isinstance(service.judgement, ContainJudgement)
+        ]
+        if len(contains) >= self.automaton_threshold:
+            self.automaton = Automaton(contains)
+        for index, service in enumerate(services):
+            if isinstance(service.judgement, EqualJudgement):
+                self.equal.setdefault(service.judgement.string.strip(), index)
+            elif self.automaton is None or not isinstance(service.judgement, ContainJudgement):
+                self.others.append(index)
+
+    def __repr__(self) -> str:
+        return repr(self.services)
+
+    def match(self, msg: str) -> Optional[Service]:
+        """查找第一个满足条件的分支。
+
+        :param msg: 用户输入。
+        :return: 满足条件的分支，没有分支满足条件时返回None。
+        """
+        best = self.equal.get(msg.strip(), len(self.services))
+        if self.automaton is not None:
+            best = self.automaton.search(msg, best)
+        for index in self.others:
+            if index >= best:
+                break
+            if self.services[index].judgement.check(msg):
+                return self.services[index]
+        if best < len(self.services):
+            return self.services[best]
+        return None
@@ -8,11 +8,11 @@
  * @copyright Copyright (c) 2022
 """
 
+import copy
+import gc
 from typing import Optional
-from storm.locals import Store
-from storm.properties import Unicode, Int, Float
-from pyparsing import ParseException
 
+from server.state import artifact as compiled
 from server.state.action import (
     Action,
     ExitAction,
@@ -20,7 +20,7 @@ from server.state.action import (
     UpdateAction,
     SpeakAction,
 )
-from server.state.service import Service
+from server.state.service import Service, ServiceTable
 from server.user.user_state import UserState, VariableSet
 from server.database.database import Database
 from server.state.judgement import (
@@ -29,162 +29,372 @@ from server.state.judgement import (
     TypeJudgement,
     EqualJudgement,
 )
-from server.parser.parser import Parser
 from server.util.GrammarException import GrammarException
 
 
 class StateMachine(object):
     """状态机。
 
+    :ivar file: 脚本文件路径。
     :ivar states: 状态集合。
+    :ivar state_map: 从状态名映射到状态编号的字典。
+    :ivar verified: 状态是否需要登录验证。
+    :ivar variables: 脚本定义的变量集，每项为（变量名，类型，默认值）。
     :ivar db: 数据库
     :ivar speak_action: 状态默认的speak语句集合。
+    :ivar speak_vars: 状态默认的speak语句用到的全部变量，回复时一次取出。
     :ivar service: 状态的条件分支集合。
+    :ivar dispatch: 状态的条件分支表，用于快速匹配用户输入。
     :ivar default: 状态的默认分支。
     :ivar wait: 状态的超时转移分支。
+    :ivar pending: 目标状态尚未回填的Goto动作及其语法树。
+    :ivar schema_version: 用户数据表的结构版本号。
     """
 
-    def __init__(self, file: str, path: str) -> None:
+    def __init__(
+        self,
+        file: str,
+        path: Optional[str],
+        artifact: Optional[str] = None,
+        engine: str = "pyparsing",
+        durability: str = "commit",
+        persistent: bool = False,
+        backend: str = "sqlite",
+        shards: int = 1,
+    ) -> None:
         """
 
         :param file: 脚本文件路径
-        :param path: 数据库文件路径
+        :param path: 数据库文件路径，为None时不连接数据库（仅用于编译脚本）
+        :param artifact: 预编译文件路径，文件与脚本内容一致时直接加载，否则重新解析脚本
+        :param engine: 解析器，``pyparsing`` 或者 ``descent``（递归下降解析器）
+        :param durability: 数据库持久化方式，``commit`` 或者 ``batch``（延迟写入队列批量提交）
+        :param persistent: 是否保留已有的数据库文件，保留时按脚本定义迁移用户数据表
+        :param backend: 存储后端，``sqlite`` 或者 ``columnar``（进程内列式存储）
+        :param shards: SQLite数据库的分片数量
         """
-        try:
-            result = Parser.analyse_file(file)
-        except ParseException as e:
-            raise GrammarException(e.__str__(), [e.line])
+        self.file = file
         self.states: list[str] = []
-        self.db = Database(path)
-        verified: list[bool] = []
+        self.verified: list[bool] = []
+        self.variables: list[tuple] = []
         self.speak_action: list[list[Action]] = []
+        self.speak_vars: list[tuple[str, ...]] = []
         self.service: list[list[Service]] = []
+        self.dispatch: list[ServiceTable] = []
         self.default: list[list[Action]] = []
         self.wait: list[dict[int, list[Action]]] = []
-        self.basic = result[0]
-        self.create_db = False
+        self.pending: list[tuple[GotoAction, list]] = []
+        payload = compiled.load(file, artifact) if artifact is not None else None
+        if payload is not None:
+            self.restore(payload)
+        else:
+            self.build(self.parse(file, engine))
         self.db_name = str(self.basic[1][1])  # 对应脚本数据库表
-        if str(self.basic[2][1]) == "True":
-            self.create_db = True
-        create_table_statement = [
-            "CREATE TABLE " + self.db_name + "(username TEXT PRIMARY KEY, password TEXT"
-        ]  # 建表语句
-        # 处理变量定义和状态集
+        self.create_db = str(self.basic[2][1]) == "True"
+        self.db = None
+        if path is not None:
+            self.db = Database(path, durability, persistent=persistent, backend=backend, shards=shards)
+
+        # 建立数据库，持久化模式下已有数据时只补充新增的变量
+        self.schema_version = 0
+        if self.db is not None:
+            self.schema_version = self.db.prepare(self.db_name, self.variables, self.create_db)
+
+    @staticmethod
+    def parse(file: str, engine: str = "pyparsing") -> list:
+        """解析脚本文件。
+
+        解析器在此处才导入，加载预编译文件或者使用递归下降解析器时不需要pyparsing。
+
+        :param file: 脚本文件路径
+        :param engine: 解析器，``pyparsing`` 或者 ``descent``
+        :return: 语法树
+        :exception GrammarException 脚本存在语法错误
+        """
+        if engine == "descent":
+            from server.parser.descent import DescentParser
+
+            return DescentParser.analyse_file(file)
+
+        from pyparsing import ParseException
+        from server.parser.parser import Parser
+
+        try:
+            return Parser.analyse_file(file)
+        except ParseException as e:
+            raise GrammarException(e.__str__(), [e.line])
+
+    @staticmethod
+    def parse_state(text: str, engine: str = "pyparsing") -> list:
+        """解析一个状态定义。
+
+        :param text: 状态定义文本
+        :param engine: 解析器，``pyparsing`` 或者 ``descent``
+        :return: 状态定义的语法树
+        :exception GrammarException 状态定义存在语法错误
+        """
+        if engine == "descent":
+            from server.parser.descent import DescentParser
+
+            return DescentParser.analyse_state(text)
+
+        from pyparsing import ParseException
+        from server.parser.parser import Parser
+
+        try:
+            return Parser.analyse_state(text)
+        except ParseException as e:
+            raise GrammarException(e.__str__(), [e.line])
+
+    def build(self, result: list) -> None:
+        """根据语法树构建状态机。
+
+        状态按出现顺序编号，起始状态固定为0号。各个状态只构建一次，
+        Goto动作的目标状态可能尚未出现，先记录下来，全部状态构建完成后统一回填编号。
+        构建过程只创建大量无环的对象，期间暂停垃圾回收，避免随对象数量增长的反复全量扫描。
+
+        :param result: 语法树
+        :exception GrammarException 脚本存在语义错误
+        """
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.build_states(result)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def build_states(self, result: list) -> None:
+        """构建状态机，参见 build。
+
+        :param result: 语法树
+        """
+        self.basic = result[0]
+        self.variables = []
+        # 变量可以在使用它的状态之后定义，先处理变量定义
         for definition in result:
-            if definition[0] == "Var:":  # 处理变量定义
+            if definition[0] == "Var:":
                 for clause in definition[1]:
                     if VariableSet.type.get(clause[0]) is not None:
                         raise GrammarException("变量命名冲突", clause)
-                    if clause[1] == "Int":
-                        setattr(VariableSet, clause[0][1:], Int(default=clause[2]))
-                        VariableSet.type[clause[0][1:]] = "Int"
-                        create_table_statement.append(f"{clause[0][1:]} INT")
-                    elif clause[1] == "Real":
-                        setattr(
-                            VariableSet, clause[0][1:], Float(default=clause[2])
-                        )
-                        VariableSet.type[clause[0][1:]] = "Real"
-                        create_table_statement.append(f"{clause[0][1:]} REAL")
-                    elif clause[1] == "Text":
-                        setattr(
-                            VariableSet,
-                            clause[0][1:],
-                            Unicode(default=clause[2][1:-1]),
-                        )
-                        VariableSet.type[clause[0][1:]] = "Text"
-                        create_table_statement.append(f"{clause[0][1:]} TEXT")
-            elif definition[0] == "State:":  # 处理状态定义
-                if definition[1] not in self.states:
-                    self.states.append(definition[1])  # 将状态名加入状态集
-                    if len(definition[2]) == 0:
-                        verified.append(False)
+                    if clause[1] == "Text":
+                        default = clause[2][1:-1]
                     else:
-                        verified.append(True)
-                else:
-                    raise GrammarException("状态命名冲突", definition[:1])
+                        default = clause[2]
+                    VariableSet.define(clause[0][1:], clause[1], default)
+                    self.variables.append((clause[0][1:], clause[1], default))
 
-        if "Begin" not in self.states:
-            raise GrammarException("没有起始状态", [])
-        else:
-            beign_index = self.states.index("Begin")
-            if verified[beign_index]:
-                raise GrammarException("初始化状态必须不为Verified", [])
-            verified[beign_index] = verified[0]
-            verified[0] = False
-            self.states[beign_index] = self.states[0]
-            self.states[0] = "Begin"
-
-        # 建立数据库
-        if self.create_db:
-            with self.db.lock:
-                store = Store(self.db.database)
-                store.execute(",".join(create_table_statement) + ")")
-                store.add(VariableSet("Guest", ""))  # 创建默认的访客用户
-                store.commit()
-                store.close()
-
-        state_index = -1
-        # 处理各个分支和动作
+        # 0号位置留给起始状态
+        self.states = [None]
+        self.verified = [False]
+        self.state_map = dict()
+        self.speak_action = [[]]
+        self.speak_vars = [()]
+        self.service = [[]]
+        self.dispatch = [ServiceTable([])]
+        self.default = [[]]
+        self.wait = [dict()]
+        self.pending = []
         for definition in result:
             if definition[0] != "State:":
                 continue
-            state_index += 1
+            name = definition[1]
+            logined = len(definition[2]) != 0
+            if name in self.state_map:
+                raise GrammarException("状态命名冲突", definition[:1])
+            if name == "Begin":
+                if logined:
+                    raise GrammarException("初始化状态必须不为Verified", [])
+                self.states[0] = name
+                self.state_map[name] = 0
+            else:
+                self.add_state(name, logined)
+            self.build_state(definition)
 
-            # Speak子句
-            self.speak_action.append([])
-            if len(definition[3]) != 0:
-                self.construct_action(
-                    definition[3], self.speak_action[-1], state_index, verified, None
-                )
+        if "Begin" not in self.state_map:
+            raise GrammarException("没有起始状态", [])
+        self.resolve()
 
-            # Case子句
-            self.service.append([])
-            if len(definition[4]) != 0:
-                for case_list in definition[4]:
-                    value_check = "Text"
-                    if case_list[1] == "Length":
-                        self.service[-1].append(
-                            Service(LengthJudgement(case_list[2], case_list[3]))
-                        )
-                    elif case_list[1] == "Contain:":
-                        self.service[-1].append(
-                            Service(ContainJudgement(case_list[2][1:-1]))
-                        )
-                    elif case_list[1] == "Type":
-                        self.service[-1].append(Service(TypeJudgement(case_list[2])))
-                        if case_list[2] == "Int" or case_list[2] == "Real":
-                            value_check = case_list[2]
-                    elif case_list[1][0] == '"' and case_list[1][-1] == '"':
-                        self.service[-1].append(
-                            Service(EqualJudgement(case_list[1][1:-1]))
-                        )
-
-                    self.construct_action(
-                        case_list[-1],
-                        self.service[-1][-1].actions,
-                        state_index,
-                        verified,
-                        value_check,
-                    )
+    def build_state(self, definition: list) -> None:
+        """根据语法树构建一个状态的各个分支和动作，状态名必须已经在状态集中。
+
+        构建后需要调用 resolve 回填Goto动作的目标状态。
 
-            # Default子句
-            self.default.append([])
+        :param definition: 状态定义的语法树
+        :exception GrammarException 状态存在语义错误
+        """
+        state_index = self.state_map[definition[1]]
+        verified = self.verified
+
+        # Speak子句
+        speak_action: list[Action] = []
+        if len(definition[3]) != 0:
             self.construct_action(
-                definition[5][1], self.default[-1], state_index, verified, "Text"
+                definition[3], speak_action, state_index, verified, None
             )
 
-            # Timeout子句
-            self.wait.append(dict())
-            if len(definition[6]) != 0:
-                for timeout_list in definition[6]:
-                    self.wait[-1][timeout_list[1]] = []
-                    self.construct_action(
-                        timeout_list[-1],
-                        self.wait[-1][timeout_list[1]],
-                        state_index,
-                        verified,
-                        None,
+        # Case子句
+        service: list[Service] = []
+        if len(definition[4]) != 0:
+            for case_list in definition[4]:
+                value_check = "Text"
+                if case_list[1] == "Length":
+                    service.append(
+                        Service(LengthJudgement(case_list[2], case_list[3]))
+                    )
+                elif case_list[1] == "Contain:":
+                    service.append(
+                        Service(ContainJudgement(case_list[2][1:-1]))
                     )
+                elif case_list[1] == "Type":
+                    service.append(Service(TypeJudgement(case_list[2])))
+                    if case_list[2] == "Int" or case_list[2] == "Real":
+                        value_check = case_list[2]
+                elif case_list[1][0] == '"' and case_list[1][-1] == '"':
+                    service.append(
+                        Service(EqualJudgement(case_list[1][1:-1]))
+                    )
+
+                self.construct_action(
+                    case_list[-1],
+                    service[-1].actions,
+                    state_index,
+                    verified,
+                    value_check,
+                )
+
+        # Default子句
+        default: list[Action] = []
+        self.construct_action(
+            definition[5][1], default, state_index, verified, "Text"
+        )
+
+        # Timeout子句
+        wait: dict[int, list[Action]] = dict()
+        if len(definition[6]) != 0:
+            for timeout_list in definition[6]:
+                wait[timeout_list[1]] = []
+                self.construct_action(
+                    timeout_list[-1],
+                    wait[timeout_list[1]],
+                    state_index,
+                    verified,
+                    None,
+                )
+
+        self.speak_action[state_index] = speak_action
+        self.speak_vars[state_index] = tuple(dict.fromkeys(
+            name for action in speak_action for name in action.variables
+        ))
+        self.service[state_index] = service
+        self.dispatch[state_index] = ServiceTable(service)
+        self.default[state_index] = default
+        self.wait[state_index] = wait
+
+    def fork(self) -> "StateMachine":
+        """复制状态机，用于热重载。
+
+        新状态机与原状态机共享各个状态的分支和动作对象以及数据库，但状态表本身是独立的，
+        替换新状态机中的状态不影响仍在使用原状态机的请求。
+
+        :return: 新状态机
+        """
+        machine = copy.copy(self)
+        machine.states = list(self.states)
+        machine.verified = list(self.verified)
+        machine.state_map = dict(self.state_map)
+        machine.speak_action = list(self.speak_action)
+        machine.speak_vars = list(self.speak_vars)
+        machine.service = list(self.service)
+        machine.dispatch = list(self.dispatch)
+        machine.default = list(self.default)
+        machine.wait = list(self.wait)
+        machine.pending = []
+        return machine
+
+    def add_state(self, name: str, logined: bool) -> int:
+        """在状态集末尾添加一个空状态，已有状态的编号不变。
+
+        :param name: 状态名
+        :param logined: 状态是否需要登录验证
+        :return: 新状态编号
+        """
+        self.state_map[name] = len(self.states)
+        self.states.append(name)
+        self.verified.append(logined)
+        self.speak_action.append([])
+        self.speak_vars.append(())
+        self.service.append([])
+        self.dispatch.append(ServiceTable([]))
+        self.default.append([])
+        self.wait.append(dict())
+        return self.state_map[name]
+
+    def remove_state(self, name: str) -> int:
+        """删除一个状态，其编号保留为空位，处于该状态的用户在下一条消息时回到起始状态。
+
+        :param name: 状态名
+        :return: 被删除的状态编号
+        """
+        index = self.state_map.pop(name)
+        self.states[index] = None
+        self.verified[index] = False
+        self.speak_action[index] = []
+        self.speak_vars[index] = ()
+        self.service[index] = []
+        self.dispatch[index] = ServiceTable([])
+        self.default[index] = [GotoAction(0, False)]
+        self.wait[index] = dict()
+        return index
+
+    def targets(self, index: int) -> set[int]:
+        """一个状态中所有Goto动作的目标状态。
+
+        :param index: 状态编号
+        :return: 目标状态编号集合
+        """
+        actions = list(self.speak_action[index]) + list(self.default[index])
+        for case in self.service[index]:
+            actions += case.actions
+        for wait_actions in self.wait[index].values():
+            actions += wait_actions
+        return {action.next for action in actions if isinstance(action, GotoAction)}
+
+    def snapshot(self) -> dict:
+        """导出状态机快照，用于写入预编译文件。
+
+        :return: 状态表、条件分支、动作列表和变量集定义。
+        """
+        return {
+            "basic": self.basic,
+            "states": self.states,
+            "state_map": self.state_map,
+            "verified": self.verified,
+            "variables": self.variables,
+            "speak_action": self.speak_action,
+            "speak_vars": self.speak_vars,
+            "service": self.service,
+            "dispatch": self.dispatch,
+            "default": self.default,
+            "wait": self.wait,
+        }
+
+    def restore(self, payload: dict) -> None:
+        """从快照恢复状态机，并重新定义变量集。
+
+        :param payload: 状态机快照。
+        """
+        for key, value in payload.items():
+            setattr(self, key, value)
+        for name, type_, default in self.variables:
+            VariableSet.define(name, type_, default)
+
+    def save(self, artifact: str) -> None:
+        """将状态机写入预编译文件，以脚本内容哈希作为预编译文件的键。
+
+        :param artifact: 预编译文件路径。
+        """
+        compiled.save(self.file, artifact, self.snapshot())
 
     def construct_action(
         self,
@@ -206,14 +416,8 @@ class StateMachine(object):
             if language[0] == "Exit":
                 target.append(ExitAction())
             elif language[0] == "Goto":
-                if language[1] not in self.states:
-                    raise GrammarException("Goto状态不存在", language)
-                target.append(
-                    GotoAction(
-                        self.states.index(language[1]),
-                        logined[self.states.index(language[1])],
-                    )
-                )
+                target.append(GotoAction(-1, False))
+                self.pending.append((target[-1], language))
             elif language[0] == "Update:":
                 if not logined[index]:
                     raise GrammarException("不能在非验证的状态执行Update语句", language)
@@ -223,17 +427,30 @@ class StateMachine(object):
             elif language[0] == "Speak:":
                 target.append(SpeakAction(language[1]))
 
+    def resolve(self) -> None:
+        """回填所有待定Goto动作的目标状态编号和登录验证标志。
+
+        :exception GrammarException Goto的目标状态不存在
+        """
+        pending, self.pending = self.pending, []
+        for action, language in pending:
+            index = self.state_map.get(language[1])
+            if index is None:
+                raise GrammarException("Goto状态不存在", language)
+            action.next = index
+            action.logined = self.verified[index]
+
     def speak(self, user_state: UserState) -> list[str]:
         """
         输出某个状态的回复 动作。
 
+        一次取出该状态所有speak语句用到的变量，每个用户最多读取一次数据库。
+
         :param user_state: 用户状态。
         :return: 回复信息。
         """
-        response: list[str] = []
-        for action in self.speak_action[user_state.state]:
-            action.exec(user_state, response, "", self.db)
-        return response
+        values = user_state.fetch(self.speak_vars[user_state.state], self.db)
+        return [action.render(values, "") for action in self.speak_action[user_state.state]]
 
     def state_transform(self, user_state: UserState, msg: str) -> list[str]:
         """
@@ -244,13 +461,13 @@ class StateMachine(object):
         :return: 回复信息列表。
         """
         response: list[str] = []
-        for case in self.service[user_state.state]:
-            if case.judgement.check(msg):
-                for action in case.actions:
-                    action.exec(user_state, response, msg, self.db)
-                if user_state.state != -1:  # 新状态的speak动作
-                    response += self.speak(user_state)
-                return response
+        case = self.dispatch[user_state.state].match(msg)
+        if case is not None:
+            for action in case.actions:
+                action.exec(user_state, response, msg, self.db)
+            if user_state.state != -1:  # 新状态的speak动作
+                response += self.speak(user_state)
+            return response
         for action in self.default[user_state.state]:
             action.exec(user_state, response, msg, self.db)
         if user_state.state != -1:  # 新状态的speak动作
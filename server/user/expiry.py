@@ -0,0 +1,157 @@
+"""
+ * @file expiry.py
+ * @author LinZhi
+ * @brief 会话过期模块
+        使用时间轮管理全部会话的超时，一个后台线程定期批量清理过期的会话
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+import math
+import time
+from threading import Event, Lock, Thread
+from typing import Callable, Hashable, Optional
+
+
+class ExpiryWheel(object):
+    """
+    时间轮。
+    时间按 ``resolution`` 秒划分为刻度，轮上的槽位循环对应刻度，会话登记在其截止时间所在刻度的槽位中。
+    每次请求只更新会话的截止时间（``touch``），不移动槽位；时间推进到某个槽位时取出其中全部会话，
+    已经过期的批量交给 ``on_expire``，截止时间被推迟的重新登记到新的槽位。
+    因此每个会话在一个超时周期内最多被重新登记一次，请求路径上只有一次字典赋值，
+    全部会话共用一个后台线程，过期时间最多比设定值晚 ``resolution`` 秒。
+
+    :ivar ttl: 会话超时秒数。
+    :ivar resolution: 刻度秒数，即过期检查的间隔。
+    :ivar on_expire: 过期回调，参数为一批过期的键，在持有锁之外调用。
+    :ivar clock: 单调时钟。
+    :ivar deadlines: 从键映射到截止时间的字典，即存活的会话。
+    :ivar slots: 槽位，每个槽位是一组键。
+    :ivar tick: 下一个待处理的刻度。
+    :ivar evicted: 因超时被清理的会话数量。
+    :ivar sweeps: 处理过的刻度数量。
+    """
+
+    def __init__(self, ttl: float, on_expire: Callable[[list], None], resolution: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+
+        :param ttl: 会话超时秒数。
+        :param on_expire: 过期回调。
+        :param resolution: 刻度秒数。
+        :param clock: 单调时钟，测试时可以替换。
+        """
+        self.ttl = ttl
+        self.resolution = resolution
+        self.on_expire = on_expire
+        self.clock = clock
+        self.deadlines: dict[Hashable, float] = dict()
+        self.slots: list[set] = [set() for _ in range(math.ceil(ttl / resolution) + 2)]
+        self.tick = self.tick_of(clock())
+        self.evicted = 0
+        self.sweeps = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def tick_of(self, moment: float) -> int:
+        """时间所在的刻度。"""
+        return int(moment // self.resolution)
+
+    def add(self, key: Hashable) -> None:
+        """登记一个新的会话。
+
+        :param key: 会话的键。
+        """
+        with self.lock:
+            deadline = self.clock() + self.ttl
+            self.deadlines[key] = deadline
+            self.slots[self.tick_of(deadline) % len(self.slots)].add(key)
+
+    def touch(self, key: Hashable) -> bool:
+        """会话收到请求，推迟截止时间。
+
+        :param key: 会话的键。
+        :return: 会话是否存活，已经过期或者移除时返回False。
+        """
+        with self.lock:
+            if key not in self.deadlines:
+                return False
+            self.deadlines[key] = self.clock() + self.ttl
+            return True
+
+    def discard(self, key: Hashable) -> None:
+        """移除一个会话，不计入超时清理数量。槽位中的键在时间推进到该槽位时丢弃。
+
+        :param key: 会话的键。
+        """
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """推进时间，批量清理到期的会话。
+
+        :param now: 当前时间，为None时读取时钟。
+        :return: 本次清理的会话数量。
+        """
+        expired = []
+        with self.lock:
+            now = self.clock() if now is None else now
+            current = self.tick_of(now)
+            count = min(current - self.tick + 1, len(self.slots))  # 时间跳跃超过一圈时每个槽位只需处理一次
+            for tick in range(self.tick, self.tick + count):
+                slot = self.slots[tick % len(self.slots)]
+                if len(slot) == 0:
+                    continue
+                keys = list(slot)
+                slot.clear()
+                for key in keys:
+                    deadline = self.deadlines.get(key)
+                    if deadline is None:  # 已经移除
+                        continue
+                    if deadline <= now:
+                        del self.deadlines[key]
+                        expired.append(key)
+                    else:  # 截止时间被推迟，登记到新的槽位，当前刻度内到期的放到下一刻度
+                        target = max(self.tick_of(deadline), current + 1)
+                        self.slots[target % len(self.slots)].add(key)
+            self.tick = current + 1 if count > 0 else self.tick
+            self.sweeps += max(count, 0)
+            self.evicted += len(expired)
+        if len(expired) != 0:
+            self.on_expire(expired)
+        return len(expired)
+
+    def alive(self) -> int:
+        """存活的会话数量。"""
+        return len(self.deadlines)
+
+    def stats(self) -> dict:
+        """会话统计。
+
+        :return: 包含存活的会话数量 ``alive``、超时清理的会话数量 ``evicted``、处理过的刻度数量 ``sweeps`` 的字典。
+        """
+        with self.lock:
+            return {"alive": len(self.deadlines), "evicted": self.evicted, "sweeps": self.sweeps}
+
+    def start(self) -> None:
+        """启动后台清理线程。"""
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """停止后台清理线程。"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        """后台线程主循环，每个刻度清理一次。"""
+        while not self.stopped.wait(self.resolution):
+            try:
+                self.advance()
+            except Exception as err:  # 回调出错不影响之后的清理
+                print("ExpiryWheel: ", err)
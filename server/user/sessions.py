@@ -0,0 +1,115 @@
+"""
+ * @file sessions.py
+ * @author LinZhi
+ * @brief 会话表模块
+        按用户名哈希分段加锁的在线用户表
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+from threading import Lock
+from typing import Any, Iterator, Optional
+
+SHARDS = 16
+
+
+class SessionTable(object):
+    """
+    分段会话表。
+    用户按用户名的哈希分配到 ``shards`` 个段，每段一个字典和一把锁，不同段上的写操作互不等待。
+    读操作不加锁（单次字典读取在CPython中是原子的），写操作只锁用户所在的段，
+    改名时按段编号顺序锁住两个段，移动对其他线程是原子的，并且不会死锁。
+
+    :ivar shards: 每段的字典。
+    :ivar locks: 每段的锁。
+    """
+
+    def __init__(self, shards: int = SHARDS) -> None:
+        """
+
+        :param shards: 段数量。
+        """
+        self.shards: list[dict[str, Any]] = [dict() for _ in range(shards)]
+        self.locks = [Lock() for _ in range(shards)]
+
+    def index(self, username: str) -> int:
+        """用户所在的段编号。"""
+        return hash(username) % len(self.shards)
+
+    def get(self, username: str) -> Optional[Any]:
+        """读取用户，不加锁。
+
+        :param username: 用户名。
+        :return: 用户不存在时返回None。
+        """
+        return self.shards[self.index(username)].get(username)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.shards[self.index(username)]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def add(self, username: str, value: Any) -> bool:
+        """添加用户。
+
+        :param username: 用户名。
+        :param value: 用户对象。
+        :return: 用户名已经存在时不添加，返回False。
+        """
+        index = self.index(username)
+        with self.locks[index]:
+            if username in self.shards[index]:
+                return False
+            self.shards[index][username] = value
+            return True
+
+    def pop(self, username: str) -> Optional[Any]:
+        """移除用户。
+
+        :param username: 用户名。
+        :return: 被移除的用户对象，用户不存在时返回None。
+        """
+        index = self.index(username)
+        with self.locks[index]:
+            return self.shards[index].pop(username, None)
+
+    def move(self, old: str, new: str) -> Optional[Any]:
+        """把用户从原用户名移动到新用户名。
+
+        同时持有两个段的锁，对其他写操作而言移动是原子的；先写入新位置再删除原位置，
+        不加锁的读取最多短暂地在两个用户名下都读到该用户，不会两处都读不到。
+
+        :param old: 原用户名。
+        :param new: 新用户名。
+        :return: 被移动的用户对象；原用户名不存在，或者新用户名已经存在时不移动，返回None。
+        """
+        first, second = sorted((self.index(old), self.index(new)))
+        with self.locks[first]:
+            if second != first:
+                self.locks[second].acquire()
+            try:
+                source, target = self.shards[self.index(old)], self.shards[self.index(new)]
+                if old not in source or new in target:
+                    return None
+                value = source[old]
+                target[new] = value
+                del source[old]
+                return value
+            finally:
+                if second != first:
+                    self.locks[second].release()
+
+    def values(self) -> list:
+        """全部用户对象的快照，逐段加锁复制。"""
+        result = []
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                result.extend(shard.values())
+        return result
+
+    def __iter__(self) -> Iterator[str]:
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                keys = list(shard)
+            yield from keys
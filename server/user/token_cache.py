@@ -0,0 +1,100 @@
+"""
+ * @file token_cache.py
+ * @author LinZhi
+ * @brief 令牌缓存模块
+        缓存已经验证过签名的JWT令牌，重复的请求不再计算HMAC
+ * @version 0.1
+ * @date 2022-11-28
+ * @copyright Copyright (c) 2022
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+CAPACITY = 65536
+
+
+class TokenCache(object):
+    """
+    已验证令牌的LRU缓存。
+    键为令牌字符串，值为令牌中的用户名。缓存只省去签名验证，令牌是否有效仍由会话是否存在决定，
+    会话结束或者用户名改变时按用户名移除对应的令牌。同一用户名编码得到的令牌相同，因此每个用户名最多一个令牌。
+
+    :ivar capacity: 最多缓存的令牌数量。
+    :ivar tokens: 从令牌映射到用户名的有序字典，最近使用的在末尾。
+    :ivar owners: 从用户名映射到令牌的字典。
+    :ivar hits: 命中次数。
+    :ivar misses: 未命中次数。
+    :ivar evictions: 因容量不足淘汰的令牌数量。
+    """
+
+    def __init__(self, capacity: int = CAPACITY) -> None:
+        """
+
+        :param capacity: 最多缓存的令牌数量。
+        """
+        self.capacity = capacity
+        self.tokens: OrderedDict[str, str] = OrderedDict()
+        self.owners: dict[str, str] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, token: str) -> Optional[str]:
+        """查找令牌。
+
+        :param token: 令牌。
+        :return: 令牌中的用户名，未缓存时返回None。
+        """
+        with self.lock:
+            username = self.tokens.get(token)
+            if username is None:
+                self.misses += 1
+                return None
+            self.tokens.move_to_end(token)
+            self.hits += 1
+            return username
+
+    def put(self, token: str, username: str) -> None:
+        """缓存一个验证通过的令牌。
+
+        :param token: 令牌。
+        :param username: 令牌中的用户名。
+        """
+        with self.lock:
+            old = self.owners.get(username)
+            if old is not None:
+                del self.tokens[old]
+            self.tokens[token] = username
+            self.owners[username] = token
+            while len(self.tokens) > self.capacity:
+                _, evicted = self.tokens.popitem(last=False)
+                del self.owners[evicted]
+                self.evictions += 1
+
+    def discard(self, username: str) -> None:
+        """移除用户名对应的令牌。
+
+        :param username: 用户名。
+        """
+        with self.lock:
+            token = self.owners.pop(username, None)
+            if token is not None:
+                del self.tokens[token]
+
+    def stats(self) -> dict:
+        """命中统计。
+
+        :return: 包含命中次数 ``hits``、未命中次数 ``misses``、命中率 ``ratio``、
+            缓存的令牌数量 ``size``、淘汰数量 ``evictions`` 的字典。
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "ratio": self.hits / total if total != 0 else 0.0,
+                "size": len(self.tokens),
+                "evictions": self.evictions,
+            }
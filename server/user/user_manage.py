@@ -8,39 +8,90 @@
  * @copyright Copyright (c) 2022
 """
 import time
-from typing import Optional
-from threading import Lock, Timer
+from contextlib import contextmanager
+from threading import Condition
+from typing import Iterator, Optional
 import jwt
 from server.state.state import UserState
 from server.database.database import Database
+from server.user.expiry import ExpiryWheel
+from server.user.sessions import SessionTable, SHARDS
+from server.user.token_cache import TokenCache, CAPACITY
+
+SESSION_TTL = 300  # 会话闲置超时秒数
 
 
 class User(object):
     """用户类。
 
-    :ivar timer: 计时器，根据设定时间，释放用户对象
     :ivar state: 用户状态。
     :ivar username: 用户名。
+    :ivar stateless: 是否为无状态访客，其状态保存在令牌中，服务器不保存User对象。
     """
 
-    def __init__(self, username: str) -> None:
-        self.timer = None
+    __slots__ = ("state", "username", "stateless")
+
+    def __init__(self, username: str, stateless: bool = False) -> None:
         self.state = UserState()
         self.username = username
+        self.stateless = stateless
 
 
 class UserManage(object):
     """用户管理类。
 
-    :ivar users: 从用户名映射到User对象的字典。
-    :ivar lock: 互斥访问 users 字典的互斥锁。
+    :ivar users: 从用户名映射到User对象的分段会话表，读取不加锁，写入只锁用户所在的段。
     :ivar key: JWT加密密钥。
+    :ivar sessions: 会话超时时间轮，闲置超过 ``ttl`` 秒的用户由后台线程释放。
+    :ivar tokens: 已验证令牌的缓存。
+    :ivar stateless_guests: 访客会话是否无状态。无状态访客的状态编号和上次echo的秒数保存在签名的令牌中，
+        服务器在登录或者注册之前不为其保存任何对象，每次请求后返回新的令牌。
+    :ivar idle: 闲置调度器 IdleScheduler，为None时闲置时间由客户端通过 /echo 报告。
+    :ivar running: 正在执行转移的User对象集合，参见 ``turn``。
     """
 
-    def __init__(self, key: str) -> None:
-        self.users: dict[str, User] = dict()
-        self.lock = Lock()
+    def __init__(self, key: str, ttl: float = SESSION_TTL, resolution: float = 1.0, shards: int = SHARDS,
+                 token_cache: int = CAPACITY, stateless_guests: bool = False) -> None:
+        """
+
+        :param key: JWT加密密钥。
+        :param ttl: 会话闲置超时秒数。
+        :param resolution: 超时检查的间隔秒数。
+        :param shards: 会话表的段数量。
+        :param token_cache: 最多缓存的已验证令牌数量。
+        :param stateless_guests: 访客会话是否无状态。
+        """
+        self.users = SessionTable(shards)
         self.key = key
+        self.tokens = TokenCache(token_cache)
+        self.stateless_guests = stateless_guests
+        self.ttl = ttl
+        self.idle = None
+        self.running: set = set()
+        self.turns = Condition()
+        self.sessions = ExpiryWheel(ttl, self.expire, resolution)
+        self.sessions.start()
+
+    @contextmanager
+    def turn(self, user: User) -> Iterator[None]:
+        """轮流执行同一会话的转移，/send、/echo 和闲置调度器的超时转移不同时修改会话的状态。
+
+        状态机应在取得执行权之后获取：热重载后新状态机追加的状态编号在原状态机中不存在，
+        同一会话的转移依次执行时，后执行的转移使用的状态机不会比先执行的旧。
+        不能使用 ``user.state.lock``，转移中的动作会获取这个锁。
+
+        :param user: User对象。
+        """
+        with self.turns:
+            while user in self.running:
+                self.turns.wait()
+            self.running.add(user)
+        try:
+            yield
+        finally:
+            with self.turns:
+                self.running.discard(user)
+                self.turns.notify_all()
 
     def jwt_encode(self, username: str) -> str:
         """JWT令牌编码。
@@ -50,19 +101,69 @@ class UserManage(object):
         """
         return jwt.encode({"username": username}, self.key, algorithm="HS256")
 
+    def guest_encode(self, user: User) -> str:
+        """无状态访客的令牌编码，令牌在闲置 ``ttl`` 秒后过期。
+
+        :param user: 无状态访客的User对象。
+        :return: JWT令牌。
+        """
+        payload = {
+            "guest": user.username,
+            "state": user.state.state,
+            "last": user.state.last_time,
+            "exp": int(time.time() + self.ttl),
+        }
+        return jwt.encode(payload, self.key, algorithm="HS256")
+
+    def guest_decode(self, payload: dict) -> User:
+        """由令牌内容恢复无状态访客。
+
+        :param payload: 已经验证签名的令牌内容。
+        :return: 临时的User对象。
+        :raises jwt.InvalidTokenError: 未开启无状态访客，或者会话已经结束时触发。
+        """
+        if not self.stateless_guests or payload.get("state", -1) < 0:
+            raise jwt.InvalidTokenError
+        user = User(payload["guest"], True)
+        user.state.state = payload["state"]
+        user.state.last_time = payload.get("last", 0)
+        return user
+
+    def reissue(self, user: User) -> Optional[str]:
+        """请求处理完后为无状态访客生成携带新状态的令牌。
+
+        :param user: User对象。
+        :return: 新的令牌，有状态的会话返回None，客户端继续使用原令牌。
+        """
+        if not user.stateless:
+            return None
+        return self.guest_encode(user)
+
     def jwt_decode(self, token: str) -> User:
         """JWT令牌解码。
 
+        验证通过的令牌进入缓存，之后同一令牌的请求不再验证签名，但仍然要求会话存在，
+        会话结束的令牌与未缓存时一样被拒绝。
+
         :param token: JWT令牌。
         :return: 如果解码成功，并且用户存在，则返回对应的User对象。
         :raises jwt.InvalidTokenError: 当解码失败或者用户名不存在时触发。
         """
-        username = jwt.decode(token, self.key, algorithms="HS256").get("username")
-        if username is None or username not in self.users.keys():
+        username = self.tokens.get(token)
+        cached = username is not None
+        if not cached:
+            payload = jwt.decode(token, self.key, algorithms="HS256")
+            if "guest" in payload:  # 无状态访客的令牌每次请求都会改变，不进入缓存
+                return self.guest_decode(payload)
+            username = payload.get("username")
+        user = self.users.get(username) if username is not None else None
+        if user is None or not self.sessions.touch(username):  # 推迟会话的超时时间
+            if cached:
+                self.tokens.discard(username)
             raise jwt.InvalidTokenError
-        self.users[username].timer.cancel()
-        self.users[username].timer = Timer(300, self.timeout, username)  # 重设超时计时器
-        return self.users[username]
+        if not cached:
+            self.tokens.put(token, username)
+        return user
 
     def connect(self) -> (User, str):
         """处理新客户端连接到服务器的请求。
@@ -70,10 +171,15 @@ class UserManage(object):
         :return: User对象和JWT令牌。
         """
         username = f"Guest_{time.time_ns()}"
-        with self.lock:
-            self.users[username] = User(username)
-            self.users[username].timer = Timer(300, self.timeout, username)  # 初始化超时计时器
-        return self.users[username], self.jwt_encode(username)
+        if self.stateless_guests:  # 不保存User对象，用户名只用于区分令牌
+            user = User(username, True)
+            return user, self.guest_encode(user)
+        user = User(username)
+        while not self.users.add(username, user):  # 两个线程在同一纳秒内连接
+            username = f"Guest_{time.time_ns()}"
+            user.username = username
+        self.sessions.add(username)
+        return user, self.jwt_encode(username)
 
     def login(self, user: User, username: str, password: str, db: Database) -> Optional[str]:
         """处理登录请求。
@@ -85,14 +191,13 @@ class UserManage(object):
         :return: 如果登录成功,返回新JWT令牌。否则返回None。
         """
         old_username = user.username
-        if not self.users[old_username].state.login(username, password, db):  # 登录失败，用户名或密码错误
+        if username in self.users:  # 用户已经登录，同一用户只能有一个会话持有缓存
             return None
-        if self.users.get(username, None) is not None:  # 用户已经登录。
+        if not user.state.login(username, password, db):  # 登录失败，用户名或密码错误
+            return None
+        if not self.rename(user, old_username, username):  # 同一用户同时在另一个会话中登录成功
+            user.state.logout()
             return None
-        with self.lock:
-            self.users[username] = self.users[old_username]  # 用户名改变，移动User对象到新位置
-            self.users[username].username = username
-            del self.users[old_username]
         return self.jwt_encode(username)
 
     def register(self, user: User, username: str, password: str, db: Database) -> Optional[str]:
@@ -105,19 +210,63 @@ class UserManage(object):
         :return: 如果注册成功，返回新JWT令牌。否则返回None。
         """
         old_username = user.username
-        if not self.users[old_username].state.register(username, password, db):  # 注册失败
+        if not user.state.register(username, password, db):  # 注册失败
+            return None
+        if not self.rename(user, old_username, username):
+            user.state.logout()
             return None
-        with self.lock:
-            self.users[username] = self.users[old_username]  # 用户名改变，移动User对象到新位置
-            self.users[username].username = username
-            del self.users[old_username]
         return self.jwt_encode(username)
 
+    def rename(self, user: User, old_username: str, username: str) -> bool:
+        """用户名改变，移动User对象到新位置。
+
+        :param user: User对象。
+        :param old_username: 原用户名。
+        :param username: 新用户名。
+        :return: 新用户名已经被其他会话占用，或者原会话已经超时时返回False。
+        """
+        if user.stateless:  # 无状态访客登录后成为有状态的会话
+            if not self.users.add(username, user):
+                return False
+            user.stateless = False
+        elif self.users.move(old_username, username) is None:
+            return False
+        user.username = username
+        self.tokens.discard(old_username)
+        self.sessions.discard(old_username)
+        self.sessions.add(username)
+        return True
+
     def timeout(self, username: str) -> None:
         """超时状态处理函数。
 
         :param username: 超时的用户名。
         """
-        with self.lock:
-            self.users[username].timer.cancel()
-            del self.users[username]  # 释放User对象。
+        self.sessions.discard(username)
+        self.tokens.discard(username)
+        user = self.users.pop(username)  # 释放User对象。
+        if user is not None:
+            user.state.invalidate()  # 会话结束，丢弃变量缓存
+            if self.idle is not None:
+                self.idle.forget(user)
+
+    def expire(self, usernames: list[str]) -> None:
+        """时间轮批量释放闲置超时的用户。
+
+        :param usernames: 超时的用户名。
+        """
+        for username in usernames:
+            self.tokens.discard(username)
+            user = self.users.pop(username)
+            if user is not None:
+                user.state.invalidate()
+                if self.idle is not None:
+                    self.idle.forget(user)
+
+    def session_stats(self) -> dict:
+        """会话统计，参见 ExpiryWheel.stats。"""
+        return self.sessions.stats()
+
+    def token_stats(self) -> dict:
+        """令牌缓存统计，参见 TokenCache.stats。"""
+        return self.tokens.stats()
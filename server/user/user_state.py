@@ -8,12 +8,15 @@
  * @copyright Copyright (c) 2022
 """
 from threading import Lock
+from typing import Iterable, Optional, Union
 
-from storm.properties import Unicode
-from storm.store import Store
+from storm.properties import Unicode, Int, Float
 
 from server.database.database import Database
 
+LOCK_STRIPES = 1024
+_LOCKS = tuple(Lock() for _ in range(LOCK_STRIPES))  # 全部用户状态共用的锁池
+
 
 class VariableSet(object):
     """脚本语言变量集，与数据库关联。
@@ -36,47 +39,138 @@ class VariableSet(object):
         self.username = username
         self.password = password
 
+    @classmethod
+    def define(cls, name: str, type_: str, default: Union[int, float, str]) -> None:
+        """为变量集添加一列。
+
+        :param name: 变量名，不含 ``$`` 前缀。
+        :param type_: 变量类型，可以是 ``Int``、``Real``、``Text`` 之一。
+        :param default: 变量默认值，字符串默认值不含引号。
+        """
+        if type_ == "Int":
+            setattr(cls, name, Int(default=default))
+        elif type_ == "Real":
+            setattr(cls, name, Float(default=default))
+        elif type_ == "Text":
+            setattr(cls, name, Unicode(default=default))
+        cls.type[name] = type_
+        if "__storm_class_info__" in cls.__dict__:  # storm缓存了类的列信息，增加列后需要重新生成
+            del cls.__storm_class_info__
+
 
 class UserState(object):
     """用户状态类
 
+    登录或注册成功后，用户的变量集被读入 ``cache``，此后读取变量不再访问数据库，
+    更新动作在提交后同步修改缓存。访客用户共享同一行数据，不进行缓存。
+    每个在线会话一个实例，因此使用 ``__slots__`` 去掉实例字典，锁从共用的锁池中按对象地址选取，不为每个实例创建锁，
+    状态编号为小整数，访客的用户名为同一个字符串常量。
+
+    :cvar cache_hits: 所有用户读取变量时命中缓存的次数。
+    :cvar cache_misses: 所有用户读取变量时访问数据库的次数。
     :ivar state: 用户在状态机中所处的状态。
     :ivar have_login: 用户是否已经登录。
     :ivar last_time: 距离用户上次发送消息过去的秒数。
-    :ivar lock: 互斥锁。
+    :ivar lock: 互斥锁，与其他实例共用。
     :ivar username: 用户名。
+    :ivar cache: 从变量名映射到变量值的字典，未缓存时为None。
     """
+    __slots__ = ("state", "have_login", "last_time", "username", "cache")
+    cache_hits = 0
+    cache_misses = 0
+    counter_lock = Lock()
 
     def __init__(self) -> None:
         self.state = 0
         self.have_login = False
         self.last_time = 0
-        self.lock = Lock()
         self.username = "Guest"
+        self.cache: Optional[dict] = None
+
+    @property
+    def lock(self) -> Lock:
+        """实例的互斥锁，从锁池中按对象地址选取。持有时不能再获取其他用户状态的锁。"""
+        return _LOCKS[(id(self) >> 4) % LOCK_STRIPES]
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """缓存命中统计。
+
+        :return: 包含命中次数 ``hits``、未命中次数 ``misses`` 和命中率 ``ratio`` 的字典。
+        """
+        with cls.counter_lock:
+            hits, misses = cls.cache_hits, cls.cache_misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "ratio": hits / total if total != 0 else 0.0}
+
+    @classmethod
+    def count(cls, hit: bool) -> None:
+        with cls.counter_lock:
+            if hit:
+                cls.cache_hits += 1
+            else:
+                cls.cache_misses += 1
+
+    def cached(self, name: str, value: Union[int, float, str]) -> None:
+        """更新动作提交后同步修改缓存。
+
+        :param name: 变量名。
+        :param value: 变量的新值。
+        """
+        cache = self.cache
+        if cache is not None:
+            cache[name] = value
+
+    def invalidate(self) -> None:
+        """会话结束时丢弃缓存。"""
+        self.cache = None
+
+    def fetch(self, names: Iterable[str], db: Database) -> dict:
+        """一次读取用户的多个变量，优先从缓存读取。
+
+        :param names: 变量名。
+        :param db: 数据库对象
+        :return: 从变量名映射到变量值的字典。
+        """
+        names = tuple(names)
+        if len(names) == 0:
+            return dict()
+        cache = self.cache
+        if cache is not None:
+            self.count(True)
+            return {name: cache[name] for name in names}
+        self.count(False)
+        if self.have_login:  # 缓存被丢弃后重新载入
+            cache = db.get_variables(self.username)
+            self.cache = cache
+            return {name: cache[name] for name in names}
+        return db.get_variables(self.username, names)
 
     def register(self, username: str, password: str, db: Database) -> bool:
         """注册新用户。
 
-        首先在数据库中查找用户是否存在，如果不存在，则向数据库中添加一个新用户，并且更新用户名和登录信息。
+        向数据库中添加一个新用户，由存储后端判断用户是否已经存在，成功后更新用户名和登录信息。
 
         :param db: 数据库对象
         :param username: 用户名。
         :param password: 密码。
         :return: 如果注册成功，返回True；否则返回False。
         """
-        with db.lock:
-            store = Store(db.database)
-            if store.get(VariableSet, username) is not None:  # 用户已经存在
-                store.close()
-                return False
-            with self.lock:
-                self.username = username
-                variable_set = VariableSet(username, password)
-                self.have_login = True
-            store.add(variable_set)  # 添加新的行
-            store.commit()
-            store.close()
-            return True
+        cache = db.create_user(username, password)
+        if cache is None:  # 用户已经存在
+            return False
+        with self.lock:
+            self.username = username
+            self.have_login = True
+            self.cache = cache
+        return True
+
+    def logout(self) -> None:
+        """退回访客用户，丢弃缓存。"""
+        with self.lock:
+            self.username = "Guest"
+            self.have_login = False
+            self.cache = None
 
     def login(self, username: str, password: str, db: Database) -> bool:
         """用户登录。
@@ -91,17 +185,11 @@ class UserState(object):
         if username == "Guest":  # 不能登录访客用户
             return False
 
-        with db.lock:
-            store = Store(db.database)
-            variable_set = store.get(VariableSet, username)
-            if variable_set is None:  # 用户不存在
-                store.close()
-                return False
-            if variable_set.password == password:
-                with self.lock:
-                    self.username = username
-                    self.have_login = True
-                store.close()
-                return True
-            store.close()
+        cache = db.verify_login(username, password)
+        if cache is None:  # 用户不存在或者密码错误
             return False
+        with self.lock:
+            self.username = username
+            self.have_login = True
+            self.cache = cache
+        return True
@@ -6,4 +6,32 @@ python -m test_update_action
 python -m test_user_state
 python -m test_state
 python -m test_app
-#   python -m test_pressure
\ No newline at end of file
+python -m test_artifact
+python -m test_descent
+python -m test_reload
+python -m test_dispatch
+python -m test_write_queue
+python -m test_database
+python -m test_persistent
+python -m test_backend
+python -m test_bulk
+python -m test_jobs
+python -m test_expiry
+python -m test_sessions
+python -m test_token_cache
+python -m test_guests
+python -m test_idle
+python -m test_async_app
+#   python -m test_pressure
+#   python -m test_benchmark_parser
+#   python -m test_benchmark_dispatch
+#   python -m test_benchmark_build
+#   python -m test_benchmark_update
+#   python -m test_benchmark_backend
+#   python -m test_benchmark_shard
+#   python -m test_benchmark_sessions
+#   python -m test_benchmark_guests
+#   python -m test_benchmark_memory
+#   python -m test_benchmark_batch
+#   python -m test_benchmark_async
+#   python -m test_benchmark_websocket
@@ -0,0 +1,59 @@
+"""
+基准测试使用的合成脚本
+"""
+
+
+def generate_script(states: int, services: int = 4) -> str:
+    """生成一个合成脚本，每个状态约 ``10 + 2 * services`` 行。
+
+    :param states: 状态数量。
+    :param services: 每个状态的条件分支数量。
+    :return: 脚本文本。
+    """
+    lines = [
+        "Basic:",
+        "    Name: robot",
+        "    Database: True",
+        "",
+        "Var:",
+        "    $balance Real 0",
+        "    $name Text \"用户\"",
+        "    $trans Int 0",
+        "",
+    ]
+    for i in range(states):
+        name = "Begin" if i == 0 else f"S{_letters(i)}"
+        following = f"S{_letters((i + 1) % states)}" if (i + 1) % states else "Begin"
+        lines.append(f"State: {name}" + ("" if i % 2 == 0 else " Logined"))
+        lines.append(f"    Speak: \"欢迎来到 {name}\" + $name")
+        lines.append("    Speak: \"余额：\" + $balance")
+        for j in range(services):
+            if j % 4 == 0:
+                lines.append(f"    Service: \"选项{j}\"")
+                lines.append(f"        Goto {following}")
+            elif j % 4 == 1:
+                lines.append(f"    Service: Contain: \"关键字{j}\"")
+                lines.append("        Goto Begin")
+            elif j % 4 == 2:
+                lines.append("    Service: Length > 200")
+                lines.append("        Speak: \"输入过长\"")
+            else:
+                lines.append("    Service: Type Real")
+                lines.append("        Speak: \"您输入了\" + Input")
+        lines.append("    Default:")
+        lines.append("        Speak: \"抱歉，我没能理解您的意思\"")
+        lines.append("    Wait: 30")
+        lines.append("        Speak: \"您已经很久没有操作了\"")
+        lines.append("        Goto Begin")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _letters(number: int) -> str:
+    """将编号转换为只含字母的状态名后缀（状态名只能由字母组成）。"""
+    result = ""
+    while True:
+        number, rest = divmod(number, 26)
+        result = chr(ord("A") + rest) + result
+        if number == 0:
+            return result
@@ -92,6 +92,33 @@ class TestApp(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn("token", data)
 
+    def test_batch(self):
+        tokens = [json.loads(self.client.get("/").data)["token"] for _ in range(2)]
+        items = [
+            {"token": tokens[0], "msg": "投诉"},
+            {"token": tokens[1], "msg": "改名"},
+            {"token": tokens[0], "seconds": 60},
+            {"token": "", "msg": "你好"},
+            {"token": tokens[1], "msg": "退出"},
+            {"token": tokens[1], "msg": "你好"},
+            {"msg": "你好"},
+        ]
+        response = self.client.post("/batch", json=items)
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)["results"]
+        self.assertEqual([result["status"] for result in results], [200, 401, 200, 403, 200, 403, 400])
+        self.assertEqual(results[0]["msg"][0], "请输入您的建议，不超过200个字符")
+        self.assertEqual(results[2]["msg"][0], "您已经很久没有操作了，即将返回主菜单")
+        self.assertTrue(results[4]["exit"])  # 同一会话结束后的项返回403
+
+        response = self.client.get("/send", query_string={"msg": "你好", "token": tokens[1]})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post("/batch", json={"items": [{"token": tokens[0], "msg": "返回"}]})
+        self.assertEqual(json.loads(response.data)["results"][0]["status"], 200)
+        self.assertEqual(self.client.post("/batch", json={"msg": "你好"}).status_code, 400)
+        self.assertEqual(self.client.post("/batch", json=[{}] * 1001).status_code, 413)
+        self.assertEqual(self.client.post("/job", json={"key": ""}).status_code, 404)  # 没有设置 DSL_ADMIN_KEY
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,72 @@
+"""
+预编译文件测试
+"""
+import os
+import shutil
+import subprocess
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.state import artifact
+from server.state.state import StateMachine
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+LOAD_SCRIPT = """
+import sys
+sys.path.append({root!r})
+from server.state.state import StateMachine
+m = StateMachine({file!r}, None, {artifact!r})
+print("pyparsing" in sys.modules)
+print(repr(m.states))
+print(repr(m.service))
+"""
+
+
+class TestArtifact(unittest.TestCase):
+    def setUp(self):
+        self.file = os.path.join(current_path, "artifact.txt")
+        self.artifact = os.path.join(current_path, "artifact.dslc")
+        shutil.copy(os.path.join(current_path, "parser/case2.txt"), self.file)
+
+    def tearDown(self):
+        for path in (self.file, self.artifact):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_in_process(self) -> list[str]:
+        script = LOAD_SCRIPT.format(root=rootPath, file=self.file, artifact=self.artifact)
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        return output.stdout.splitlines()
+
+    def test_load(self):
+        m = StateMachine(self.file, None)
+        m.save(self.artifact)
+        self.assertIsNotNone(artifact.load(self.file, self.artifact))
+
+        lines = self.load_in_process()
+        self.assertEqual(lines[0], "False")  # 加载预编译文件时不导入pyparsing
+        self.assertEqual(lines[1], repr(m.states))
+        self.assertEqual(lines[2], repr(m.service))
+
+    def test_fallback(self):
+        StateMachine(self.file, None).save(self.artifact)
+        with open(self.file, "a", encoding="utf-8") as f:
+            f.write("\n\nState: Extra\n    Default:\n")
+        self.assertIsNone(artifact.load(self.file, self.artifact))
+
+        lines = self.load_in_process()
+        self.assertEqual(lines[0], "True")  # 脚本已修改，重新解析
+        self.assertIn("'Extra'", lines[1])
+
+        with open(self.artifact, "r+b") as f:
+            f.write(b"XXXX")
+        self.assertIsNone(artifact.load(self.file, self.artifact))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+"""
+异步服务器测试
+"""
+import asyncio
+import base64
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+import sys
+from urllib.parse import urlencode
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+import rfc6455
+from async_app import AsyncServer
+from controller import Controller
+from server.database.database import Database
+from server.state.idle import IdleScheduler
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class WebSocketClient(object):
+    """测试用的WebSocket客户端。"""
+
+    async def open(self, port: int, token: str = None) -> int:
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        target = "/ws" + ("" if token is None else "?" + urlencode({"token": token}))
+        self.writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+        status = int((await self.reader.readline()).split()[1])
+        headers = dict()
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        if status == 101:
+            assert headers["sec-websocket-accept"] == rfc6455.accept_key(key)
+        return status
+
+    def send(self, frame: dict) -> None:
+        self.writer.write(rfc6455.encode(rfc6455.TEXT, json.dumps(frame).encode(), masked=True))
+
+    async def receive(self) -> dict:
+        text = await asyncio.wait_for(rfc6455.read_message(self.reader, self.writer, require_mask=False), 5)
+        return None if text is None else json.loads(text)
+
+    async def request(self, frame: dict) -> dict:
+        self.send(frame)
+        return await self.receive()
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "async.db")
+        self.user_manage = UserManage("secret")
+        self.controller = Controller(self.user_manage, StateMachine(script, self.db_path))
+        self.server = AsyncServer(self.controller, workers=2)
+        self.port = self.server.start()
+        self.client = http.client.HTTPConnection("127.0.0.1", self.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.user_manage.sessions.stop()
+        Database.remove(self.db_path)
+
+    def get(self, path: str, **args) -> (int, dict):
+        self.client.request("GET", path + "?" + urlencode(args))
+        response = self.client.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if response.status == 200 else None
+
+    def test_routes(self):
+        status, data = self.get("/")
+        self.assertEqual(status, 200)
+        token = data["token"]
+        self.assertFalse(data["push"])
+        status, data = self.get("/send", msg="投诉", token=token)
+        self.assertEqual(data["msg"][0], "请输入您的建议，不超过200个字符")
+        status, data = self.get("/echo", seconds=60, token=token)
+        self.assertEqual(data["msg"][0], "您已经很久没有操作了，即将返回主菜单")
+        self.assertEqual(self.get("/send", msg="改名", token=token)[0], 401)
+        self.assertEqual(self.get("/send", msg="你好", token="")[0], 403)
+        self.assertEqual(self.get("/send", token=token)[0], 400)
+        self.assertEqual(self.get("/echo", seconds="x", token=token)[0], 400)
+        self.assertEqual(self.get("/poll", token=token)[0], 404)
+        self.assertEqual(self.get("/missing")[0], 404)
+
+        status, data = self.get("/register", username="async", password="pw", token=token)
+        token = data["token"]
+        status, data = self.get("/send", msg="余额", token=token)
+        self.assertEqual(status, 200)
+
+        items = [{"token": token, "msg": "返回"}, {"token": token, "msg": "退出"}, {"token": token}]
+        self.client.request("POST", "/batch", body=json.dumps(items))
+        response = self.client.getresponse()
+        results = json.loads(response.read())["results"]
+        self.assertEqual([result["status"] for result in results], [200, 200, 400])
+        self.assertTrue(results[1]["exit"])
+        self.assertEqual(self.get("/batch")[0], 405)
+        self.client.request("POST", "/job", body=json.dumps({"key": "", "variable": "billing"}))
+        self.assertEqual(self.client.getresponse().status, 404)  # 没有设置管理密钥
+        self.assertEqual(self.server.stats()["connections"], 1)  # 全部请求使用同一个连接
+
+    def test_close(self):
+        with socket.create_connection(("127.0.0.1", self.port)) as sock:
+            sock.sendall(b"GET / HTTP/1.0\r\n\r\n")
+            data = b""
+            while True:
+                chunk = sock.recv(4096)
+                if len(chunk) == 0:  # HTTP/1.0 请求处理后关闭连接
+                    break
+                data += chunk
+        self.assertTrue(data.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"Connection: close", data)
+
+    def test_idle_connections(self):
+        threads = threading.active_count()
+        sockets = [socket.create_connection(("127.0.0.1", self.port)) for _ in range(200)]
+        for _ in range(20):
+            self.get("/")
+        time.sleep(0.1)
+        self.assertEqual(self.server.stats()["connections"], 201)
+        self.assertLessEqual(threading.active_count(), threads + 2)  # 连接不占用线程，只有线程池的2个线程
+        for sock in sockets:
+            sock.close()
+
+    def test_poll(self):
+        clock = FakeClock()
+        idle = self.user_manage.idle = IdleScheduler(self.controller.machine, self.user_manage, clock)
+        status, data = self.get("/")
+        self.assertTrue(data["push"])
+        token = data["token"]
+        result = []
+
+        def poll() -> None:
+            client = http.client.HTTPConnection("127.0.0.1", self.port)
+            client.request("GET", "/poll?" + urlencode({"token": token, "timeout": 10}))
+            result.append(json.loads(client.getresponse().read()))
+            client.close()
+
+        thread = threading.Thread(target=poll)
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.2)
+        self.assertEqual(idle.fire(1060), 1)  # 调度器执行超时转移，唤醒等待的协程
+        thread.join()
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(result[0]["msg"], ["您已经很久没有操作了，即将于30秒后退出"])
+        self.assertEqual(idle.fire(1090), 1)
+        status, data = self.get("/poll", token=token, timeout=1)  # 发件箱中已经有消息，立即返回
+        self.assertTrue(data["exit"])
+        self.assertEqual(self.get("/poll", token=token)[0], 403)
+
+    def test_stateless_push(self):
+        self.user_manage.stateless_guests = True
+        idle = self.user_manage.idle = IdleScheduler(self.controller.machine, self.user_manage, FakeClock())
+        status, data = self.get("/")
+        self.assertFalse(data["push"])  # 无状态访客使用 /echo
+        status, data = self.get("/register", username="guest", password="pw", token=data["token"])
+        token = data["token"]
+        self.assertEqual(self.get("/send", msg="投诉", token=token)[0], 200)
+        self.assertEqual(idle.stats()["scheduled"], 0)  # 登录后客户端仍然使用 /echo，服务器不执行超时转移
+        self.assertEqual(self.get("/poll", token=token)[0], 404)
+        status, data = self.get("/echo", seconds=60, token=token)
+        self.assertEqual(data["msg"][0], "您已经很久没有操作了，即将返回主菜单")
+
+    def test_websocket(self):
+        async def run() -> None:
+            client = WebSocketClient()
+            self.assertEqual(await client.open(self.port), 101)
+            greeting = await client.receive()
+            self.assertEqual((greeting["route"], greeting["status"]), ("/", 200))
+            self.assertEqual(self.server.stats()["websockets"], 1)
+            self.assertEqual((await client.request({"route": "/send", "msg": "改名"}))["status"], 401)
+            data = await client.request({"route": "/send", "msg": "投诉"})
+            self.assertEqual(data["msg"][0], "请输入您的建议，不超过200个字符")
+            self.assertEqual((await client.request({"route": "/missing"}))["status"], 400)
+            self.assertEqual((await client.request({"route": "/echo", "seconds": "x"}))["status"], 400)
+            data = await client.request({"route": "/login", "username": "nobody", "password": "pw"})
+            self.assertIsNone(data["token"])
+            data = await client.request({"route": "/register", "username": "socket", "password": "pw"})
+            self.assertEqual(data["status"], 200)  # 连接改用新的token
+            self.assertEqual((await client.request({"route": "/send", "msg": "返回"}))["status"], 200)
+
+            client.writer.write(rfc6455.encode(rfc6455.PING, b"ping", masked=True))
+            text = json.dumps({"route": "/send", "msg": "退出"}).encode()
+            frame = rfc6455.encode(rfc6455.TEXT, text[:10], masked=True)
+            client.writer.write(bytes([frame[0] & 0x7F]) + frame[1:])  # 第一片不设FIN
+            client.writer.write(rfc6455.encode(rfc6455.CONTINUATION, text[10:], masked=True))
+            fin, opcode, payload = await rfc6455.read_frame(client.reader, require_mask=False)
+            self.assertEqual((opcode, payload), (rfc6455.PONG, b"ping"))
+            data = await client.receive()  # 分片的消息
+            self.assertTrue(data["exit"])
+            fin, opcode, payload = await rfc6455.read_frame(client.reader, require_mask=False)
+            self.assertEqual(opcode, rfc6455.CLOSE)  # 会话结束，服务器关闭连接
+            await client.close()
+            self.assertEqual(await client.open(self.port, greeting["token"]), 403)
+            await client.close()
+
+        asyncio.run(run())
+
+    def test_websocket_push(self):
+        clock = FakeClock()
+        idle = self.user_manage.idle = IdleScheduler(self.controller.machine, self.user_manage, clock)
+        status, data = self.get("/")
+
+        async def run() -> None:
+            client = WebSocketClient()
+            self.assertEqual(await client.open(self.port, data["token"]), 101)
+            await asyncio.sleep(0.2)
+            self.assertEqual(idle.fire(1060), 1)
+            pushed = await client.receive()
+            self.assertEqual(pushed["route"], "/poll")
+            self.assertEqual(pushed["msg"], ["您已经很久没有操作了，即将于30秒后退出"])
+            self.assertEqual(idle.fire(1090), 1)
+            self.assertTrue((await client.receive())["exit"])
+            self.assertIsNone(await client.receive())  # 服务器的关闭帧
+            await client.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+存储后端测试
+同一脚本的会话在SQLite后端和列式存储后端上得到相同的结果
+"""
+import os
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.columnar import ColumnarBackend
+from server.database.sharded import ShardedBackend
+from server.database.database import Database
+from server.state.action import UpdateAction
+from server.state.state import StateMachine
+from server.user.user_state import UserState
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+def session(machine: StateMachine, username: str) -> list[str]:
+    """注册一个用户并走完充值、改名流程，返回全部回复。"""
+    user_state = UserState()
+    response = machine.speak(user_state)
+    assert user_state.register(username, "pw", machine.db)
+    for msg in ("余额", "充值", "12.5", "充值", "7", "返回", "改名", "新名字", "余额"):
+        response += machine.state_transform(user_state, msg)
+    user_state.invalidate()  # 丢弃缓存，从后端重新读取
+    response += machine.speak(user_state)
+    return response
+
+
+class TestBackend(unittest.TestCase):
+    def setUp(self):
+        self.paths = [os.path.join(current_path, "backend.db"), os.path.join(current_path, "backend.col"),
+                      os.path.join(current_path, "sharded.db")]
+
+    def tearDown(self):
+        for path in self.paths:
+            Database.remove(path)
+        for path in self.paths:
+            for index in range(4):
+                Database.remove(Database.shard_path(path, index))
+
+    def test_same_result(self):
+        sqlite = StateMachine(script, self.paths[0])
+        columnar = StateMachine(script, self.paths[1], backend="columnar")
+        self.assertIsInstance(columnar.db.backend, ColumnarBackend)
+        sharded = StateMachine(script, self.paths[2], shards=4)
+        self.assertIsInstance(sharded.db.backend, ShardedBackend)
+        expected = session(sqlite, "alice")
+        self.assertEqual(expected, session(columnar, "alice"))
+        self.assertEqual(expected, session(sharded, "alice"))
+        for machine in (sqlite, columnar, sharded):
+            db = machine.db
+            self.assertEqual(db.get_variables("alice"),
+                             {"username": "alice", "billing": 19.5, "name": "新名字", "trans": 2})
+            self.assertEqual(db.get_variables("Guest", ["trans"]), {"trans": 0})
+            self.assertIsNone(db.get_variables("nobody"))
+            self.assertIsNone(db.create_user("alice", "other"))
+            self.assertIsNone(db.verify_login("alice", "wrong"))
+            self.assertEqual(db.verify_login("alice", "pw")["billing"], 19.5)
+            db.close()
+
+    def test_shard(self):
+        machine = StateMachine(script, self.paths[0], shards=4)
+        backend: ShardedBackend = machine.db.backend
+        names = [f"user{i}" for i in range(40)]
+        for name in names:
+            self.assertIsNotNone(machine.db.create_user(name, ""))
+        counts = []
+        for shard in backend.shards:
+            with shard.store() as store:
+                counts.append(store.execute("SELECT COUNT(*) FROM robot WHERE username != 'Guest'").get_one()[0])
+        self.assertEqual(sum(counts), 40)
+        self.assertTrue(all(count > 0 for count in counts))  # 用户分散到所有分片
+        for name in names:  # 用户所在的分片由用户名决定
+            self.assertEqual(backend.shard(name).get_variables(name, ["username"]), {"username": name})
+        metrics = machine.db.metrics()  # 合计全部分片的连接池
+        self.assertEqual(metrics["checkouts"], sum(shard.metrics()["checkouts"] for shard in backend.shards))
+        self.assertGreater(metrics["checkouts"], 40)
+        self.assertEqual(metrics["pool_size"], 4 * backend.shards[0].pool_size)
+        machine.db.close()
+
+        machine = StateMachine(script, self.paths[0], persistent=True, shards=4)  # 重启后仍然能找到用户
+        self.assertIsNotNone(machine.db.verify_login("user7", ""))
+        with self.assertRaises(ValueError):  # 分片数量改变
+            StateMachine(script, self.paths[0], persistent=True, shards=2)
+
+    def test_snapshot(self):
+        machine = StateMachine(script, self.paths[1], backend="columnar")
+        session(machine, "bob")
+        machine.db.close()
+        backend: ColumnarBackend = machine.db.backend
+        self.assertEqual(backend.columns["name"][backend.rows["bob"]], "新名字")
+
+        restored = ColumnarBackend(self.paths[1], persistent=True)
+        self.assertEqual(restored.get_variables("bob"), backend.get_variables("bob"))
+        self.assertEqual(restored.verify_login("bob", "pw")["name"], "新名字")
+        self.assertEqual(restored.version, 1)
+        self.assertEqual(restored.prepare("robot", [("billing", "Real", 0.0), ("level", "Int", 3)], True), 2)
+        self.assertEqual(restored.get_variables("bob", ["billing", "level"]), {"billing": 19.5, "level": 3})
+        self.assertEqual(restored.create_user("carol", "")["level"], 3)
+
+        rename = UpdateAction("name", "Set", "Input", "Text")
+        for index in range(1000):  # 被覆盖的文本不再保留
+            restored.apply_update("bob", rename, f"名字{index}")
+        self.assertEqual(restored.get_variables("bob", ["name"]), {"name": "名字999"})
+        restored.snapshot()
+        self.assertLess(os.path.getsize(self.paths[1]), 4096)
+        self.assertEqual(ColumnarBackend(self.paths[1], persistent=True).verify_login("bob", "pw")["name"], "名字999")
+
+        fresh = ColumnarBackend(self.paths[1], persistent=False)  # 非持久化模式不读取快照
+        self.assertIsNone(fresh.get_variables("bob"))
+        self.assertEqual(fresh.prepare("robot", [("billing", "Real", 0.0)], False), 0)  # Database: False 不建表
+        self.assertIsNone(fresh.get_variables("Guest"))
+
+    def test_periodic_snapshot(self):
+        backend = ColumnarBackend(self.paths[1], snapshot_delay=0.05)
+        backend.prepare("robot", [("billing", "Real", 0.0)], True)
+        backend.create_user("dave", "pw")
+        deadline = time.monotonic() + 5
+        while backend.snapshots == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        restored = ColumnarBackend(self.paths[1], persistent=True)  # 没有调用 close，相当于进程崩溃
+        self.assertIsNotNone(restored.verify_login("dave", "pw"))
+
+        counted = ColumnarBackend(self.paths[1], persistent=True, snapshot_changes=3, snapshot_delay=60)
+        for index in range(3):  # 达到修改数量时不等待 snapshot_delay
+            counted.create_user(f"user{index}", "")
+        deadline = time.monotonic() + 5
+        while counted.snapshots == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(counted.snapshots, 1)
+        self.assertIsNotNone(ColumnarBackend(self.paths[1], persistent=True).get_variables("user2"))
+        for item in (backend, restored, counted):
+            item.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+异步服务器基准测试
+同一个控制器分别由Flask开发服务器（多线程）和异步服务器提供服务，并发客户端反复发送消息，
+比较每秒请求数和请求延迟；异步服务器再在保持大量空闲长连接时测一次
+"""
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+import sys
+from statistics import quantiles
+from urllib.parse import urlencode
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from werkzeug.serving import make_server
+
+from app import app, controller
+from async_app import AsyncServer
+
+CLIENTS = int(os.environ.get("ASYNC_CLIENTS", "32"))
+ROUNDS = int(os.environ.get("ASYNC_ROUNDS", "30"))
+IDLE = int(os.environ.get("ASYNC_IDLE", "2000"))
+MESSAGES = ("投诉", "返回", "你好")
+
+
+def load(port: int) -> (float, float, float):
+    """每个客户端建立会话后反复发送消息。
+
+    :return: 每秒请求数、延迟的中位数和99分位数（毫秒）。
+    """
+    latencies = []
+
+    def work() -> None:
+        client = http.client.HTTPConnection("127.0.0.1", port)
+        client.request("GET", "/")
+        token = json.loads(client.getresponse().read())["token"]
+        samples = []
+        for _ in range(ROUNDS):
+            for msg in MESSAGES:
+                start = time.perf_counter()
+                client.request("GET", "/send?" + urlencode({"msg": msg, "token": token}))
+                response = client.getresponse()
+                response.read()
+                samples.append(time.perf_counter() - start)
+                assert response.status == 200
+        client.close()
+        latencies.extend(samples)
+
+    threads = [threading.Thread(target=work) for _ in range(CLIENTS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cuts = quantiles(latencies, n=100)
+    return len(latencies) / elapsed, cuts[49] * 1000, cuts[98] * 1000
+
+
+class TestAsyncBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        flask_server = make_server("127.0.0.1", 0, app, threaded=True)
+        thread = threading.Thread(target=flask_server.serve_forever, daemon=True)
+        thread.start()
+        result = {"flask": load(flask_server.server_port)}
+        flask_server.shutdown()
+
+        server = AsyncServer(controller)
+        port = server.start()
+        result["asyncio"] = load(port)
+        threads = threading.active_count()
+        sockets = [socket.create_connection(("127.0.0.1", port)) for _ in range(IDLE)]
+        result[f"asyncio+{IDLE} idle"] = load(port)
+        self.assertLessEqual(threading.active_count(), threads + CLIENTS)  # 空闲连接不占用线程
+        for sock in sockets:
+            sock.close()
+        server.stop()
+        for name, (rps, p50, p99) in result.items():
+            print(f"{name:>18}: {rps:7.0f} req/s  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+        self.assertGreater(result["asyncio"][0], result["flask"][0] * 0.8)
+
+
+if __name__ == "__main__":
+    unittest.main()
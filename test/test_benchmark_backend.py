@@ -0,0 +1,67 @@
+"""
+存储后端基准测试
+同样的脚本会话流量分别运行在SQLite后端和列式存储后端上，比较每秒处理的消息数和变量读取次数
+"""
+import os
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.user_state import UserState
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+USERS = int(os.environ.get("BACKEND_USERS", "200"))
+ROUNDS = int(os.environ.get("BACKEND_ROUNDS", "5"))
+TRAFFIC = ("余额", "充值", "12.5", "返回", "改名", "新名字", "余额", "返回")
+
+
+def run(backend: str) -> (float, float):
+    """返回每秒处理的消息数和每秒未命中缓存的变量读取次数。"""
+    path = os.path.join(current_path, f"bench.{backend}")
+    machine = StateMachine(script, path, backend=backend)
+    sessions = []
+    for i in range(USERS):
+        user_state = UserState()
+        user_state.register(f"user{i}", "pw", machine.db)
+        sessions.append(user_state)
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for user_state in sessions:
+            for msg in TRAFFIC:
+                machine.state_transform(user_state, msg)
+    messages = USERS * ROUNDS * len(TRAFFIC) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for user_state in sessions:
+            user_state.invalidate()
+            machine.speak(user_state)
+    reads = USERS * ROUNDS / (time.perf_counter() - start)
+
+    assert machine.db.get_variables("user0")["billing"] == 12.5 * ROUNDS
+    machine.db.close()
+    Database.remove(path)
+    return messages, reads
+
+
+class TestBackendBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        result = {}
+        for backend in ("sqlite", "columnar"):
+            result[backend] = run(backend)
+            print(f"{backend:>8}: {result[backend][0]:.0f} msg/s, {result[backend][1]:.0f} uncached reads/s")
+        self.assertGreater(result["columnar"][0], result["sqlite"][0])
+        self.assertGreater(result["columnar"][1], result["sqlite"][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+批量接口基准测试
+同样数量的消息分别通过逐条的 /send 和一次 /batch 发送，比较每秒处理的消息数量
+"""
+import json
+import os
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from app import app
+from controller import MAX_BATCH
+
+SESSIONS = int(os.environ.get("BATCH_SESSIONS", "100"))
+ROUNDS = int(os.environ.get("BATCH_ROUNDS", "10"))
+MESSAGES = ("投诉", "返回", "你好")
+
+
+class TestBatchBenchmark(unittest.TestCase):
+    def setUp(self):
+        app.config["TESTING"] = True
+        self.client = app.test_client()
+        self.tokens = [json.loads(self.client.get("/").data)["token"] for _ in range(SESSIONS)]
+
+    def single(self) -> float:
+        """逐条发送，返回每秒消息数量。"""
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for token in self.tokens:
+                for msg in MESSAGES:
+                    response = self.client.get("/send", query_string={"msg": msg, "token": token})
+                    assert response.status_code == 200
+        return ROUNDS * SESSIONS * len(MESSAGES) / (time.perf_counter() - start)
+
+    def batch(self) -> float:
+        """每轮全部会话的消息放在批量请求中发送，返回每秒消息数量。"""
+        items = [{"token": token, "msg": msg} for token in self.tokens for msg in MESSAGES]
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for offset in range(0, len(items), MAX_BATCH):
+                response = self.client.post("/batch", json=items[offset:offset + MAX_BATCH])
+                results = json.loads(response.data)["results"]
+                assert all(result["status"] == 200 for result in results)
+        return ROUNDS * len(items) / (time.perf_counter() - start)
+
+    def test_benchmark(self):
+        single = self.single()
+        batch = self.batch()
+        print(f"/send : {single:.0f} msg/s")
+        print(f"/batch: {batch:.0f} msg/s ({batch / single:.1f}x)")
+        self.assertGreater(batch, single)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+状态机构建基准测试
+构建时间与状态数量近似成线性关系，并报告构建过程的内存峰值
+"""
+import time
+import tracemalloc
+import unittest
+import sys
+import os
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.parser.descent import DescentParser
+from server.state.state import StateMachine
+from synthetic import generate_script
+
+SIZES = [int(size) for size in os.environ.get("BUILD_SIZES", "1000,10000,100000").split(",")]
+
+
+def build(tree: list) -> StateMachine:
+    machine = StateMachine.__new__(StateMachine)
+    machine.build(tree)
+    return machine
+
+
+class TestBuildBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        timing = {}
+        for size in SIZES:
+            tree = DescentParser(generate_script(size, services=2)).language()
+            start = time.perf_counter()
+            machine = build(tree)
+            timing[size] = time.perf_counter() - start
+            self.assertEqual(len(machine.states), size)
+
+            tracemalloc.start()
+            build(tree)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{size:>6} states: {timing[size]:.3f}s, "
+                  f"{timing[size] / size * 1e6:.1f}us/state, peak {peak / 2 ** 20:.1f}MiB")
+        smallest, largest = SIZES[0], SIZES[-1]
+        self.assertLess(timing[largest] / largest, timing[smallest] / smallest * 3)  # 每个状态的构建时间近似不变
+
+
+if __name__ == "__main__":
+    unittest.main()
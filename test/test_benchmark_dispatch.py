@@ -0,0 +1,57 @@
+"""
+条件分支匹配基准测试
+每个状态的相等判断分支数量增加时，每条消息的匹配时间保持不变
+包含判断分支数量增加时，自动机的匹配时间只与消息长度有关
+"""
+import time
+import unittest
+import sys
+import os
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.state.service import Service, ServiceTable
+from server.state.judgement import ContainJudgement, EqualJudgement, LengthJudgement, TypeJudgement
+from test_dispatch import linear_match
+
+ROUNDS = 20000
+
+
+def per_message(match, messages: list[str]) -> float:
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        match(messages[i % len(messages)])
+    return (time.perf_counter() - start) / ROUNDS
+
+
+class TestDispatchBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        timing = {}
+        for count in (10, 100, 1000):
+            services = [Service(EqualJudgement(f"选项{i}")) for i in range(count)]
+            services += [Service(LengthJudgement(">", 200)), Service(TypeJudgement("Real"))]
+            messages = [f"选项{i}" for i in range(count - 5, count)] + ["没有匹配"]
+            table = ServiceTable(services)
+            timing[count] = per_message(table.match, messages)
+            linear = per_message(lambda msg: linear_match(services, msg), messages)
+            print(f"{count:>5} services: table {timing[count] * 1e6:.2f}us, linear {linear * 1e6:.2f}us")
+        self.assertLess(timing[1000], timing[10] * 3)  # 与分支数量无关
+
+    def test_contain(self):
+        timing = {}
+        message = "我想咨询一下关于信用卡年费的问题，上个月被扣了两百元但是我记得是免年费的，麻烦帮我查一下" * 2
+        for count in (10, 100, 1000):
+            services = [Service(ContainJudgement(f"关键字{i}")) for i in range(count)]
+            services.append(Service(ContainJudgement("免年费")))
+            table = ServiceTable(services)
+            timing[count] = per_message(table.match, [message])
+            linear = per_message(lambda msg: linear_match(services, msg), [message])
+            print(f"{count:>5} contains: automaton {timing[count] * 1e6:.2f}us, linear {linear * 1e6:.2f}us")
+            self.assertIs(table.match(message), services[-1])
+        self.assertLess(timing[1000], timing[100] * 3)  # 超过阈值后与分支数量无关
+
+
+if __name__ == "__main__":
+    unittest.main()
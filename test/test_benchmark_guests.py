@@ -0,0 +1,47 @@
+"""
+无状态访客内存基准测试
+大量访客连接后不再发送消息，比较有状态与无状态访客在服务器上保留的内存
+"""
+import os
+import time
+import tracemalloc
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.user.user_manage import UserManage
+
+STATELESS_CONNECTS = int(os.environ.get("GUEST_CONNECTS", "1000000"))
+STATEFUL_CONNECTS = int(os.environ.get("GUEST_STATEFUL_CONNECTS", "100000"))
+
+
+def run(stateless: bool, connects: int) -> (float, float):
+    """连接 ``connects`` 次，返回每次连接保留的字节数和每秒连接数。"""
+    user_manage = UserManage("secret", stateless_guests=stateless)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for _ in range(connects):
+        user_manage.connect()
+    elapsed = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    user_manage.sessions.stop()
+    return retained / connects, connects / elapsed
+
+
+class TestGuestBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        stateful, stateful_rate = run(False, STATEFUL_CONNECTS)
+        print(f"stateful  {STATEFUL_CONNECTS:>8} connects: {stateful:.0f} bytes/connect, {stateful_rate:.0f} connects/s")
+        stateless, stateless_rate = run(True, STATELESS_CONNECTS)
+        print(f"stateless {STATELESS_CONNECTS:>8} connects: {stateless:.1f} bytes/connect, {stateless_rate:.0f} connects/s")
+        self.assertLess(stateless, 1.0)  # 服务器不为无状态访客保留内存
+        self.assertLess(stateless * 100, stateful)
+
+
+if __name__ == "__main__":
+    unittest.main()
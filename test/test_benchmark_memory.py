@@ -0,0 +1,43 @@
+"""
+会话内存基准测试
+用tracemalloc统计每个在线会话占用的字节数，包括User对象、用户状态、会话表和超时时间轮中的记录
+"""
+import os
+import tracemalloc
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.user.user_manage import UserManage
+
+SESSIONS = [int(count) for count in os.environ.get("MEMORY_SESSIONS", "10000,100000,1000000").split(",")]
+BUDGET = 400  # 每个会话的字节数上限
+
+
+def measure(sessions: int) -> float:
+    """建立 ``sessions`` 个访客会话，返回每个会话占用的字节数。"""
+    user_manage = UserManage("secret")
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(sessions):
+        user_manage.connect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(user_manage.users) == sessions
+    user_manage.sessions.stop()
+    return retained / sessions
+
+
+class TestMemoryBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        for sessions in SESSIONS:
+            size = measure(sessions)
+            print(f"{sessions:>8} sessions: {size:.0f} bytes/session")
+            self.assertLess(size, BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+解析器基准测试
+在合成脚本上比较pyparsing解析器与递归下降解析器的解析时间
+"""
+import os
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.parser.parser import Parser
+from server.parser.descent import DescentParser
+from synthetic import generate_script
+
+PYPARSING_LIMIT = int(os.environ.get("PYPARSING_LIMIT", 10000))  # pyparsing解析器参与比较的最大行数
+
+
+class TestParserBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        timing = {}
+        for lines in (10000, 50000, 100000):
+            text = generate_script(lines // 17)
+            start = time.perf_counter()
+            result = DescentParser(text).language()
+            timing[lines] = time.perf_counter() - start
+            print(f"descent   {lines:>6} lines: {timing[lines]:.3f}s")
+            if lines <= PYPARSING_LIMIT:
+                start = time.perf_counter()
+                expected = Parser.language.parse_string(text, parse_all=True).as_list()
+                print(f"pyparsing {lines:>6} lines: {time.perf_counter() - start:.3f}s")
+                self.assertEqual(result, expected)
+        self.assertLess(timing[100000], timing[10000] * 10 * 2)  # 近似线性
+
+
+if __name__ == "__main__":
+    unittest.main()
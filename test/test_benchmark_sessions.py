@@ -0,0 +1,70 @@
+"""
+会话表基准测试
+64个线程同时连接、发送消息、登录，比较单段与多段会话表的每秒操作数量
+"""
+import os
+import time
+import unittest
+import sys
+from threading import Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+THREADS = 64
+ROUNDS = int(os.environ.get("SESSION_ROUNDS", "20"))
+SHARDS = [int(count) for count in os.environ.get("SESSION_SHARDS", "1,16").split(",")]
+
+
+def run(machine: StateMachine, shards: int) -> float:
+    """每个线程反复连接、发送三条消息、登录、退出，返回每秒操作数量。"""
+    user_manage = UserManage("secret", shards=shards)
+
+    def work(i: int) -> None:
+        for _ in range(ROUNDS):
+            user, token = user_manage.connect()
+            machine.speak(user.state)
+            for msg in ("投诉", "返回", "你好"):
+                machine.state_transform(user_manage.jwt_decode(token).state, msg)
+            token = user_manage.login(user, f"user{i}", "pw", machine.db)
+            assert token is not None
+            user_manage.jwt_decode(token)
+            user_manage.timeout(user.username)
+
+    threads = [Thread(target=work, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert len(user_manage.users) == 0
+    user_manage.sessions.stop()
+    return THREADS * ROUNDS * 6 / elapsed
+
+
+class TestSessionBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        path = os.path.join(current_path, "session_bench.db")
+        machine = StateMachine(script, path)
+        for i in range(THREADS):
+            machine.db.create_user(f"user{i}", "pw")
+        result = {}
+        for shards in SHARDS:
+            result[shards] = run(machine, shards)
+            print(f"{shards:>2} shards: {result[shards]:.0f} ops/s")
+        Database.remove(path)
+        # 解释器锁下段锁只减少等待，单核机器上只要求分段不降低吞吐
+        self.assertGreater(result[SHARDS[-1]], result[SHARDS[0]] * 0.8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+分片存储基准测试
+多个线程同时存款，比较单个SQLite文件与多个分片的每秒更新数量
+"""
+import os
+import time
+import unittest
+import sys
+from threading import Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.state.action import UpdateAction
+from server.user.user_state import UserState, VariableSet
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+UPDATES = int(os.environ.get("SHARD_UPDATES", "1600"))
+THREADS = 16
+SHARDS = [int(count) for count in os.environ.get("SHARD_COUNTS", "1,4").split(",")]
+
+
+def run(shards: int) -> (float, list[int]):
+    """每个线程代表一个用户连续存款。
+
+    :return: 每秒更新数量，以及每个分片中用户的行数。
+    """
+    path = os.path.join(current_path, "shard_bench.db")
+    db = Database(path, shards=shards)
+    db.prepare("robot", [("balance", "Real", 0.0)], True)
+    sessions = []
+    for i in range(THREADS):
+        user_state = UserState()
+        user_state.register(f"user{i}", "", db)
+        sessions.append(user_state)
+    deposit = UpdateAction("balance", "Add", "Input", "Real")
+
+    def work(user_state: UserState) -> None:
+        for _ in range(UPDATES // THREADS):
+            deposit.exec(user_state, [], "10", db)
+
+    threads = [Thread(target=work, args=(user_state,)) for user_state in sessions]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for user_state in sessions:
+        assert db.get_variables(user_state.username, ["balance"])["balance"] == UPDATES // THREADS * 10.0
+    rows = []
+    for shard in getattr(db.backend, "shards", [db]):
+        with shard.store() as store:
+            rows.append(store.execute("SELECT COUNT(*) FROM robot WHERE username != 'Guest'").get_one()[0])
+    db.close()
+    Database.remove(path)
+    for index in range(shards):
+        Database.remove(Database.shard_path(path, index))
+    return UPDATES / elapsed, rows
+
+
+class TestShardBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        VariableSet.define("balance", "Real", 0.0)
+        for shards in SHARDS:
+            rate, rows = run(shards)
+            print(f"{shards:>2} shards: {rate:.0f} updates/s, users per shard {rows}")
+            # 吞吐量取决于核数、磁盘和机器负载，只输出不断言；断言写入确实分散到了每个分片
+            self.assertEqual(len(rows), shards)
+            self.assertEqual(sum(rows), THREADS)
+            if shards <= THREADS // 2:
+                self.assertNotIn(0, rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+更新动作基准测试
+比较每次更新立即提交与延迟写入队列批量提交的每秒更新数量
+"""
+import os
+import time
+import unittest
+import sys
+from threading import Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from storm.store import Store
+from server.database.database import Database
+from server.state.action import UpdateAction
+from server.user.user_state import UserState, VariableSet
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+UPDATES = int(os.environ.get("UPDATE_COUNT", "2000"))
+THREADS = 8
+
+
+def run(durability: str) -> float:
+    """多个会话并发存取款，返回每秒更新数量。"""
+    path = os.path.join(current_path, f"bench_{durability}.db")
+    db = Database(path, durability)
+    store = Store(db.database)
+    store.execute("CREATE TABLE robot (username TEXT PRIMARY KEY, password TEXT, balance REAL)")
+    store.commit()
+    store.close()
+    sessions = []
+    for i in range(THREADS):
+        user_state = UserState()
+        user_state.register(f"user{i}", "", db)
+        sessions.append(user_state)
+    deposit = UpdateAction("balance", "Add", "Input", "Real")
+    withdraw = UpdateAction("balance", "Sub", 1.5, None)
+
+    def work(user_state: UserState) -> None:
+        for i in range(UPDATES // THREADS):
+            if i % 2 == 0:
+                deposit.exec(user_state, [], "3", db)
+            else:
+                withdraw.exec(user_state, [], "", db)
+
+    threads = [Thread(target=work, args=(user_state,)) for user_state in sessions]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush()  # 计入队列中剩余更新的提交时间
+    elapsed = time.perf_counter() - start
+
+    store = Store(db.database)
+    for user_state in sessions:
+        balance = store.get(VariableSet, user_state.username).balance
+        assert balance == user_state.cache["balance"] == UPDATES // THREADS // 2 * 1.5
+    store.close()
+    if db.queue is not None:
+        print(f"  {db.queue.batches} transactions")
+        db.queue.close()
+    Database.remove(path)
+    return UPDATES / elapsed
+
+
+class TestUpdateBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        VariableSet.define("balance", "Real", 0.0)
+        commit = run("commit")
+        print(f"commit: {commit:.0f} updates/s")
+        batch = run("batch")
+        print(f"batch:  {batch:.0f} updates/s")
+        self.assertGreater(batch, commit)
+
+
+if __name__ == "__main__":
+    unittest.main()
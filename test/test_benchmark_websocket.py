@@ -0,0 +1,116 @@
+"""
+WebSocket基准测试
+并发客户端通过异步服务器的 /send（HTTP长连接，每次带token和完整的请求头）和 /ws（鉴权一次，每条消息一帧）
+发送同样的消息，比较每秒消息数、往返延迟和每条消息在连接上传输的字节数
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+import unittest
+import sys
+from statistics import median
+from urllib.parse import urlencode
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+import rfc6455
+from async_app import AsyncServer
+from controller import Controller
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+CLIENTS = int(os.environ.get("WS_CLIENTS", "16"))
+ROUNDS = int(os.environ.get("WS_ROUNDS", "100"))
+MESSAGES = ("投诉", "返回", "你好")
+HEADERS = "Host: 127.0.0.1\r\nUser-Agent: python-requests/2.26.0\r\nAccept-Encoding: gzip, deflate\r\n" \
+          "Accept: */*\r\nConnection: keep-alive\r\n\r\n"  # 与客户端使用的 requests 相同的请求头
+
+
+async def http_client(port: int, samples: list) -> int:
+    """通过 /send 发送消息，返回传输的字节数。"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    transferred = 0
+
+    async def get(target: str) -> dict:
+        nonlocal transferred
+        request = f"GET {target} HTTP/1.1\r\n{HEADERS}".encode()
+        writer.write(request)
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        body = await reader.readexactly(length)
+        transferred += len(request) + len(head) + length
+        return json.loads(body)
+
+    token = (await get("/"))["token"]
+    transferred = 0
+    for _ in range(ROUNDS):
+        for msg in MESSAGES:
+            start = time.perf_counter()
+            await get("/send?" + urlencode({"token": token, "msg": msg}))
+            samples.append(time.perf_counter() - start)
+    writer.close()
+    return transferred
+
+
+async def websocket_client(port: int, samples: list) -> int:
+    """通过 /ws 发送消息，返回传输的字节数（不含握手）。"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(f"GET /ws HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+    await reader.readuntil(b"\r\n\r\n")
+    await rfc6455.read_message(reader, writer, require_mask=False)  # 问候消息
+    transferred = 0
+    for _ in range(ROUNDS):
+        for msg in MESSAGES:
+            start = time.perf_counter()
+            frame = rfc6455.encode(rfc6455.TEXT, json.dumps({"route": "/send", "msg": msg}).encode(), masked=True)
+            writer.write(frame)
+            text = await rfc6455.read_message(reader, writer, require_mask=False)
+            samples.append(time.perf_counter() - start)
+            encoded = len(text.encode())
+            transferred += len(frame) + encoded + (2 if encoded < 126 else 4)
+    writer.close()
+    return transferred
+
+
+async def measure(client, port: int) -> (float, float, float):
+    """并发运行客户端。
+
+    :return: 每秒消息数、往返延迟的中位数（毫秒）和每条消息的字节数。
+    """
+    samples = []
+    start = time.perf_counter()
+    transferred = await asyncio.gather(*[client(port, samples) for _ in range(CLIENTS)])
+    elapsed = time.perf_counter() - start
+    return len(samples) / elapsed, median(samples) * 1000, sum(transferred) / len(samples)
+
+
+class TestWebSocketBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        path = os.path.join(current_path, "websocket_bench.db")
+        user_manage = UserManage("secret")
+        server = AsyncServer(Controller(user_manage, StateMachine(script, path)))
+        port = server.start()
+        result = {
+            "/send": asyncio.run(measure(http_client, port)),
+            "/ws": asyncio.run(measure(websocket_client, port)),
+        }
+        server.stop()
+        user_manage.sessions.stop()
+        Database.remove(path)
+        for name, (rate, latency, size) in result.items():
+            print(f"{name:>6}: {rate:6.0f} msg/s  p50 {latency:6.2f} ms  {size:5.0f} B/msg")
+        self.assertLess(result["/ws"][2], result["/send"][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
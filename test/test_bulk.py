@@ -0,0 +1,84 @@
+"""
+批量导入导出测试
+"""
+import io
+import json
+import os
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.bulk import BulkLoader, main, read_records
+from server.database.database import Database
+from server.state.state import StateMachine
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "bulk.db")
+        self.csv_path = os.path.join(current_path, "bulk.csv")
+        self.jsonl_path = os.path.join(current_path, "bulk.jsonl")
+        with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("username,password,billing,name\n")
+            for i in range(250):
+                f.write(f"user{i},pw{i},{i}.5,名字{i}\n")
+            f.write("user3,again,0,重复\n")  # 已存在，跳过
+            f.write("bad,pw,not-a-number,x\n")  # 类型错误，拒绝
+            f.write("nodefault,pw,,\n")  # 缺少的变量取默认值
+
+    def tearDown(self):
+        for path in (self.csv_path, self.jsonl_path):
+            if os.path.exists(path):
+                os.remove(path)
+        Database.remove(self.db_path)
+        for index in range(3):
+            Database.remove(Database.shard_path(self.db_path, index))
+
+    def test_import_export(self):
+        for shards in (1, 3):
+            machine = StateMachine(script, self.db_path, shards=shards)
+            loader = BulkLoader(self.db_path, machine.db_name, machine.variables, shards, batch_size=64)
+            reports = []
+            with open(self.csv_path, "r", encoding="utf-8", newline="") as f:
+                result = loader.import_records(read_records(f, "csv"), lambda *args: reports.append(args))
+            self.assertEqual(result, (253, 251, 1))
+            self.assertGreater(len(reports), 3)  # 每提交一批报告一次进度
+            self.assertEqual(machine.db.verify_login("user7", "pw7"),
+                             {"username": "user7", "billing": 7.5, "name": "名字7", "trans": 0})
+            self.assertEqual(machine.db.get_variables("user3", ["name"]), {"name": "名字3"})
+            self.assertEqual(machine.db.get_variables("nodefault", ["billing", "name"]),
+                             {"billing": 0.0, "name": "用户"})
+
+            out = io.StringIO()
+            self.assertEqual(loader.export_file(out, "jsonl"), 251)
+            records = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual(sorted(record["username"] for record in records)[:2], ["nodefault", "user0"])
+            machine.db.close()
+
+    def test_bad_lines(self):
+        machine = StateMachine(script, self.db_path)
+        loader = BulkLoader(self.db_path, machine.db_name, machine.variables)
+        lines = ['{"username": "good", "billing": 1}\n', "not json\n", "[1, 2]\n", '"text"\n',
+                 '{"username": "after"}\n']
+        self.assertEqual(loader.import_records(read_records(io.StringIO("".join(lines)), "jsonl")), (5, 2, 3))
+        self.assertEqual(machine.db.get_variables("good", ["billing"]), {"billing": 1.0})
+        self.assertIsNotNone(machine.db.get_variables("after"))  # 错误的行之后继续导入
+        machine.db.close()
+
+    def test_cli(self):
+        self.assertEqual(main(["import", script, self.db_path, self.csv_path]), 2)  # 有被拒绝的记录
+        self.assertEqual(main(["export", script, self.db_path, self.jsonl_path, "--batch", "10"]), 0)
+        Database.remove(self.db_path)
+        self.assertEqual(main(["import", script, self.db_path, self.jsonl_path]), 0)  # 导出的文件可以重新导入
+        machine = StateMachine(script, self.db_path, persistent=True)
+        self.assertEqual(machine.db.verify_login("user249", "pw249")["billing"], 249.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+数据库连接池测试
+"""
+import os
+import unittest
+import sys
+from threading import Barrier, Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.user.user_state import UserState
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(current_path, "pool.db")
+        self.db = Database(self.path, pool_size=4, busy_timeout=2.0)
+        with self.db.store() as store:
+            store.execute("CREATE TABLE robot (username TEXT PRIMARY KEY, password TEXT)")
+
+    def tearDown(self):
+        Database.remove(self.path)
+
+    def count(self) -> int:
+        with self.db.store() as store:
+            return store.execute("SELECT COUNT(*) FROM robot").get_one()[0]
+
+    def test_store(self):
+        with self.db.store() as store:
+            self.assertEqual(store.execute("PRAGMA journal_mode").get_one()[0], "wal")
+            with self.db.store() as inner:  # 嵌套使用共用同一事务
+                self.assertIs(inner, store)
+                inner.execute("INSERT INTO robot VALUES ('a', '')")
+        with self.db.store() as store:
+            self.assertIs(store, self.db.local.store)  # 同一线程重复使用Store
+        self.assertEqual(self.count(), 1)
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.store() as store:
+                store.execute("INSERT INTO robot VALUES ('b', '')")
+                1 / 0
+        self.assertEqual(self.count(), 1)  # 异常时回滚
+
+    def test_threads(self):
+        barrier = Barrier(8)
+        seen = []
+
+        def work(i: int) -> None:
+            barrier.wait()
+            with self.db.store() as store:
+                store.execute("INSERT INTO robot VALUES (?, '')", (f"user{i}",))
+            seen.append(self.count())
+
+        threads = [Thread(target=work, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.count(), 8)  # 其他线程提交的修改对后续读取可见
+        self.assertIn(8, seen)
+        metrics = self.db.metrics()
+        self.assertEqual(metrics["pool_size"], 4)
+        self.assertEqual(metrics["busy_timeout"], 2.0)
+        self.assertEqual(metrics["stores"], 9)  # 每个线程一个Store
+        self.assertEqual(metrics["in_use"], 0)
+        self.assertGreaterEqual(metrics["wait_max"], 0.0)
+
+    def test_register_race(self):
+        barrier = Barrier(8)
+        results = []
+
+        def register() -> None:
+            user_state = UserState()
+            barrier.wait()
+            results.append(user_state.register("same", "", self.db))
+
+        threads = [Thread(target=register) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [False] * 7 + [True])  # 只有一个线程注册成功
+        self.assertEqual(self.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
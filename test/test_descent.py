@@ -0,0 +1,54 @@
+"""
+递归下降解析器测试
+与pyparsing解析器进行差分测试
+"""
+import os
+import unittest
+import sys
+from pyparsing import ParseException
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.parser.parser import Parser
+from server.parser.descent import DescentParser
+from server.state.state import StateMachine
+from server.util.GrammarException import GrammarException
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+class TestDescentParser(unittest.TestCase):
+    def test_analyse_file(self):
+        """
+        两个解析器对 parser/case*.txt 的解析结果相同
+        """
+        for i in range(1, 6):
+            file = os.path.join(current_path, f"parser/case{i}.txt")
+            try:
+                expected = Parser.analyse_file(file)
+            except ParseException:
+                with self.assertRaises(GrammarException):
+                    DescentParser.analyse_file(file)
+                continue
+            self.assertEqual(DescentParser.analyse_file(file), expected)
+            self.assertEqual(repr(DescentParser.analyse_file(file)), repr(expected))
+
+    def test_keyword(self):
+        with self.assertRaises(GrammarException):  # 关键字后紧接标识符字符
+            DescentParser("Basic:\n Name: robot\n Database: True\nState: Begin\n Speak:$name\n Default:").language()
+        result = DescentParser("Basic: Name: robot Database: True\nState: Begin Default:\tGoto Begin").language()
+        self.assertEqual(result[1], ["State:", "Begin", [], [], [], ["Default:", [["Goto", "Begin"]]], []])
+
+    def test_state_machine(self):
+        file = os.path.join(current_path, "parser/case2.txt")
+        expected = StateMachine(file, None)
+        m = StateMachine(file, None, engine="descent")
+        self.assertEqual(repr(m.states), repr(expected.states))
+        self.assertEqual(repr(m.service), repr(expected.service))
+        self.assertEqual(repr(m.wait), repr(expected.wait))
+
+
+if __name__ == "__main__":
+    unittest.main()
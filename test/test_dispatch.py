@@ -0,0 +1,91 @@
+"""
+条件分支表测试
+"""
+import random
+import unittest
+import sys
+import os
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.state.automaton import Automaton
+from server.state.service import Service, ServiceTable
+from server.state.judgement import (
+    ContainJudgement,
+    LengthJudgement,
+    TypeJudgement,
+    EqualJudgement,
+)
+
+
+def linear_match(services: list[Service], msg: str):
+    """按声明顺序逐个检查，作为对照。"""
+    for case in services:
+        if case.judgement.check(msg):
+            return case
+    return None
+
+
+class TestServiceTable(unittest.TestCase):
+    def test_match(self):
+        services = [
+            Service(EqualJudgement("返回")),
+            Service(ContainJudgement("存")),
+            Service(EqualJudgement(" 存款 ")),
+            Service(LengthJudgement("<", 2)),
+            Service(EqualJudgement("1")),
+            Service(EqualJudgement("返回")),
+        ]
+        table = ServiceTable(services)
+        self.assertIs(table.match(" 返回"), services[0])
+        self.assertIs(table.match("存款"), services[1])  # 声明在前的包含判断优先
+        self.assertIs(table.match("1"), services[3])  # 声明在前的长度判断优先
+        self.assertIsNone(table.match("取款"))
+
+    def test_random(self):
+        """随机生成分支和输入，结果与逐个检查相同"""
+        default = ServiceTable.automaton_threshold
+        try:
+            for threshold in (1, 4, default):
+                ServiceTable.automaton_threshold = threshold
+                self.check_random()
+        finally:
+            ServiceTable.automaton_threshold = default
+
+    def check_random(self):
+        random.seed(0)
+        words = ["a", "b", "ab", " a", "ba ", "12", "1.5", "", "aab", "bab"]
+        for _ in range(500):
+            services = []
+            for _ in range(random.randint(0, 16)):
+                kind = random.randrange(4)
+                if kind == 0:
+                    services.append(Service(EqualJudgement(random.choice(words))))
+                elif kind == 1:
+                    services.append(Service(ContainJudgement(random.choice(words))))
+                elif kind == 2:
+                    services.append(Service(LengthJudgement(random.choice(["<", ">", "="]), random.randint(0, 3))))
+                else:
+                    services.append(Service(TypeJudgement(random.choice(["Int", "Real"]))))
+            table = ServiceTable(services)
+            for msg in words + ["abc", " 12 ", "x", "xaabab", "babab"]:
+                self.assertIs(table.match(msg), linear_match(services, msg))
+
+
+class TestAutomaton(unittest.TestCase):
+    def test_search(self):
+        automaton = Automaton([("he", 3), ("she", 1), ("his", 2), ("hers", 0)])
+        self.assertEqual(automaton.search("ushers"), 0)
+        self.assertEqual(automaton.search("ushe"), 1)
+        self.assertEqual(automaton.search("ahishe", 2), 1)
+        self.assertEqual(automaton.search("this", 2), 2)
+        self.assertEqual(automaton.search("xyz"), float("inf"))
+        automaton = Automaton([("abc", 1), ("", 5)])
+        self.assertEqual(automaton.search(""), 5)
+        self.assertEqual(automaton.search("xabcx"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
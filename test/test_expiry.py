@@ -0,0 +1,105 @@
+"""
+会话过期测试
+"""
+import os
+import threading
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+import jwt
+
+from server.user.expiry import ExpiryWheel
+from server.user.user_manage import UserManage
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestExpiryWheel(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.expired = []
+        self.wheel = ExpiryWheel(10, self.expired.extend, 1.0, self.clock)
+
+    def advance(self, seconds: float) -> int:
+        self.clock.now += seconds
+        return self.wheel.advance()
+
+    def test_expire(self):
+        for key in ("a", "b", "c"):
+            self.wheel.add(key)
+        self.assertEqual(self.advance(5), 0)
+        self.assertTrue(self.wheel.touch("a"))  # a 的截止时间推迟到15秒
+        self.wheel.discard("c")
+        self.assertEqual(self.advance(6), 1)
+        self.assertEqual(self.expired, ["b"])
+        self.assertFalse(self.wheel.touch("b"))  # 过期后不能复活
+        self.assertEqual(self.advance(3), 0)
+        self.assertEqual(self.advance(2), 1)
+        self.assertEqual(self.expired, ["b", "a"])
+        self.assertEqual(self.wheel.stats()["alive"], 0)
+        self.assertEqual(self.wheel.stats()["evicted"], 2)  # 主动移除不计入
+
+    def test_batch(self):
+        for i in range(10000):
+            self.wheel.add(i)
+        self.clock.now += 5
+        for i in range(0, 10000, 2):
+            self.wheel.touch(i)
+        self.assertEqual(self.advance(5.5), 5000)  # 未被推迟的一半全部过期
+        self.assertEqual(self.wheel.alive(), 5000)
+        self.assertEqual(self.advance(100), 5000)  # 时间跳跃超过一圈
+
+    def test_late_touch(self):
+        self.wheel.add("a")
+        self.clock.now += 9.9
+        self.wheel.touch("a")
+        self.assertEqual(self.advance(0.2), 0)
+        self.assertEqual(self.advance(9.7), 0)
+        self.assertEqual(self.advance(1.1), 1)  # 过期时间最多晚一个刻度
+
+
+class TestUserManage(unittest.TestCase):
+    def test_timeout(self):
+        user_manage = UserManage("secret", ttl=0.2, resolution=0.05)
+        _, idle = user_manage.connect()
+        user, token = user_manage.connect()
+        for _ in range(6):
+            time.sleep(0.05)
+            self.assertIs(user_manage.jwt_decode(token), user)  # 每次请求推迟超时
+        with self.assertRaises(jwt.InvalidTokenError):
+            user_manage.jwt_decode(idle)
+        time.sleep(0.4)
+        with self.assertRaises(jwt.InvalidTokenError):
+            user_manage.jwt_decode(token)
+        self.assertEqual(len(user_manage.users), 0)
+        self.assertEqual(user_manage.session_stats()["alive"], 0)
+        self.assertEqual(user_manage.session_stats()["evicted"], 2)
+        user_manage.sessions.stop()
+
+    def test_no_threads(self):
+        user_manage = UserManage("secret")
+        threads = threading.active_count()
+        for _ in range(10000):
+            _, token = user_manage.connect()
+        user_manage.jwt_decode(token)
+        self.assertEqual(threading.active_count(), threads)  # 会话不占用线程
+        self.assertEqual(user_manage.session_stats()["alive"], 10000)
+        user, _ = user_manage.connect()
+        user_manage.timeout(user.username)
+        self.assertEqual(user_manage.session_stats()["alive"], 10000)
+        user_manage.sessions.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+无状态访客测试
+"""
+import os
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+import jwt
+
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class TestStatelessGuests(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "guests.db")
+        self.machine = StateMachine(script, self.db_path)
+        self.machine.db.create_user("alice", "pw")
+        self.user_manage = UserManage("secret", stateless_guests=True)
+
+    def tearDown(self):
+        self.user_manage.sessions.stop()
+        Database.remove(self.db_path)
+
+    def send(self, token: str, msg: str) -> (list[str], str):
+        """与 /send 路由相同的处理。"""
+        user = self.user_manage.jwt_decode(token)
+        response = self.machine.state_transform(user.state, msg)
+        if user.state.state == -1:
+            self.user_manage.timeout(user.username)
+        new_token = self.user_manage.reissue(user)
+        return response, new_token if new_token is not None else token
+
+    def test_state_in_token(self):
+        user, token = self.user_manage.connect()
+        self.assertEqual(len(self.user_manage.users), 0)  # 服务器不保存访客
+        self.assertEqual(self.user_manage.session_stats()["alive"], 0)
+        response, token = self.send(token, "投诉")
+        self.assertEqual(response, ["请输入您的建议，不超过200个字符"])
+        self.assertEqual(self.user_manage.jwt_decode(token).state.state, self.machine.state_map["Complain"])
+
+        user = self.user_manage.jwt_decode(token)
+        response, _, _ = self.machine.timeout_transform(user.state, 65)
+        self.assertEqual(response[0], "您已经很久没有操作了，即将返回主菜单")
+        token = self.user_manage.reissue(user)
+        self.assertEqual(self.user_manage.jwt_decode(token).state.last_time, 65)
+
+        response, exit_token = self.send(token, "投诉")
+        response, exit_token = self.send(exit_token, "很好")
+        self.assertEqual(response, ["感谢您的建议"])
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(exit_token)  # 会话结束的令牌被拒绝
+
+    def test_login(self):
+        user, token = self.user_manage.connect()
+        _, token = self.send(token, "投诉")
+        user = self.user_manage.jwt_decode(token)
+        new_token = self.user_manage.login(user, "alice", "pw", self.machine.db)
+        self.assertIsNotNone(new_token)
+        self.assertIs(self.user_manage.jwt_decode(new_token), user)  # 登录后成为有状态的会话
+        self.assertIsNone(self.user_manage.reissue(user))
+        self.assertEqual(user.state.state, self.machine.state_map["Complain"])
+        self.assertEqual(self.user_manage.session_stats()["alive"], 1)
+
+        other = self.user_manage.jwt_decode(self.user_manage.connect()[1])
+        self.assertIsNone(self.user_manage.login(other, "alice", "pw", self.machine.db))  # 已经登录
+        self.assertTrue(other.stateless)
+
+    def test_rejected(self):
+        _, token = self.user_manage.connect()
+        stateful = UserManage("secret")
+        with self.assertRaises(jwt.InvalidTokenError):
+            stateful.jwt_decode(token)  # 未开启无状态访客
+        stateful.sessions.stop()
+        forged = jwt.encode({"guest": "Guest_1", "state": 0, "last": 0, "exp": int(time.time()) + 60}, "other",
+                            algorithm="HS256")
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(forged)
+        expired = jwt.encode({"guest": "Guest_1", "state": 0, "last": 0, "exp": int(time.time()) - 1}, "secret",
+                             algorithm="HS256")
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(expired)  # 闲置超时
+
+
+if __name__ == '__main__':
+    unittest.main()
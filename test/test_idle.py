@@ -0,0 +1,164 @@
+"""
+闲置调度测试
+"""
+import os
+import time
+import unittest
+import sys
+from threading import Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.state import idle
+from server.state.idle import IdleScheduler
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestIdleScheduler(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "idle.db")
+        self.machine = StateMachine(script, self.db_path)
+        self.clock = FakeClock()
+        self.user_manage = UserManage("secret")
+        self.idle = IdleScheduler(lambda: self.machine, self.user_manage, self.clock)
+        self.user_manage.idle = self.idle
+        self.user, _ = self.user_manage.connect()
+        self.idle.enroll(self.user)
+
+    def tearDown(self):
+        self.user_manage.sessions.stop()
+        Database.remove(self.db_path)
+
+    def test_exit(self):
+        self.assertEqual(self.idle.fire(1059), 0)
+        self.assertEqual(self.idle.poll(self.user, 0), ([], False, False))
+        self.assertEqual(self.idle.fire(1060), 1)
+        self.assertEqual(self.idle.poll(self.user, 0), (["您已经很久没有操作了，即将于30秒后退出"], False, False))
+        self.assertEqual(self.idle.fire(1089), 0)
+        self.assertEqual(self.idle.fire(1090), 1)
+        self.assertEqual(self.idle.poll(self.user, 0), ([], True, True))
+        self.assertEqual(self.idle.stats()["scheduled"], 0)
+
+    def test_touch(self):
+        self.clock.now = 1050
+        self.idle.touch(self.user)  # 发送消息，闲置时间重新计算
+        self.assertEqual(self.idle.fire(1100), 0)
+        self.assertEqual(self.idle.fire(1110), 1)
+        self.assertEqual(self.user.state.last_time, 60)
+
+    def test_reset(self):
+        self.machine.state_transform(self.user.state, "投诉")
+        self.idle.touch(self.user)
+        self.assertEqual(self.idle.fire(1060), 1)  # 超时返回主菜单
+        messages, exit_, reset = self.idle.poll(self.user, 0)
+        self.assertEqual(messages[0], "您已经很久没有操作了，即将返回主菜单")
+        self.assertEqual((exit_, reset), (False, True))
+        self.assertEqual(self.idle.fire(1119), 0)
+        self.assertEqual(self.idle.fire(1120), 1)  # 主菜单的Wait从转移时开始计算
+
+    def test_rounding(self):
+        self.clock.now = 1000.1
+        self.idle.touch(self.user)  # 1060.1 - 1000.1 略小于60
+        self.assertEqual(self.idle.fire(1060.1), 1)
+        self.assertEqual(self.user.state.last_time, 60)
+        self.assertEqual(self.idle.poll(self.user, 0)[0], ["您已经很久没有操作了，即将于30秒后退出"])
+        self.assertEqual(self.idle.stats()["scheduled"], 1)  # 下一个Wait分支
+
+    def test_error(self):
+        other, _ = self.user_manage.connect()
+        self.idle.enroll(other)
+        transform = self.machine.timeout_transform
+
+        def failing(user_state, seconds):
+            if user_state is self.user.state:
+                user_state.last_time = seconds
+                raise RuntimeError("转移失败")
+            return transform(user_state, seconds)
+
+        self.machine.timeout_transform = failing
+        self.assertEqual(self.idle.fire(1060), 2)
+        self.assertEqual(self.idle.poll(other, 0)[0], ["您已经很久没有操作了，即将于30秒后退出"])
+        self.assertEqual(self.idle.stats()["errors"], 1)
+        self.assertEqual(self.idle.stats()["scheduled"], 2)  # 出错的会话仍然安排下一个Wait分支
+        self.machine.timeout_transform = transform
+        self.assertEqual(self.idle.fire(1090), 2)
+        self.assertEqual(self.idle.poll(self.user, 0), ([], True, True))
+
+    def test_not_enrolled(self):
+        other, _ = self.user_manage.connect()
+        self.idle.touch(other)  # 客户端没有被告知使用推送，仍然定时发送 /echo
+        self.assertEqual(self.idle.stats()["scheduled"], 1)
+        self.assertEqual(self.idle.fire(1060), 1)
+        self.assertEqual(other.state.last_time, 0)
+
+    def test_compact(self):
+        for index in range(1000):  # 会话发送消息的频率远高于Wait分支的时间
+            self.clock.now = 1000 + index * 0.01
+            self.idle.touch(self.user)
+        stats = self.idle.stats()
+        self.assertEqual(stats["scheduled"], 1)
+        self.assertLessEqual(stats["heap"], idle.COMPACT + idle.COMPACT_MIN + 1)
+        self.assertEqual(self.idle.fire(1069), 0)
+        self.assertEqual(self.idle.fire(1070), 1)
+        self.assertEqual(self.idle.stats()["fired"], 1)
+
+    def test_turn(self):
+        result = []
+        with self.user_manage.turn(self.user):  # 正在处理会话的消息
+            thread = Thread(target=lambda: result.append(self.idle.fire(1060)))
+            thread.start()
+            time.sleep(0.05)
+            self.assertEqual(result, [])
+            self.idle.touch(self.user)
+        thread.join()
+        self.assertEqual(result, [0])  # 超时转移没有执行
+        self.assertEqual(self.user.state.last_time, 0)  # 超时时间已经改变，不再执行转移
+        self.assertEqual(self.idle.poll(self.user, 0), ([], False, False))
+
+    def test_long_poll(self):
+        result = []
+        thread = Thread(target=lambda: result.append(self.idle.poll(self.user, 5)))
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.05)
+        self.idle.fire(1060)
+        thread.join()
+        self.assertLess(time.perf_counter() - start, 1)  # 有消息时立即返回
+        self.assertEqual(result[0][0], ["您已经很久没有操作了，即将于30秒后退出"])
+
+    def test_forget(self):
+        self.user_manage.timeout(self.user.username)
+        self.assertEqual(self.idle.fire(2000), 0)
+        self.assertEqual(self.idle.stats()["scheduled"], 0)
+
+    def test_thread(self):
+        machine = self.machine
+        user_manage = UserManage("secret")
+        idle = IdleScheduler(lambda: machine, user_manage)
+        user_manage.idle = idle
+        machine.wait[0] = {1: machine.wait[0][60]}  # 缩短主菜单的Wait分支
+        user, _ = user_manage.connect()
+        idle.start()
+        idle.enroll(user)
+        self.assertEqual(idle.poll(user, 5)[0], ["您已经很久没有操作了，即将于30秒后退出"])
+        idle.stop()
+        user_manage.sessions.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
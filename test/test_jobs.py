@@ -0,0 +1,115 @@
+"""
+批量更新任务测试
+"""
+import os
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from controller import Controller
+from server.database.database import Database
+from server.state.jobs import BulkUpdateJob, main
+from server.state.state import StateMachine
+from server.user.user_manage import UserManage
+from server.util.GrammarException import GrammarException
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        self.paths = [os.path.join(current_path, "jobs.db"), os.path.join(current_path, "jobs.col"),
+                      os.path.join(current_path, "jobs_sharded.db")]
+
+    def tearDown(self):
+        for path in self.paths:
+            Database.remove(path)
+            for index in range(3):
+                Database.remove(Database.shard_path(path, index))
+
+    @staticmethod
+    def populate(db: Database, count: int) -> None:
+        for i in range(count):
+            db.create_user(f"user{i}", "pw")
+            if i % 2 == 0:
+                db.apply_update(f"user{i}", BulkUpdateJob("billing", "Set", "100").update, 100.0)
+
+    def test_backends(self):
+        machines = [
+            StateMachine(script, self.paths[0], durability="batch"),
+            StateMachine(script, self.paths[1], backend="columnar"),
+            StateMachine(script, self.paths[2], shards=3),
+        ]
+        for machine in machines:
+            db = machine.db
+            self.populate(db, 50)
+            for chunk_size in (None, 7):
+                result = BulkUpdateJob("billing", "Add", "0.5", "billing >= 100", chunk_size).run(db)
+                self.assertEqual(result["rows"], 25)
+                self.assertGreaterEqual(result["seconds"], result["max_lock_seconds"])
+            result = BulkUpdateJob("trans", "Set", "3", chunk_size=10).run(db)
+            self.assertEqual(result["rows"], 50)  # 访客用户不被更新
+            BulkUpdateJob("name", "Set", "会员", "trans = 3").run(db)
+            self.assertEqual(db.get_variables("user0"),
+                             {"username": "user0", "billing": 101.0, "name": "会员", "trans": 3})
+            self.assertEqual(db.get_variables("user1", ["billing"]), {"billing": 0.0})
+            self.assertEqual(db.get_variables("Guest", ["trans"]), {"trans": 0})
+            db.close()
+
+    def test_type_check(self):
+        StateMachine(script, None)
+        with self.assertRaises(GrammarException):
+            BulkUpdateJob("trans", "Add", "1.5")  # 整数变量
+        with self.assertRaises(GrammarException):
+            BulkUpdateJob("name", "Add", "x")  # 字符串只能Set
+        with self.assertRaises(GrammarException):
+            BulkUpdateJob("missing", "Set", "1")
+        with self.assertRaises(GrammarException):
+            BulkUpdateJob("billing", "Add", "1", "billing ~ 3")
+        with self.assertRaises(GrammarException):
+            BulkUpdateJob("billing", "Add", "1", "trans > 0.5")
+
+    def test_invalidate_sessions(self):
+        machine = StateMachine(script, self.paths[0])
+        user_manage = UserManage("secret")
+        user, _ = user_manage.connect()
+        self.assertIsNotNone(user_manage.register(user, "alice", "pw", machine.db))
+        self.assertEqual(user.state.fetch(["trans"], machine.db), {"trans": 0})
+        BulkUpdateJob("trans", "Add", "2").run(machine.db, user_manage)
+        self.assertEqual(user.state.fetch(["trans"], machine.db), {"trans": 2})  # 缓存重新载入
+
+    def test_route(self):
+        machine = StateMachine(script, self.paths[0], durability="batch")
+        user_manage = UserManage("secret")
+        controller = Controller(user_manage, machine, admin_key="admin")
+        user, _ = user_manage.connect()
+        user_manage.register(user, "alice", "pw", machine.db)
+        self.assertEqual(user.state.fetch(["billing"], machine.db), {"billing": 0.0})
+        body, status = controller.job({"key": "admin", "variable": "billing", "op": "Add", "value": "5"})
+        self.assertEqual((body["rows"], status), (1, 200))
+        self.assertEqual(user.state.fetch(["billing"], machine.db), {"billing": 5.0})  # 在线会话读到新值
+        self.assertEqual(controller.job({"key": "wrong", "variable": "billing", "op": "Add", "value": "5"})[1], 403)
+        self.assertEqual(controller.job({"key": "admin", "variable": "missing", "op": "Add", "value": "5"})[1], 400)
+        self.assertEqual(controller.job({"key": "admin", "variable": "billing"})[1], 400)
+        self.assertEqual(controller.job([])[1], 400)
+        controller.admin_key = None
+        self.assertEqual(controller.job({"key": "admin", "variable": "billing", "op": "Add", "value": "5"})[1], 404)
+        machine.db.close()
+
+    def test_cli(self):
+        machine = StateMachine(script, self.paths[0])
+        self.populate(machine.db, 20)
+        machine.db.close()
+        self.assertEqual(main([script, self.paths[0], "billing", "Sub", "1", "--where", "billing > 50",
+                               "--chunk", "4"]), 0)
+        self.assertEqual(main([script, self.paths[0], "trans", "Add", "x"]), 1)
+        machine = StateMachine(script, self.paths[0], persistent=True)
+        self.assertEqual(machine.db.get_variables("user2", ["billing"]), {"billing": 99.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
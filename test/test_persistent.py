@@ -0,0 +1,56 @@
+"""
+持久化数据库模式测试
+"""
+import unittest
+import sys
+import os
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.state.state import *
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+class TestPersistent(unittest.TestCase):
+    def test_migrate(self):
+        db_path = os.path.join(current_path, "persist.db")
+        script = os.path.join(current_path, "persist.txt")
+        with open(os.path.join(current_path, "grammar.txt"), "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            with open(script, "w", encoding="utf-8") as f:
+                f.write(text)
+            m = StateMachine(script, db_path, persistent=True)
+            self.assertEqual(m.schema_version, 1)
+            user_state = UserState()
+            user_state.register("keep", "pw", m.db)
+            UpdateAction("billing", "Add", 2.5, None).exec(user_state, [], "", m.db)
+
+            # 重启并增加一个变量，已有用户保留，新列取得默认值
+            with open(script, "w", encoding="utf-8") as f:
+                f.write(text.replace('$trans Int 0', '$trans Int 0\n    $level Int 3\n    $tag Text "it\'s"'))
+            m = StateMachine(script, db_path, persistent=True)
+            self.assertEqual(m.schema_version, 2)
+            user_state = UserState()
+            self.assertTrue(user_state.login("keep", "pw", m.db))
+            self.assertEqual(user_state.fetch(["billing", "level", "tag"], m.db),
+                             {"billing": 2.5, "level": 3, "tag": "it's"})
+            with m.db.store() as store:
+                self.assertEqual(store.execute("SELECT COUNT(*) FROM robot WHERE username = 'Guest'").get_one()[0], 1)
+
+            m = StateMachine(script, db_path, persistent=True)
+            self.assertEqual(m.schema_version, 2)  # 结构未改变，版本号不变
+
+            with open(script, "w", encoding="utf-8") as f:
+                f.write(text.replace('$trans Int 0', '$trans Text "0"'))
+            with self.assertRaises(GrammarException):  # 类型改变不自动迁移
+                StateMachine(script, db_path, persistent=True)
+        finally:
+            os.remove(script)
+            Database.remove(db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
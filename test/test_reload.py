@@ -0,0 +1,137 @@
+"""
+热重载测试
+"""
+import os
+import shutil
+import time
+import unittest
+import sys
+from threading import Event, Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from controller import Controller
+from server.database.database import Database
+from server.state.reload import ScriptReloader
+from server.state.state import StateMachine, GotoAction
+from server.user.user_manage import UserManage
+from server.util.GrammarException import GrammarException
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+class TestScriptReloader(unittest.TestCase):
+    def setUp(self):
+        self.file = os.path.join(current_path, "reload.txt")
+        shutil.copy(os.path.join(current_path, "grammar.txt"), self.file)
+        self.machine = StateMachine(self.file, None)
+        self.user_manage = UserManage("secret")
+        self.reloader = ScriptReloader(self.machine, self.user_manage)
+
+    def tearDown(self):
+        os.remove(self.file)
+
+    def read(self) -> str:
+        with open(self.file, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def edit(self, old: str, new: str) -> None:
+        text = self.read()
+        self.assertIn(old, text)
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write(text.replace(old, new))
+
+    def test_reload(self):
+        self.assertFalse(self.reloader.reload())
+        self.edit('Speak: "请输入您的建议，不超过200个字符"', 'Speak: "请输入您的建议"')
+        self.edit('Speak: "感谢您的建议"\n        Exit', 'Speak: "感谢您的建议"\n        Goto Survey')
+        self.edit('State: Rename', 'State: Survey\n    Speak: "请为我们打分"\n    Default:\n        Goto Begin\n\nState: Rename')
+        self.assertTrue(self.reloader.reload())
+
+        old, new = self.machine, self.reloader.machine
+        complain = old.state_map["Complain"]
+        self.assertEqual(new.state_map["Complain"], complain)  # 已有状态编号不变
+        self.assertEqual(new.state_map["Survey"], len(old.states))
+        self.assertEqual(repr(old.speak_action[complain]), '[Speak "请输入您的建议，不超过200个字符"]')
+        self.assertEqual(repr(new.speak_action[complain]), '[Speak "请输入您的建议"]')
+        self.assertEqual(repr(new.service[complain][1]), 'Length <= 200: Speak "感谢您的建议"; Goto 5')
+        self.assertIs(new.service[0], old.service[0])  # 未改变的状态不重新构建
+        self.assertEqual(self.reloader.referrers["Survey"], {"Complain"})
+
+    def test_remove(self):
+        user, _ = self.user_manage.connect()
+        user.state.state = self.machine.state_map["Complain"]
+        self.edit('        Goto Complain\n', '        Exit\n')
+        text = self.read()
+        start = text.index("State: Complain")
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write(text[:start] + text[text.index("State: Rename"):])
+        self.assertTrue(self.reloader.reload())
+        self.assertNotIn("Complain", self.reloader.machine.state_map)
+        self.assertEqual(user.state.state, 0)  # 处于被删除状态的用户回到起始状态
+
+    def test_interleave(self):
+        path = os.path.join(current_path, "reload.db")
+        self.machine = StateMachine(self.file, path)  # 问候语读取变量，需要数据库
+        self.reloader = ScriptReloader(self.machine, self.user_manage)
+        controller = Controller(self.user_manage, self.machine, self.reloader)
+        token = controller.connect()[0]["token"]
+        entered, release = Event(), Event()
+        transform = self.machine.state_transform
+
+        def blocking(user_state, msg):  # 请求已经取得原状态机，尚未读取用户的状态
+            entered.set()
+            release.wait(5)
+            return transform(user_state, msg)
+
+        self.machine.state_transform = blocking
+        results = {}
+        first = Thread(target=lambda: results.setdefault("old", controller.send({"msg": "你好", "token": token})))
+        first.start()
+        self.assertTrue(entered.wait(5))
+        self.edit('    Service: "退出"\n        Exit', '    Service: "调查"\n        Goto Survey\n    Service: "退出"\n        Exit')
+        self.edit('State: Rename', 'State: Survey\n    Speak: "请为我们打分"\n    Default:\n        Goto Begin\n\nState: Rename')
+        self.assertTrue(self.reloader.reload())
+        del self.reloader.machine.state_transform  # 新状态机复制了替换的方法
+        second = Thread(target=lambda: results.setdefault("new", controller.send({"msg": "调查", "token": token})))
+        second.start()
+        time.sleep(0.05)
+        self.assertNotIn("new", results)  # 同一会话的请求等待原状态机上的请求完成
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(results["old"][1], 200)
+        self.assertEqual(results["new"], ({"msg": ["请为我们打分"], "exit": False}, 200))
+        user = self.user_manage.users.get(self.user_manage.jwt_decode(token).username)
+        self.assertEqual(user.state.state, self.reloader.machine.state_map["Survey"])
+        self.user_manage.sessions.stop()
+        self.machine.db.close()
+        Database.remove(path)
+
+    def test_logined(self):
+        self.edit("State: Complain", "State: Complain Logined")
+        self.assertTrue(self.reloader.reload())
+        machine = self.reloader.machine
+        goto = [action for action in machine.service[0][2].actions if isinstance(action, GotoAction)]
+        self.assertTrue(goto[0].logined)  # 转移到该状态的Goto动作随之更新
+        self.assertFalse(self.machine.service[0][2].actions[0].logined)
+
+    def test_error(self):
+        text = self.read()
+        start = text.index("State: Complain")
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write(text[:start] + text[text.index("State: Rename"):])
+        with self.assertRaises(GrammarException):  # Begin 仍然转移到被删除的状态
+            self.reloader.reload()
+        self.assertIs(self.reloader.machine, self.machine)
+
+        shutil.copy(os.path.join(current_path, "grammar.txt"), self.file)
+        self.edit('$trans Int 0', '$trans Int 1')
+        with self.assertRaises(GrammarException):
+            self.reloader.reload()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+分段会话表测试
+"""
+import os
+import unittest
+import sys
+from threading import Thread
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.sessions import SessionTable
+from server.user.user_manage import UserManage
+from test_benchmark_memory import BUDGET, measure
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class TestSessionTable(unittest.TestCase):
+    def test_table(self):
+        table = SessionTable(4)
+        self.assertTrue(table.add("a", 1))
+        self.assertFalse(table.add("a", 2))
+        self.assertTrue(table.add("b", 3))
+        self.assertIsNone(table.move("a", "b"))  # 新用户名已经存在
+        self.assertEqual(table.move("a", "c"), 1)
+        self.assertNotIn("a", table)
+        self.assertEqual(table.get("c"), 1)
+        self.assertIsNone(table.move("a", "d"))  # 原用户名不存在
+        self.assertEqual(sorted(table), ["b", "c"])
+        self.assertEqual(table.pop("b"), 3)
+        self.assertEqual(len(table), 1)
+
+    def test_concurrent_move(self):
+        table = SessionTable(8)
+        for i in range(64):
+            table.add(f"guest{i}", i)
+
+        def work(i: int) -> None:
+            for _ in range(500):  # 8个线程争用同一个新用户名，在两个段之间来回移动
+                if table.move(f"guest{i}", f"user{i % 8}") is not None:
+                    table.move(f"user{i % 8}", f"guest{i}")
+
+        threads = [Thread(target=work, args=(i,)) for i in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(table), 64)  # 移动不会丢失或者复制用户
+        self.assertEqual(sorted(table.values()), list(range(64)))
+
+
+class TestUserManage(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "sessions.db")
+        self.machine = StateMachine(script, self.db_path)
+        self.machine.db.create_user("alice", "pw")
+
+    def tearDown(self):
+        Database.remove(self.db_path)
+
+    def test_login_race(self):
+        user_manage = UserManage("secret", shards=4)
+        users = [user_manage.connect()[0] for _ in range(16)]
+        tokens = []
+        threads = [Thread(target=lambda user=user: tokens.append(
+            user_manage.login(user, "alice", "pw", self.machine.db))) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len([token for token in tokens if token is not None]), 1)  # 只有一个会话登录成功
+        self.assertEqual(len(user_manage.users), 16)
+        logined = [user for user in users if user.state.have_login]
+        self.assertEqual(len(logined), 1)
+        self.assertIs(user_manage.users.get("alice"), logined[0])
+        for user in users:
+            if user is not logined[0]:
+                self.assertEqual(user.state.username, "Guest")
+                self.assertIs(user_manage.users.get(user.username), user)
+        user_manage.sessions.stop()
+
+    def test_memory_budget(self):
+        self.assertLess(measure(10000), BUDGET)  # 每个会话的内存超过预算时失败
+
+
+if __name__ == '__main__':
+    unittest.main()
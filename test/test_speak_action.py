@@ -9,6 +9,8 @@ current_path = os.path.split(os.path.realpath(__file__))[0]
 curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(curPath)[0]
 sys.path.append(rootPath)
+from storm.locals import Store
+from storm.properties import Unicode, Int, Float
 from server.state.state import *
 
 
@@ -38,7 +40,22 @@ class TestSpeakAction(unittest.TestCase):
         with self.assertRaises(GrammarException):
             SpeakAction(["$vvv"])
 
-        os.remove(os.path.join(current_path, "dsl.db"))
+        action = SpeakAction(["\"余额：\"", "\"元\"", "$test2", "$test1", "$test2"])
+        self.assertEqual(action.template, [(SpeakAction.LITERAL, "余额：元"), (SpeakAction.VARIABLE, "test2"),
+                                           (SpeakAction.VARIABLE, "test1"), (SpeakAction.VARIABLE, "test2")])
+        self.assertEqual(action.variables, ("test2", "test1"))
+        fetched = []
+        fetch = UserState.fetch
+        UserState.fetch = lambda state, names, database: fetched.append(names) or fetch(state, names, database)
+        try:
+            result = []
+            action.exec(user_state, result, "", db)
+            self.assertEqual(["余额：元0.000.0"], result)
+            self.assertEqual(fetched, [("test2", "test1")])  # 一次取出全部变量
+        finally:
+            UserState.fetch = fetch
+
+        Database.remove(os.path.join(current_path, "dsl.db"))
 
 
 if __name__ == '__main__':
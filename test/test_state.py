@@ -8,6 +8,7 @@ curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(curPath)[0]
 sys.path.append(rootPath)
 
+from storm.locals import Store
 from server.state.state import *
 from server.util.LoginExcepiton import LoginException
 
@@ -40,6 +41,7 @@ class TestStateMachine(unittest.TestCase):
             self.assertEqual(line, repr(m.default))
             line = f.readline().strip()
             self.assertEqual(line, repr(m.wait))
+        self.assertEqual(m.speak_vars[1], ("name", "billing", "transactions"))
 
         user_state = UserState()
 
@@ -61,7 +63,7 @@ class TestStateMachine(unittest.TestCase):
         self.assertEqual(result, (["test1Test1.00"], False, True))
         self.assertEqual(user_state.state, 1)
 
-        os.remove(os.path.join(current_path, "../dsl.db"))
+        Database.remove(os.path.join(current_path, "../dsl.db"))
 
 
 if __name__ == '__main__':
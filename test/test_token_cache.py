@@ -0,0 +1,77 @@
+"""
+令牌缓存测试
+"""
+import os
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+import jwt
+
+from server.database.database import Database
+from server.state.state import StateMachine
+from server.user.token_cache import TokenCache
+from server.user.user_manage import UserManage
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+script = os.path.join(current_path, "grammar.txt")
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_lru(self):
+        cache = TokenCache(2)
+        cache.put("t1", "a")
+        cache.put("t2", "b")
+        self.assertEqual(cache.get("t1"), "a")  # t1 成为最近使用的
+        cache.put("t3", "c")
+        self.assertIsNone(cache.get("t2"))  # 淘汰最久未使用的 t2
+        self.assertEqual(cache.get("t3"), "c")
+        cache.put("t4", "a")  # 同一用户名的新令牌替换旧令牌
+        self.assertIsNone(cache.get("t1"))
+        cache.discard("c")
+        self.assertIsNone(cache.get("t3"))
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 3, "ratio": 0.4, "size": 1, "evictions": 1})
+
+
+class TestUserManage(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(current_path, "token.db")
+        self.machine = StateMachine(script, self.db_path)
+        self.machine.db.create_user("alice", "pw")
+        self.user_manage = UserManage("secret")
+
+    def tearDown(self):
+        self.user_manage.sessions.stop()
+        Database.remove(self.db_path)
+
+    def test_hit(self):
+        user, token = self.user_manage.connect()
+        for _ in range(10):
+            self.assertIs(self.user_manage.jwt_decode(token), user)
+        stats = self.user_manage.token_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (9, 1))
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"))  # 签名错误
+
+    def test_revoke(self):
+        user, guest_token = self.user_manage.connect()
+        self.user_manage.jwt_decode(guest_token)
+        token = self.user_manage.login(user, "alice", "pw", self.machine.db)
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(guest_token)  # 登录后原令牌失效
+        self.assertIs(self.user_manage.jwt_decode(token), user)
+        self.assertIs(self.user_manage.jwt_decode(token), user)
+        self.user_manage.timeout("alice")
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.user_manage.jwt_decode(token)  # 会话结束后令牌失效
+        self.assertEqual(self.user_manage.token_stats()["size"], 0)
+        other, _ = self.user_manage.connect()
+        self.assertEqual(self.user_manage.login(other, "alice", "pw", self.machine.db), token)
+        self.assertIs(self.user_manage.jwt_decode(token), other)  # 重新登录后同一令牌属于新会话
+
+
+if __name__ == '__main__':
+    unittest.main()
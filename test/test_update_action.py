@@ -43,6 +43,7 @@ class TestUpdateAction(unittest.TestCase):
         store.close()
 
         action = UpdateAction("test1", "Add", 1, "Int")
+        self.assertEqual(action.statement, "UPDATE robot SET test1 = test1 + ? WHERE username = ?")
         action.exec(user_state, [], "", db)
         store = Store(db.database)
         self.assertEqual(store.get(VariableSet, "test").test1, 2)
@@ -55,6 +56,7 @@ class TestUpdateAction(unittest.TestCase):
         store.close()
 
         action = UpdateAction("test2", "Set", "Input", "Real")
+        self.assertEqual(action.statement, "UPDATE robot SET test2 = ? WHERE username = ?")
         action.exec(user_state, [], "2.2", db)
         store = Store(db.database)
         self.assertEqual(store.get(VariableSet, "test").test2, 2.2)
@@ -71,6 +73,8 @@ class TestUpdateAction(unittest.TestCase):
         store = Store(db.database)
         self.assertEqual(store.get(VariableSet, "test").test3, "testing")
         store.close()
+        # 缓存与数据库保持一致
+        self.assertEqual(user_state.cache, {"username": "test", "test1": 2, "test2": 2.2, "test3": "testing"})
 
         with self.assertRaises(GrammarException):
             UpdateAction("test1", "Set", "Input", "Text")
@@ -89,7 +93,7 @@ class TestUpdateAction(unittest.TestCase):
         with self.assertRaises(GrammarException):
             UpdateAction("test4", "Set", "", None)
 
-        os.remove(os.path.join(current_path, "dsl.db"))
+        Database.remove(os.path.join(current_path, "dsl.db"))
 
 
 if __name__ == '__main__':
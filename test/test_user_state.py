@@ -9,6 +9,7 @@ curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(curPath)[0]
 sys.path.append(rootPath)
 
+from storm.locals import Store
 from server.state.state import *
 from server.database.database import Database
 from server.util.LoginExcepiton import LoginException
@@ -27,7 +28,7 @@ class TestDatabase(unittest.TestCase):
         store.close()
 
     def tearDown(self):
-        os.remove(os.path.join(current_path, "dsl.db"))
+        Database.remove(os.path.join(current_path, "dsl.db"))
 
 
 class TestUserState(TestDatabase):
@@ -47,6 +48,28 @@ class TestUserState(TestDatabase):
         self.assertEqual(user_state.username, "test2", db)
         self.assertTrue(user_state.have_login)
 
+    def test_cache(self):
+        user_state = UserState()
+        self.assertIsNone(user_state.cache)  # 访客不缓存
+        user_state.register("test3", "test3", db)
+        self.assertEqual(user_state.cache, {"username": "test3"})
+        stats = UserState.cache_stats()
+        self.assertEqual(user_state.fetch(["username"], db), {"username": "test3"})
+        self.assertEqual(UserState.cache_stats()["hits"], stats["hits"] + 1)
+        self.assertEqual(UserState.cache_stats()["misses"], stats["misses"])
+
+        user_state.cached("username", "changed")
+        self.assertEqual(user_state.fetch(["username"], db), {"username": "changed"})
+        user_state.invalidate()
+        self.assertIsNone(user_state.cache)
+        self.assertEqual(user_state.fetch(["username"], db), {"username": "test3"})
+        self.assertEqual(UserState.cache_stats()["misses"], stats["misses"] + 1)
+        self.assertEqual(user_state.cache, {"username": "test3"})  # 未命中时重新载入
+
+        user_state = UserState()
+        user_state.login("test3", "test3", db)
+        self.assertEqual(user_state.cache, {"username": "test3"})
+
 
 class TestLengthJudgement(unittest.TestCase):
     def test_check(self):
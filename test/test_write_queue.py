@@ -0,0 +1,137 @@
+"""
+延迟写入队列测试
+"""
+import os
+import sqlite3
+import time
+import unittest
+import sys
+
+curPath = os.path.abspath(os.path.dirname(__file__))
+rootPath = os.path.split(curPath)[0]
+sys.path.append(rootPath)
+
+from storm.store import Store
+from server.database.database import Database
+from server.state.action import UpdateAction
+from server.user.user_state import UserState, VariableSet
+
+current_path = os.path.split(os.path.realpath(__file__))[0]
+
+
+def insert(value: int):
+    return lambda store: store.execute("INSERT INTO log VALUES (?)", (value,))
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(current_path, "queue.db")
+        self.db = Database(self.path, "batch", batch_size=8, max_delay=0.05)
+        store = Store(self.db.database)
+        store.execute("CREATE TABLE log (value INTEGER)")
+        store.commit()
+        store.close()
+
+    def tearDown(self):
+        self.db.queue.close()
+        Database.remove(self.path)
+
+    def count(self) -> int:
+        store = Store(self.db.database)
+        result = store.execute("SELECT COUNT(*) FROM log").get_one()[0]
+        store.close()
+        return result
+
+    def test_batch_size(self):
+        for i in range(20):
+            self.db.queue.submit(insert(i))
+        self.db.flush()
+        self.assertEqual(self.count(), 20)
+        self.assertEqual(self.db.queue.batches, 3)  # 8 + 8 + 4
+
+    def test_max_delay(self):
+        self.db.queue.submit(insert(1))
+        deadline = time.monotonic() + 1
+        while self.db.queue.pending() != 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.db.queue.pending(), 0)  # 不足一批时在丢失窗口内提交
+        self.assertEqual(self.count(), 1)
+
+    def test_error(self):
+        self.db.queue.submit(insert(1))
+        self.db.queue.submit(lambda store: store.execute("INSERT INTO missing VALUES (1)"))
+        self.db.queue.submit(insert(2))
+        self.db.flush()
+        self.assertEqual(self.db.queue.errors, 1)
+        self.assertEqual(self.count(), 2)
+
+    def test_locked(self):
+        db = Database(os.path.join(current_path, "locked.db"), "batch", busy_timeout=0.05)
+        with db.store() as store:
+            store.execute("CREATE TABLE log (value INTEGER)")
+        holder = sqlite3.connect(os.path.join(current_path, "locked.db"), isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")  # 另一个连接一直持有写锁
+        db.queue.submit(insert(1))
+        db.flush()  # 重试失败后返回，不会永久阻塞
+        self.assertEqual(len(db.queue.failed), 1)
+        self.assertEqual(db.queue.errors, 1)
+        holder.execute("ROLLBACK")
+        holder.close()
+        db.queue.submit(db.queue.failed.pop())  # 写线程仍然运行，可以重新提交
+        db.flush()
+        with db.store() as store:
+            self.assertEqual(store.execute("SELECT COUNT(*) FROM log").get_one()[0], 1)
+        db.close()
+        Database.remove(os.path.join(current_path, "locked.db"))
+
+    def test_close(self):
+        for i in range(5):
+            self.db.queue.submit(insert(i))
+        self.db.queue.close()
+        self.assertEqual(self.count(), 5)
+        self.db.queue.close()
+
+    def test_durability(self):
+        with self.assertRaises(ValueError):
+            Database(os.path.join(current_path, "unknown.db"), "never")
+
+
+class TestBatchUpdate(unittest.TestCase):
+    def test_exec(self):
+        path = os.path.join(current_path, "batch.db")
+        db = Database(path, "batch", max_delay=10)
+        VariableSet.define("money", "Int", 0)
+        store = Store(db.database)
+        store.execute("CREATE TABLE robot (username TEXT PRIMARY KEY, password TEXT, money INTEGER)")
+        store.add(VariableSet("Guest", ""))
+        store.commit()
+        store.close()
+
+        user_state = UserState()
+        user_state.register("batch", "", db)
+        for _ in range(10):
+            UpdateAction("money", "Add", 3, None).exec(user_state, [], "", db)
+        UpdateAction("money", "Sub", "Input", "Int").exec(user_state, [], "5", db)
+        self.assertEqual(user_state.fetch(["money"], db), {"money": 25})  # 缓存立即可见
+        self.assertEqual(db.queue.pending(), 11)
+        self.assertEqual(UserState().fetch(["money"], db), {"money": 0})  # 访客读取不提交其他用户的更新
+        other = UserState()
+        other.register("other", "", db)
+        other.invalidate()
+        self.assertEqual(other.fetch(["money"], db), {"money": 0})  # 读取其他用户不提交队列
+        self.assertEqual(db.queue.pending(), 11)
+        self.assertEqual(db.queue.batches, 0)
+        guest = UserState()
+        UpdateAction("money", "Add", 7, None).exec(guest, [], "", db)
+        self.assertEqual(guest.fetch(["money"], db), {"money": 7})  # 未缓存时读取前先提交队列
+        self.assertEqual(db.queue.pending(), 0)
+        self.assertEqual(db.queue.batches, 1)
+        store = Store(db.database)
+        self.assertEqual(store.get(VariableSet, "batch").money, 25)
+        store.close()
+        db.queue.close()
+        Database.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()